@@ -1,11 +1,190 @@
 import asyncio
+import logging
 
 from datetime import datetime
-from pyairtable import Table
-from pyairtable.formulas import match
+from bot import constants
+from bot.common.metrics import instrument_airtable
+from bot.common.tracing import traced
 from bot.config import AIRTABLE_BASE, AIRTABLE_KEY
 
+logger = logging.getLogger(__name__)
 
+
+# pyairtable pulls in requests, which is slow to import, and is only
+# needed once the first record is read or written
+def Table(api_key, base_id, table_name):
+    from pyairtable import Table
+
+    return instrument_airtable(Table(api_key, base_id, table_name))
+
+
+def match(dict_values):
+    from pyairtable.formulas import match
+
+    return match(dict_values)
+
+
+# The most records Airtable accepts in a single create or update request
+BATCH_SIZE = 10
+
+
+def chunks(records, size=BATCH_SIZE):
+    for i in range(0, len(records), size):
+        yield records[i : i + size]
+
+
+@traced("airtable.batch_update")
+async def batch_update(table_name, records, base_id=AIRTABLE_BASE):
+
+    """Update records with one request per BATCH_SIZE records.
+
+    Each record is a dict with the id and the fields to set."""
+
+    loop = asyncio.get_running_loop()
+
+    def _batch_update():
+        table = Table(AIRTABLE_KEY, base_id, table_name)
+        updated = []
+        for chunk in chunks(records):
+            updated += table.batch_update(chunk)
+        return updated
+
+    return await loop.run_in_executor(None, _batch_update)
+
+
+@traced("airtable.batch_create")
+async def batch_create(table_name, records, base_id=AIRTABLE_BASE):
+
+    """Create records from dicts of their fields with one request
+    per BATCH_SIZE records, returns the created records in order."""
+
+    loop = asyncio.get_running_loop()
+
+    def _batch_create():
+        table = Table(AIRTABLE_KEY, base_id, table_name)
+        created = []
+        for chunk in chunks(records):
+            created += table.batch_create(chunk)
+        return created
+
+    return await loop.run_in_executor(None, _batch_create)
+
+
+class RecordBatcher:
+    """Collects record writes to a table and sends them in batches
+
+    A write waits until BATCH_SIZE writes to the table are pending or
+    max_delay seconds passed since the first of them, and then all of
+    them go out in a single request. Updates of a record that is
+    already pending are merged into it, as are creates with the same
+    key. Every caller gets its record back or the exception of the
+    request that carried it.
+
+    Args:
+      table_name: The table the records are written to
+      max_delay: Seconds a write waits for others to join its batch
+      base_id: The base the table is in
+
+    Attributes:
+      requests: The number of requests made
+    """
+
+    def __init__(self, table_name, max_delay, base_id=AIRTABLE_BASE):
+        self.table_name = table_name
+        self.max_delay = max_delay
+        self.base_id = base_id
+        self.requests = 0
+        self._updates = {}
+        self._creates = []
+        self._create_keys = {}
+        self._timers = {}
+        # Created on first use, so they belong to the loop that runs
+        self._sending = {}
+
+    async def update(self, record_id, fields):
+        pending = self._updates.get(record_id)
+        if pending is None:
+            pending = self._updates[record_id] = (
+                {},
+                asyncio.get_running_loop().create_future(),
+            )
+        pending[0].update(fields)
+        self._schedule("update", len(self._updates))
+        return await asyncio.shield(pending[1])
+
+    async def create(self, fields, key=None):
+        """Create a record, unless one with the same key is pending"""
+        future = self._create_keys.get(key) if key is not None else None
+        if future is None:
+            future = asyncio.get_running_loop().create_future()
+            self._creates.append((fields, future))
+            if key is not None:
+                self._create_keys[key] = future
+            self._schedule("create", len(self._creates))
+        return await asyncio.shield(future)
+
+    async def flush(self):
+        """Send every pending write now"""
+        await asyncio.gather(self._flush("update"), self._flush("create"))
+
+    def _schedule(self, kind, pending):
+        if pending >= BATCH_SIZE:
+            asyncio.ensure_future(self._flush(kind))
+        elif kind not in self._timers:
+            self._timers[kind] = asyncio.get_running_loop().call_later(
+                self.max_delay, lambda: asyncio.ensure_future(self._flush(kind))
+            )
+
+    async def _flush(self, kind):
+        timer = self._timers.pop(kind, None)
+        if timer is not None:
+            timer.cancel()
+        if kind == "update":
+            updates, self._updates = self._updates, {}
+            records = [
+                {"id": record_id, "fields": fields}
+                for record_id, (fields, _) in updates.items()
+            ]
+            futures = [future for _, future in updates.values()]
+            send = batch_update
+        else:
+            creates, self._creates = self._creates, []
+            self._create_keys = {}
+            records = [fields for fields, _ in creates]
+            futures = [future for _, future in creates]
+            send = batch_create
+        if not records:
+            return
+        # Batches go out one at a time so a later update of a record
+        # never overtakes an earlier one
+        try:
+            lock = self._sending.get(kind)
+            if lock is None:
+                lock = self._sending[kind] = asyncio.Lock()
+            async with lock:
+                self.requests += 1
+                results = await send(self.table_name, records, self.base_id)
+        except Exception as e:
+            logger.exception(f"Failed to {kind} {len(records)} {self.table_name}")
+            for future in futures:
+                future.set_exception(e)
+            return
+        for future, result in zip(futures, results):
+            future.set_result(result)
+
+
+# Records linking a user to each contribution of the guild's
+# contribution flow they reached
+PROGRESS_TABLE = "Contribution Progress"
+
+user_updates = RecordBatcher("Users", max_delay=constants.Airtable.batch_delay)
+member_updates = RecordBatcher("Members", max_delay=constants.Airtable.batch_delay)
+progress_creates = RecordBatcher(
+    PROGRESS_TABLE, max_delay=constants.Airtable.batch_delay
+)
+
+
+@traced("airtable.find_user")
 async def find_user(user_id, guild_id):
 
     """Return airtable record number in users table given user_id and guild_id."""
@@ -26,6 +205,7 @@ async def find_user(user_id, guild_id):
     return await loop.run_in_executor(None, _find_user)
 
 
+@traced("airtable.get_user_record")
 async def get_user_record(user_id, guild_id):
 
     """Return airtable record number in users table given user_id and guild_id."""
@@ -46,6 +226,7 @@ async def get_user_record(user_id, guild_id):
     return await loop.run_in_executor(None, _find_user)
 
 
+@traced("airtable.get_contribution_records")
 async def get_contribution_records(guild_id):
 
     """"""
@@ -64,30 +245,21 @@ async def get_contribution_records(guild_id):
     return await loop.run_in_executor(None, _get_contribution)
 
 
-async def get_highest_contribution_records(guild_id, user_id, total):
+@traced("airtable.get_guild_progress")
+async def get_guild_progress(guild_id):
 
-    """"""
+    """Return every Contribution Progress record of a guild."""
 
     loop = asyncio.get_running_loop()
 
-    def _get_contribution():
-        table = Table(AIRTABLE_KEY, AIRTABLE_BASE, "Contribution Flow")
-        records = table.all(
-            formula=match(
-                {
-                    "guilds": str(guild_id),
-                    "users": str(f"{guild_id}_{user_id}"),
-                    "order": total,
-                }
-            )
+    def _get_progress():
+        table = Table(AIRTABLE_KEY, AIRTABLE_BASE, PROGRESS_TABLE)
+        return table.all(
+            formula=match({"guild_id": str(guild_id)}),
+            fields=["discord_id", "order"],
         )
-        if records:
-            record_id = records[0]
-        else:
-            record_id = None
-        return record_id
 
-    return await loop.run_in_executor(None, _get_contribution)
+    return await loop.run_in_executor(None, _get_progress)
 
 
 # cannot use in async
@@ -103,6 +275,7 @@ def find_discord(user_id):
     return record_id
 
 
+@traced("airtable.get_discord_record")
 async def get_discord_record(user_id):
 
     """Return airtable record number in global table given user_id."""
@@ -119,6 +292,7 @@ async def get_discord_record(user_id):
     return await loop.run_in_executor(None, _get_discord_record)
 
 
+@traced("airtable.find_guild")
 async def find_guild(guild_id):
 
     """Return airtable record number in guild table given guild_id."""
@@ -137,6 +311,7 @@ async def find_guild(guild_id):
     return await loop.run_in_executor(None, _find_guild)
 
 
+@traced("airtable.get_guild_by_guild_id")
 async def get_guild_by_guild_id(guild_id):
 
     """Return airtable record number in guild table given guild_id."""
@@ -155,6 +330,21 @@ async def get_guild_by_guild_id(guild_id):
     return await loop.run_in_executor(None, _find_guild)
 
 
+@traced("airtable.get_guilds")
+async def get_guilds():
+
+    """Return every record in the guild table."""
+
+    loop = asyncio.get_running_loop()
+
+    def _get_guilds():
+        table = Table(AIRTABLE_KEY, AIRTABLE_BASE, "guilds")
+        return table.all()
+
+    return await loop.run_in_executor(None, _get_guilds)
+
+
+@traced("airtable.get_guild")
 async def get_guild(record_id):
 
     """Return airtable record number in guild table given guild_id."""
@@ -172,6 +362,7 @@ async def get_guild(record_id):
     return await loop.run_in_executor(None, _find_guild)
 
 
+@traced("airtable.get_contribution_count")
 async def get_contribution_count(user_id, base_id):
 
     """Get a count of contributions a user has made to a given guild"""
@@ -196,6 +387,7 @@ async def get_contribution_count(user_id, base_id):
     return await loop.run_in_executor(None, _count)
 
 
+@traced("airtable.get_contributions")
 async def get_contributions(global_id, date):
 
     """Get a count of contributions a user has made to a given guild"""
@@ -222,70 +414,76 @@ async def get_contributions(global_id, date):
     return await loop.run_in_executor(None, _contributions)
 
 
-async def update_user(record_id, id_field, id_val):
+@traced("airtable.find_progress")
+async def find_progress(guild_id, user_id, order):
 
-    """Add or update user ID info given ID field, value,
-    and user table airtable record number."""
+    """Return the Contribution Progress record of a user and order, if any."""
 
     loop = asyncio.get_running_loop()
 
-    def _update_user():
-        table = Table(AIRTABLE_KEY, AIRTABLE_BASE, "Users")
-        table.update(record_id, {id_field: id_val})
-
-    return await loop.run_in_executor(None, _update_user)
-
-
-async def update_member(record_id, id_field, id_val):
-
-    """Add or update member ID given ID field, value,
-    and member table airtable record number."""
-
-    loop = asyncio.get_running_loop()
+    def _find_progress():
+        table = Table(AIRTABLE_KEY, AIRTABLE_BASE, PROGRESS_TABLE)
+        records = table.all(
+            formula=match(
+                {"guild_id": str(guild_id), "discord_id": str(user_id), "order": order}
+            ),
+            max_records=1,
+        )
+        return records[0] if records else None
 
-    def _update_member():
-        table = Table(AIRTABLE_KEY, AIRTABLE_BASE, "Members")
-        table.update(record_id, {id_field: id_val})
+    return await loop.run_in_executor(None, _find_progress)
 
-    return await loop.run_in_executor(None, _update_member)
 
+@traced("airtable.add_user_to_contribution")
+async def add_user_to_contribution(guild_id, user_id, order, contribution_id=None):
 
-async def add_user_to_contribution(guild_id, user_id, order):
+    """Record that a user reached the contribution with the given order.
 
-    """Add or update user ID info given ID field, value,
-    and user table airtable record number."""
+    Progress is a record of its own in the Contribution Progress table
+    linking the Users and Contribution Flow records, so recording it
+    is a single create no matter how many users reached the
+    contribution and concurrent users cannot overwrite each other.
+    Progress that was already recorded is returned as it is, so a
+    repeated or retried call does not add a second record."""
 
     loop = asyncio.get_running_loop()
 
-    def _update_user():
+    def _find_contribution():
         table = Table(AIRTABLE_KEY, AIRTABLE_BASE, "Contribution Flow")
-        records = table.all(formula=match({"guilds": str(guild_id), "order": order}))
-        record = records[0]
-
-        table = Table(AIRTABLE_KEY, AIRTABLE_BASE, "Users")
-        user = table.all(
-            formula=match({"discord_id": str(user_id), "guild_id": str(guild_id)})
-        )
-        user_fields = user[0]
-        user_record_id = user_fields.get("id")
-
-        record_id = record.get("id")
-
-        table.update(
-            record_id,
-            {
-                "users": list(
-                    {
-                        user_record_id,
-                        *record.get("fields", {"users": []}).get("users", []),
-                    }
-                )
-            },
+        records = table.all(
+            formula=match({"guilds": str(guild_id), "order": order}), max_records=1
         )
-
-    return await loop.run_in_executor(None, _update_user)
-
-
+        if not records:
+            raise Exception(f"No contribution {order} in guild {guild_id}")
+        return records[0].get("id")
+
+    existing = await find_progress(guild_id, user_id, order)
+    if existing is not None:
+        return existing
+    if contribution_id is None:
+        contribution_id = await loop.run_in_executor(None, _find_contribution)
+    user_record_id = await find_user(user_id, guild_id)
+    if not user_record_id:
+        raise Exception(f"No Airtable record of user {user_id} in guild {guild_id}")
+    return await progress_creates.create(
+        build_progress_fields(
+            guild_id, user_id, order, contribution_id, user_record_id
+        ),
+        key=(str(guild_id), str(user_id), order),
+    )
+
+
+def build_progress_fields(guild_id, user_id, order, contribution_id, user_record_id):
+    return {
+        "contribution": [contribution_id],
+        "user": [user_record_id],
+        "guild_id": str(guild_id),
+        "discord_id": str(user_id),
+        "order": order,
+    }
+
+
+@traced("airtable.create_user")
 async def create_user(user_id, guild_id):
 
     """Return new airtable record # in users table given user_id & guild_id.
@@ -1,4 +1,11 @@
 import discord
 
-intents = discord.Intents.all()
-bot = discord.Bot(intents=intents)
+from bot import constants
+from bot.common.bot.gateway import build_client_options, record_gateway
+from bot.common.metrics import instrument_discord
+from bot.common.tracing import trace_discord
+
+bot = trace_discord(instrument_discord(discord.Bot(**build_client_options())))
+
+if constants.Gateway.record_path:
+    record_gateway(bot, constants.Gateway.record_path)
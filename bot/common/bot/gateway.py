@@ -0,0 +1,84 @@
+import json
+import logging
+
+from distutils.util import strtobool
+
+import discord
+
+from bot import constants
+
+logger = logging.getLogger(__name__)
+
+# The intents each feature of the bot relies on. Slash commands and the
+# guild and channel lookups need guilds, conversations happen in DMs.
+FEATURE_INTENTS = {
+    "commands": ("guilds",),
+    "conversations": ("dm_messages", "dm_reactions"),
+}
+
+
+def build_intents(features, extra_intents=(), all_intents=False):
+    """The gateway intents the given features need
+
+    Args:
+      features: Names of the features the bot runs, see FEATURE_INTENTS
+      extra_intents: Names of intents to enable on top of those
+      all_intents: Whether to enable every intent instead
+
+    Returns:
+      A discord.Intents
+    """
+    if all_intents:
+        return discord.Intents.all()
+    intents = discord.Intents.none()
+    for feature in features:
+        if feature not in FEATURE_INTENTS:
+            raise Exception(f"Unknown gateway feature {feature}")
+        for name in FEATURE_INTENTS[feature]:
+            setattr(intents, name, True)
+    for name in extra_intents:
+        if name not in discord.Intents.VALID_FLAGS:
+            raise Exception(f"Unknown gateway intent {name}")
+        setattr(intents, name, True)
+    return intents
+
+
+def build_client_options():
+    """The discord client options selected by the gateway config"""
+    settings = constants.Gateway
+    intents = build_intents(
+        settings.features,
+        settings.extra_intents,
+        bool(strtobool(settings.all_intents)),
+    )
+    options = {
+        "intents": intents,
+        # Only keep members we were told about through an intent, the
+        # bot's own member is always kept
+        "member_cache_flags": discord.MemberCacheFlags.from_intents(intents),
+        "chunk_guilds_at_startup": intents.members,
+        "max_messages": settings.max_messages,
+    }
+    if settings.record_path:
+        options["enable_debug_events"] = True
+    return options
+
+
+def record_gateway(bot, path):
+    """Append every gateway dispatch the bot receives to a file
+
+    Each line holds the json of one event with its name in ``t`` and
+    payload in ``d``, which is what scripts/bench_gateway.py replays.
+    """
+    logger.warning(f"Recording gateway events to {path}")
+
+    async def on_socket_raw_receive(msg):
+        if isinstance(msg, bytes):
+            msg = msg.decode()
+        event = json.loads(msg)
+        if event.get("op") != 0:
+            return
+        with open(path, "a") as f:
+            f.write(json.dumps({"t": event["t"], "d": event["d"]}) + "\n")
+
+    bot.add_listener(on_socket_raw_receive)
@@ -1,9 +1,59 @@
+import asyncio
+import logging
+import time
+import uuid
+
 from abc import ABC, abstractmethod
+from collections import OrderedDict
+
+from bot import constants
+from bot.common.keys import build_version_key
 from bot.config import Redis
 
+logger = logging.getLogger(__name__)
+
+
+class Batch:
+    """Cache operations queued to be run together
+
+    Operations are queued with the same methods as on the cache and
+    run by ``execute``, which returns their results in the order they
+    were queued. This runs them one after the other, caches that can
+    send several commands in one round trip override ``Cache.batch``.
+
+    Args:
+      cache: The cache the operations run against
+    """
+
+    def __init__(self, cache):
+        self.cache = cache
+        self.operations = []
+
+    def __len__(self):
+        return len(self.operations)
+
+    def get(self, key):
+        return self._queue("get", key)
+
+    def set(self, key, value, ex=None):
+        return self._queue("set", key, value, ex=ex)
+
+    def delete(self, key):
+        return self._queue("delete", key)
+
+    def expire(self, key, seconds):
+        return self._queue("expire", key, seconds)
 
-def build_congrats_key(user_id):
-    return f"{user_id}-congrats"
+    def _queue(self, name, *args, **kwargs):
+        self.operations.append((name, args, kwargs))
+        return self
+
+    async def execute(self):
+        operations, self.operations = self.operations, []
+        return [
+            await getattr(self.cache, name)(*args, **kwargs)
+            for name, args, kwargs in operations
+        ]
 
 
 # Abstract base class #
@@ -15,20 +65,567 @@ class Cache(ABC):
         pass
 
     @abstractmethod
-    async def set(self, key, value):
+    async def set(self, key, value, ex=None):
+        """Set a value, expiring it after ``ex`` seconds if given"""
         pass
 
     @abstractmethod
     async def delete(self, key):
         pass
 
+    @abstractmethod
+    async def expire(self, key, seconds):
+        """Expire a key and its version after ``seconds``"""
+        pass
+
+    @abstractmethod
+    async def get_versioned(self, key):
+        """Get a value along with the version it was written at
+
+        Returns:
+          A tuple of the value (or None) and its integer version. Keys
+          that were never written are at version 0.
+        """
+        pass
+
+    @abstractmethod
+    async def compare_and_set(self, key, value, version=None, ex=None):
+        """Set a value if it is still at the given version
+
+        Args:
+          key: The key to write
+          value: The value to write
+          version: The version read alongside the value being replaced,
+            if None the value is written unconditionally
+          ex: Seconds after which the value and its version expire
+
+        Returns:
+          The new version of the key or None if another writer has
+          changed the key since ``version`` was read
+        """
+        pass
+
+    def batch(self):
+        """Queue several get, set, delete and expire calls to run together
+
+        Returns:
+          A Batch, await its ``execute`` to run the queued operations
+        """
+        return Batch(self)
+
+    @abstractmethod
+    async def get_hash(self, key):
+        """Get all fields of a hash along with its version
+
+        Returns:
+          A tuple of a dict of the hash fields, with str field names,
+          and the integer version. If the key holds a plain value, as
+          written by ``set``, that value is returned instead of a dict
+          and if it does not exist None is.
+        """
+        pass
+
+    @abstractmethod
+    async def compare_and_set_hash(
+        self, key, fields, removed=(), version=None, ex=None, replace=False
+    ):
+        """Update hash fields if the hash is still at the given version
+
+        Args:
+          key: The key of the hash
+          fields: A dict of the fields to write
+          removed: The names of fields to remove
+          version: The version read alongside the hash, if None the
+            fields are written unconditionally
+          ex: Seconds after which the hash and its version expire
+          replace: Whether to drop whatever the key held before
+            writing the fields
+
+        Returns:
+          The new version of the key or None if another writer has
+          changed the key since ``version`` was read
+        """
+        pass
+
+
+# Keeps a counter next to the value which is bumped on every write
+# so a writer can tell whether the value changed since it was read
+COMPARE_AND_SET_SCRIPT = """
+local current = tonumber(redis.call("GET", KEYS[2]) or "0")
+if ARGV[2] ~= "" and current ~= tonumber(ARGV[2]) then
+    return false
+end
+local version = redis.call("INCR", KEYS[2])
+if ARGV[3] ~= "" then
+    redis.call("SET", KEYS[1], ARGV[1], "EX", ARGV[3])
+    redis.call("EXPIRE", KEYS[2], ARGV[3])
+else
+    redis.call("SET", KEYS[1], ARGV[1])
+    redis.call("PERSIST", KEYS[2])
+end
+return version
+"""
+
+# The version outlives the value for a while so an event that read
+# the value before it was deleted cannot write it back
+DELETE_SCRIPT = """
+redis.call("DEL", KEYS[1])
+local version = redis.call("INCR", KEYS[2])
+redis.call("EXPIRE", KEYS[2], ARGV[1])
+return version
+"""
+VERSION_RETENTION = 60 * 60
+
+# Plain values are returned as they are so states written before
+# they were stored as hashes can still be read
+GET_HASH_SCRIPT = """
+local version = redis.call("GET", KEYS[2]) or "0"
+local kind = redis.call("TYPE", KEYS[1]).ok
+if kind == "hash" then
+    return {version, kind, redis.call("HGETALL", KEYS[1])}
+elseif kind == "string" then
+    return {version, kind, redis.call("GET", KEYS[1])}
+end
+return {version, kind}
+"""
+
+# ARGV holds the expiry, whether to replace the key, the number of
+# fields to write followed by field/value pairs and then the fields
+# to remove
+COMPARE_AND_SET_HASH_SCRIPT = """
+local current = tonumber(redis.call("GET", KEYS[2]) or "0")
+if ARGV[1] ~= "" and current ~= tonumber(ARGV[1]) then
+    return false
+end
+local version = redis.call("INCR", KEYS[2])
+if ARGV[3] == "1" then
+    redis.call("DEL", KEYS[1])
+end
+local count = tonumber(ARGV[4])
+if count > 0 then
+    redis.call("HSET", KEYS[1], unpack(ARGV, 5, 4 + count * 2))
+end
+if #ARGV > 4 + count * 2 then
+    redis.call("HDEL", KEYS[1], unpack(ARGV, 5 + count * 2))
+end
+if ARGV[2] ~= "" then
+    redis.call("EXPIRE", KEYS[1], ARGV[2])
+    redis.call("EXPIRE", KEYS[2], ARGV[2])
+else
+    redis.call("PERSIST", KEYS[1])
+    redis.call("PERSIST", KEYS[2])
+end
+return version
+"""
+
+
+class RedisBatch(Batch):
+    """Sends the queued operations in one pipeline"""
+
+    async def execute(self):
+        operations, self.operations = self.operations, []
+        if not operations:
+            return []
+        cache = self.cache
+        # The number of pipeline replies each operation produces, only
+        # the first one is returned
+        replies = []
+        async with Redis.pipeline(transaction=False) as pipe:
+            for name, args, kwargs in operations:
+                if name == "get":
+                    pipe.get(*args)
+                    replies.append(1)
+                elif name == "set":
+                    pipe.set(*args, **kwargs)
+                    replies.append(1)
+                elif name == "delete":
+                    (key,) = args
+                    await cache._delete(
+                        keys=[key, build_version_key(key)],
+                        args=[VERSION_RETENTION],
+                        client=pipe,
+                    )
+                    replies.append(1)
+                else:
+                    key, seconds = args
+                    pipe.expire(key, seconds)
+                    pipe.expire(build_version_key(key), seconds)
+                    replies.append(2)
+            results = await pipe.execute()
+        out = []
+        position = 0
+        for count in replies:
+            out.append(results[position])
+            position += count
+        return out
+
+
+class LazyScript:
+    """A Redis script registered the first time it is used
+
+    Registering builds the Redis client, so a cache created at import
+    does not connect before the bot needs it.
+    """
+
+    def __init__(self, source):
+        self.source = source
+        self.script = None
+
+    def __get__(self, instance, owner):
+        if self.script is None:
+            self.script = Redis.register_script(self.source)
+        return self.script
+
 
 class RedisCache(Cache):
+    _compare_and_set = LazyScript(COMPARE_AND_SET_SCRIPT)
+    _delete = LazyScript(DELETE_SCRIPT)
+    _get_hash = LazyScript(GET_HASH_SCRIPT)
+    _compare_and_set_hash = LazyScript(COMPARE_AND_SET_HASH_SCRIPT)
+
+    def batch(self):
+        return RedisBatch(self)
+
     async def get(self, key):
         return await Redis.get(key)
 
-    async def set(self, key, value):
-        return await Redis.set(key, value)
+    async def set(self, key, value, ex=None):
+        return await Redis.set(key, value, ex=ex)
 
     async def delete(self, key):
-        return await Redis.delete(key)
+        return await self._delete(
+            keys=[key, build_version_key(key)], args=[VERSION_RETENTION]
+        )
+
+    async def expire(self, key, seconds):
+        async with Redis.pipeline(transaction=True) as pipe:
+            pipe.expire(key, seconds)
+            pipe.expire(build_version_key(key), seconds)
+            result, _ = await pipe.execute()
+        return result
+
+    async def get_versioned(self, key):
+        value, version = await Redis.mget(key, build_version_key(key))
+        return value, int(version or 0)
+
+    async def compare_and_set(self, key, value, version=None, ex=None):
+        return await self._compare_and_set(
+            keys=[key, build_version_key(key)],
+            args=[value, "" if version is None else version, ex or ""],
+        )
+
+    async def get_hash(self, key):
+        version, kind, *value = await self._get_hash(keys=[key, build_version_key(key)])
+        if kind == b"hash":
+            pairs = value[0]
+            value = {pairs[i].decode(): pairs[i + 1] for i in range(0, len(pairs), 2)}
+        elif kind == b"string":
+            value = value[0]
+        else:
+            value = None
+        return value, int(version)
+
+    async def compare_and_set_hash(
+        self, key, fields, removed=(), version=None, ex=None, replace=False
+    ):
+        args = [
+            "" if version is None else version,
+            ex or "",
+            "1" if replace else "0",
+            len(fields),
+        ]
+        for field, value in fields.items():
+            args += [field, value]
+        args += list(removed)
+        return await self._compare_and_set_hash(
+            keys=[key, build_version_key(key)], args=args
+        )
+
+
+class LRUCache:
+    """A bounded in-memory mapping whose entries expire
+
+    Args:
+      maxsize: The number of entries kept before the least recently
+        used one is evicted
+      ttl: Seconds an entry is served for after it was stored
+    """
+
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key, default=None):
+        entry = self._data.get(key)
+        if entry is None:
+            return default
+        expires, value = entry
+        if expires < time.monotonic():
+            del self._data[key]
+            return default
+        self._data.move_to_end(key)
+        return value
+
+    def set(self, key, value):
+        self._data[key] = (time.monotonic() + self.ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def delete(self, key):
+        self._data.pop(key, None)
+
+    def clear(self):
+        self._data.clear()
+
+
+class TieredBatch(Batch):
+    """Serves queued gets from memory and batches the rest to the backend"""
+
+    async def execute(self):
+        operations, self.operations = self.operations, []
+        cache = self.cache
+        results = [None] * len(operations)
+        backend = cache.backend.batch()
+        pending = []
+        # Keys written earlier in the batch are read from the backend
+        written = set()
+        for i, (name, args, kwargs) in enumerate(operations):
+            if name in ("set", "delete"):
+                written.add(str(args[0]))
+            elif name == "get" and str(args[0]) not in written:
+                entry = cache.local.get(str(args[0]))
+                if entry is not None:
+                    cache.hits += 1
+                    results[i] = entry[0]
+                    continue
+            if name == "get":
+                cache.misses += 1
+            getattr(backend, name)(*args, **kwargs)
+            pending.append(i)
+
+        invalidated = []
+        for i, result in zip(pending, await backend.execute()):
+            results[i] = result
+            name, args, _ = operations[i]
+            key = str(args[0])
+            if name == "get":
+                cache.local.set(key, (result, None))
+            elif name == "set":
+                cache.local.set(key, (args[1], None))
+                invalidated.append(key)
+            elif name == "delete":
+                cache.local.delete(key)
+                invalidated.append(key)
+        await cache._invalidate(*invalidated)
+        return results
+
+
+class TieredCache(Cache):
+    """An in-process LRU cache in front of another cache
+
+    Reads are served from memory when possible, including values this
+    process just wrote and keys that do not exist. Writes go through
+    to the backend and are announced on a redis pub/sub channel so
+    other processes drop their copy of the key.
+
+    Args:
+      backend: The cache holding the source of truth
+      maxsize: The number of keys kept in memory
+      ttl: Seconds a key is served from memory, this bounds staleness
+        if an invalidation message is missed
+      redis: The aioredis client used for invalidation messages, if
+        None invalidations are not shared between processes
+      channel: The pub/sub channel invalidations are sent on, the
+        owner of the cache starts listening with start_listener
+
+    Attributes:
+      hits: The number of reads served from memory
+      misses: The number of reads that went to the backend
+      remote_write_callbacks: Functions called with each key another
+        process wrote or deleted
+    """
+
+    def __init__(self, backend, maxsize, ttl, redis=None, channel=None):
+        self.backend = backend
+        self.local = LRUCache(maxsize, ttl)
+        self.redis = redis
+        self.channel = channel
+        self.origin = uuid.uuid4().hex
+        self.hits = 0
+        self.misses = 0
+        self.remote_write_callbacks = []
+        self._listener = None
+
+    @property
+    def hit_ratio(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hit_ratio,
+            "size": len(self.local),
+        }
+
+    def batch(self):
+        return TieredBatch(self)
+
+    async def get(self, key):
+        entry = self.local.get(str(key))
+        if entry is not None:
+            self.hits += 1
+            return entry[0]
+        self.misses += 1
+        value = await self.backend.get(key)
+        self.local.set(str(key), (value, None))
+        return value
+
+    async def set(self, key, value, ex=None):
+        result = await self.backend.set(key, value, ex=ex)
+        self.local.set(str(key), (value, None))
+        await self._invalidate(key)
+        return result
+
+    async def delete(self, key):
+        result = await self.backend.delete(key)
+        self.local.delete(str(key))
+        await self._invalidate(key)
+        return result
+
+    async def expire(self, key, seconds):
+        return await self.backend.expire(key, seconds)
+
+    async def get_versioned(self, key):
+        entry = self.local.get(str(key))
+        if entry is not None and entry[1] is not None:
+            self.hits += 1
+            return entry
+        self.misses += 1
+        entry = await self.backend.get_versioned(key)
+        self.local.set(str(key), entry)
+        return entry
+
+    async def compare_and_set(self, key, value, version=None, ex=None):
+        new_version = await self.backend.compare_and_set(key, value, version, ex=ex)
+        if new_version is None:
+            # Our copy is stale, the caller will want to read it again
+            self.local.delete(str(key))
+            return None
+        self.local.set(str(key), (value, new_version))
+        await self._invalidate(key)
+        return new_version
+
+    async def get_hash(self, key):
+        entry = self.local.get(str(key))
+        if entry is not None and entry[1] is not None:
+            self.hits += 1
+            return entry
+        self.misses += 1
+        entry = await self.backend.get_hash(key)
+        self.local.set(str(key), entry)
+        return entry
+
+    async def compare_and_set_hash(
+        self, key, fields, removed=(), version=None, ex=None, replace=False
+    ):
+        entry = self.local.get(str(key))
+        new_version = await self.backend.compare_and_set_hash(
+            key, fields, removed, version, ex=ex, replace=replace
+        )
+        if new_version is None:
+            self.local.delete(str(key))
+            return None
+        if replace:
+            value = dict(fields)
+        elif (
+            version is not None
+            and entry is not None
+            and entry[1] == version
+            and isinstance(entry[0], dict)
+        ):
+            value = {**entry[0], **fields}
+            for field in removed:
+                value.pop(field, None)
+        else:
+            # We do not know the rest of the hash
+            value = None
+        if value is None:
+            self.local.delete(str(key))
+        else:
+            self.local.set(str(key), (value, new_version))
+        await self._invalidate(key)
+        return new_version
+
+    async def _invalidate(self, *keys):
+        if self.redis is None or not keys:
+            return
+        if len(keys) == 1:
+            await self.redis.publish(self.channel, f"{self.origin}:{keys[0]}")
+            return
+        async with self.redis.pipeline(transaction=False) as pipe:
+            for key in keys:
+                pipe.publish(self.channel, f"{self.origin}:{key}")
+            await pipe.execute()
+
+    async def start_listener(self, timeout=5):
+        """Subscribe to the invalidations of other processes
+
+        Has to be called before anything is read, so remote writes are
+        heard of even by a process that has not read a key yet. Waits
+        up to timeout seconds for the subscription, the listener keeps
+        retrying in the background if redis cannot be reached.
+        """
+        if self.redis is None or self._listener is not None:
+            return
+        self._subscribed = asyncio.Event()
+        self._listener = asyncio.ensure_future(self._listen())
+        try:
+            await asyncio.wait_for(self._subscribed.wait(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning("Not yet subscribed to cache invalidations")
+
+    async def _listen(self):
+        while True:
+            try:
+                pubsub = self.redis.pubsub()
+                await pubsub.subscribe(self.channel)
+                self._subscribed.set()
+                async for message in pubsub.listen():
+                    if message["type"] != "message":
+                        continue
+                    data = message["data"]
+                    if isinstance(data, bytes):
+                        data = data.decode()
+                    origin, _, key = data.partition(":")
+                    if origin != self.origin:
+                        self.local.delete(key)
+                        for callback in self.remote_write_callbacks:
+                            callback(key)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Lost the cache invalidation subscription")
+            # Invalidations may have been missed while disconnected
+            self.local.clear()
+            await asyncio.sleep(1)
+
+
+def build_cache():
+    """Build the cache the bot stores conversation state in"""
+    cache = RedisCache()
+    if not constants.Cache.l1_size:
+        return cache
+    return TieredCache(
+        cache,
+        maxsize=constants.Cache.l1_size,
+        ttl=constants.Cache.l1_ttl,
+        redis=Redis,
+        channel=constants.Cache.invalidation_channel,
+    )
@@ -8,32 +8,45 @@ import discord
 
 from bot.common.airtable import (
     find_user,
-    create_user,
     get_discord_record,
     get_guild,
 )
 from bot.common.bot.bot import bot
+from bot.common.cache import TieredCache, build_cache
+from bot.common.diagnostics import ENABLED as DIAGNOSTICS, diagnostics
+from bot.common.filters import accept_message, accept_reaction, open_threads
+from bot.common.guilds import guild_registry
+from bot.common.jobs import WRITE_BEHIND, queue
+from bot.common.locks import user_lock
+from bot.common.maintenance import conversation_stats
+from bot.common.metrics import start_server
+from bot.common.prompts import parse_prompt_interaction, send_prompt
+from bot.common.resolver import resolver
+from bot.common.tracing import span
+from bot.common.writes import save_new_user
 from bot.common.threads.thread_builder import (
     build_cache_value,
+    get_thread,
     ThreadKeys,
+    ThreadState,
 )
-from bot.common.threads.onboarding import Onboarding
-from bot.common.threads.report import ReportStep
-from bot.common.threads.points import Points
-from bot.common.threads.update import UpdateProfile
 from bot.config import (
-    read_file,
     GUILD_IDS,
     INFO_EMBED_COLOR,
     Redis,
     get_list_of_emojis,
 )
 from bot.exceptions import NotGuildException, ErrorHandler
-from bot.common.guild_select import get_thread, GuildSelect
+from bot.common.guild_select import GuildSelect
 
 
 logger = logging.getLogger(__name__)
 
+cache = build_cache()
+if isinstance(cache, TieredCache):
+    # Conversations opened by other bot processes
+    cache.remote_write_callbacks.append(open_threads.add_key)
+
 
 @bot.slash_command(
     guild_id=GUILD_IDS,
@@ -55,30 +68,31 @@ async def report(ctx):
         )
 
         message, metadata = await select_guild(ctx, embed, error_embed)
+        state = ThreadState.new(cache, ctx.author.id)
         thread = await GuildSelect(
             ctx.author.id,
             hashlib.sha256("".encode()).hexdigest(),
             message.id,
             "",
+            state=state,
         )
         # TODO add thread and step
-        return await Redis.set(
-            ctx.author.id,
-            build_cache_value(
-                ThreadKeys.GUILD_SELECT.value,
-                thread.steps.hash_,
-                "",
-                message.id,
-                metadata={**metadata, "thread_name": ThreadKeys.REPORT.value},
-            ),
+        state.set(
+            ThreadKeys.GUILD_SELECT.value,
+            thread.steps.hash_,
+            "",
+            message.id,
+            metadata={**metadata, "thread_name": ThreadKeys.REPORT.value},
         )
+        return await state.flush()
 
-    airtableLinks = read_file()
-    airtableLink = airtableLinks.get(str(ctx.guild.id))
+    guild = await guild_registry.get(ctx.guild.id)
+
+    if guild and guild.report_link:
+        from bot.common.threads.report import ReportStep
 
-    if airtableLink:
         _, metadata = await ReportStep(
-            guild_id=ctx.guild.id, cache=Redis, bot=bot, channel=ctx.channel
+            guild_id=ctx.guild.id, cache=cache, bot=bot, channel=ctx.channel
         ).send(None, ctx.author.id)
         # send message to congrats channel
 
@@ -140,12 +154,15 @@ async def join(ctx):
         )
         return
 
-    await create_user(ctx.author.id, ctx.guild.id)
+    await save_new_user(ctx.author.id, ctx.guild.id)
+    from bot.common.threads.onboarding import Onboarding
+
     onboarding = await Onboarding(
         ctx.author.id,
         hashlib.sha256("".encode()).hexdigest(),
         message.id,
         ctx.guild.id,
+        state=ThreadState.new(cache, ctx.author.id),
     )
     await onboarding.send(message)
     await ctx.followup.send("Check your DM's to continue onboarding", ephemeral=True)
@@ -175,22 +192,24 @@ async def update(ctx):
         message, metadata = await select_guild(ctx, embed, error_embed)
         if not metadata:
             return
+        from bot.common.threads.update import UpdateProfile
+
+        state = ThreadState.new(cache, ctx.author.id)
         thread = await UpdateProfile(
             ctx.author.id,
             hashlib.sha256("".encode()).hexdigest(),
             message.id,
             "",
+            state=state,
         )
-        await Redis.set(
-            ctx.author.id,
-            build_cache_value(
-                ThreadKeys.UPDATE_PROFILE.value,
-                thread.steps.hash_,
-                "",
-                message.id,
-                metadata=metadata,
-            ),
+        state.set(
+            ThreadKeys.UPDATE_PROFILE.value,
+            thread.steps.hash_,
+            "",
+            message.id,
+            metadata=metadata,
         )
+        await state.flush()
 
 
 @bot.slash_command(
@@ -219,50 +238,49 @@ async def points(
         )
 
         message, metadata = await select_guild(ctx, embed, error_embed)
+        state = ThreadState.new(cache, ctx.author.id)
         thread = await GuildSelect(
             ctx.author.id,
             hashlib.sha256("".encode()).hexdigest(),
             message.id,
             "",
-            cache=Redis,
             discord_bot=bot,
             context=ctx,
+            state=state,
         )
-        return await Redis.set(
-            ctx.author.id,
-            build_cache_value(
-                ThreadKeys.GUILD_SELECT.value,
-                thread.steps.hash_,
-                "",
-                message.id,
-                metadata={
-                    **metadata,
-                    "thread_name": ThreadKeys.POINTS.value,
-                    "days": days,
-                },
-            ),
+        state.set(
+            ThreadKeys.GUILD_SELECT.value,
+            thread.steps.hash_,
+            "",
+            message.id,
+            metadata={
+                **metadata,
+                "thread_name": ThreadKeys.POINTS.value,
+                "days": days,
+            },
         )
+        return await state.flush()
+
+    from bot.common.threads.points import Points
 
+    state = ThreadState.new(cache, ctx.author.id)
     thread = await Points(
         ctx.author.id,
         hashlib.sha256("".encode()).hexdigest(),
         None,
         ctx.guild.id,
-        cache=Redis,
         discord_bot=bot,
         context=ctx,
+        state=state,
     )
-    await Redis.set(
-        ctx.author.id,
-        build_cache_value(
-            ThreadKeys.POINTS.value,
-            thread.steps.hash_,
-            ctx.guild.id,
-            metadata={
-                "thread_name": ThreadKeys.POINTS.value,
-                "days": days,
-            },
-        ),
+    state.set(
+        ThreadKeys.POINTS.value,
+        thread.steps.hash_,
+        ctx.guild.id,
+        metadata={
+            "thread_name": ThreadKeys.POINTS.value,
+            "days": days,
+        },
     )
     await thread.send(None)
 
@@ -293,25 +311,69 @@ if bool(strtobool(constants.Bot.is_dev)):
             message, metadata = await select_guild(ctx, embed, error_embed)
             if not metadata:
                 return
+            state = ThreadState.new(cache, ctx.author.id)
             thread = await GuildSelect(
                 ctx.author.id,
                 hashlib.sha256("".encode()).hexdigest(),
                 message.id,
                 "",
+                state=state,
             )
-            await Redis.set(
-                ctx.author.id,
-                build_cache_value(
-                    ThreadKeys.GUILD_SELECT.value,
-                    thread.steps.hash_,
-                    "",
-                    message.id,
-                    metadata={
-                        **metadata,
-                        "thread_name": ThreadKeys.INITIAL_CONTRIBUTIONS.value,
-                    },
-                ),
+            state.set(
+                ThreadKeys.GUILD_SELECT.value,
+                thread.steps.hash_,
+                "",
+                message.id,
+                metadata={
+                    **metadata,
+                    "thread_name": ThreadKeys.INITIAL_CONTRIBUTIONS.value,
+                },
             )
+            await state.flush()
+
+    @bot.slash_command(
+        guild_id=GUILD_IDS, description="Count open conversations in the cache"
+    )
+    async def conversations(
+        ctx,
+        reap: Option(
+            bool,
+            "Expire conversations stored without a ttl",  # noqa: F722
+            default=False,
+        ),
+    ):
+        await ctx.response.defer(ephemeral=True)
+        stats = await conversation_stats(Redis, reap=reap)
+        embed = discord.Embed(
+            colour=INFO_EMBED_COLOR,
+            title="Conversations",
+            description=f"{stats['conversations']} open conversations using "
+            f"{stats['memory'] / 1024:.1f} KiB",
+        )
+        for thread, count in sorted(stats["threads"].items()):
+            embed.add_field(name=thread, value=count)
+        embed.add_field(
+            name="Without expiry",
+            value=f"{stats['without_expiry']} ({stats['reaped']} reaped)",
+            inline=False,
+        )
+        await ctx.followup.send(embed=embed, ephemeral=True)
+
+    @bot.slash_command(
+        name="diagnostics",
+        guild_id=GUILD_IDS,
+        description="Dump a profile of the event loop",
+    )
+    async def diagnostics_dump(ctx):
+        if not diagnostics.running:
+            diagnostics.start()
+            await ctx.respond(
+                "Diagnostics started, run the command again for a profile",
+                ephemeral=True,
+            )
+            return
+        path, summary = diagnostics.dump()
+        await ctx.respond(summary, file=discord.File(path), ephemeral=True)
 
 
 async def select_guild(ctx, response_embed, error_embed):
@@ -333,15 +395,15 @@ async def select_guild(ctx, response_embed, error_embed):
     emojis = get_list_of_emojis(len(guild_ids))
     daos = {}
     for idx, guild_id in enumerate(guild_ids):
-        guild = await bot.fetch_guild(guild_id)
+        guild = await resolver.get_guild(guild_id)
         if not guild:
             continue
         emoji = emojis[idx]
         daos[emoji] = guild.id
         embed.add_field(name=guild.name, value=emoji)
-    message = await ctx.followup.send(embed=embed)
-    for emoji in emojis:
-        await message.add_reaction(emoji)
+    message = await send_prompt(
+        ctx.followup, embed=embed, emojis=emojis, user_id=ctx.author.id
+    )
     return message, {"daos": daos}
 
 
@@ -354,45 +416,110 @@ async def on_application_command_error(ctx, exception):
     ctx.response.is_done()
 
 
+@bot.event
+async def on_ready():
+    if isinstance(cache, TieredCache):
+        # Subscribe before loading open threads so no conversation
+        # opened by another process in between is missed
+        await cache.start_listener()
+    # Other processes only announce new conversations through the
+    # in-process cache, without it every user may have one
+    shared = bool(strtobool(constants.Locks.distributed))
+    if isinstance(cache, TieredCache) or not shared:
+        await open_threads.load(Redis)
+    if WRITE_BEHIND:
+        queue.start()
+    await guild_registry.load()
+    await start_server()
+    if DIAGNOSTICS:
+        diagnostics.start()
+
+
 @bot.event
 async def on_message(message):
-    if message.author.bot is True:
+    # Drop events that cannot continue a conversation before any I/O
+    if not accept_message(message):
         return
 
     # Check channel DM channel
     if not isinstance(message.channel, discord.DMChannel):
         return
 
-    # Check if user has open thread
-    thread_key = await Redis.get(message.author.id)
-    if not thread_key:
-        # TODO: It may make sense to send some sort of message here
-        return
+    with span("on_message", user_id=message.author.id):
+        # Events for a user are handled one at a time so each one
+        # sees the state left behind by the previous one
+        async with user_lock.acquire(message.author.id):
+            # Check if user has open thread
+            state = await ThreadState(cache, message.author.id).load()
+            if not state.values:
+                open_threads.discard(message.author.id)
+                # TODO: It may make sense to send some sort of message here
+                return
 
-    thread = await get_thread(message.author.id, thread_key)
-    await thread.send(message)
+            thread = await get_thread(message.author.id, state.values, state=state)
+            await thread.send(message)
 
 
 @bot.event
 async def on_raw_reaction_add(payload):
     reaction = payload
-    user = await bot.fetch_user(int(payload.user_id))
-    channel = await bot.fetch_channel(int(reaction.channel_id))
-    if user.bot is True:
+    # Reactions in guilds, the bot's own reactions and reactions of
+    # users without a conversation are dropped before any I/O. Only
+    # DMs have no guild id, so the channel is not looked up.
+    if not accept_reaction(payload, bot.user.id):
         return
+    with span("on_raw_reaction_add", user_id=payload.user_id):
+        user = await resolver.get_user(payload.user_id)
+        if user.bot is True:
+            return
+
+        async with user_lock.acquire(user.id):
+            # Check if user has open thread
+            state = await ThreadState(cache, user.id).load()
+            if not state.values:
+                open_threads.discard(user.id)
+                # TODO: It may make sense to send some sort of message here
+                return
+
+            thread = await get_thread(user.id, state.values, state=state)
+            await thread.handle_reaction(reaction, user)
 
-    # Check channel DM channel
-    if not isinstance(channel, discord.DMChannel):
-        return
 
-    # Check if user has open thread
-    thread_key = await Redis.get(user.id)
-    if not thread_key:
-        # TODO: It may make sense to send some sort of message here
+async def on_prompt_interaction(interaction):
+    # Buttons and select menus sent with prompts, the library still
+    # dispatches slash commands through Bot.on_interaction
+    answer = parse_prompt_interaction(interaction)
+    if answer is None:
+        return
+    user_id, choice = answer
+    if interaction.user.id != user_id:
+        await interaction.response.send_message(
+            "This prompt is not for you!", ephemeral=True
+        )
         return
 
-    thread = await get_thread(user.id, thread_key)
-    await thread.handle_reaction(reaction, user)
+    with span("on_prompt_interaction", user_id=user_id):
+        async with user_lock.acquire(user_id):
+            state = await ThreadState(cache, user_id).load()
+            if (
+                not state.values
+                or state.values.get("message_id") != interaction.message.id
+            ):
+                if not state.values:
+                    open_threads.discard(user_id)
+                await interaction.response.send_message(
+                    "This prompt is no longer active", ephemeral=True
+                )
+                return
+
+            # Acknowledge the answer and remove the components so the
+            # prompt cannot be answered twice
+            await interaction.response.edit_message(view=None)
+            thread = await get_thread(user_id, state.values, state=state)
+            await thread.handle_interaction(interaction, choice)
+
+
+bot.add_listener(on_prompt_interaction, "on_interaction")
 
 
 bot.on_application_command_error = on_application_command_error
@@ -0,0 +1,121 @@
+import asyncio
+import logging
+import time
+
+from bot import constants
+from bot.common import airtable
+
+logger = logging.getLogger(__name__)
+
+
+class GuildContributions:
+    """The contribution flow of a guild and how far its users got
+
+    Attributes:
+      flow: The Contribution Flow records of the guild by order
+      completed: The orders each discord user id reached
+      loaded_at: The monotonic time the guild was loaded
+    """
+
+    def __init__(self, flow, progress, loaded_at):
+        self.flow = flow
+        self.completed = {}
+        self.loaded_at = loaded_at
+        for record in progress:
+            fields = record.get("fields", {})
+            self.add(fields.get("discord_id"), fields.get("order"))
+
+    def add(self, user_id, order):
+        self.completed.setdefault(str(user_id), set()).add(order)
+
+
+class ContributionIndex:
+    """Answers contribution flow questions from memory
+
+    The flow and the progress of a guild are loaded from Airtable the
+    first time the guild is asked about, with one request each, and
+    kept for ttl seconds. Progress recorded in this process is added
+    as it is written so it shows up right away, progress recorded by
+    other processes shows up once the guild is reloaded.
+
+    Args:
+      ttl: Seconds a guild is kept before it is loaded again
+
+    Attributes:
+      loads: The number of times a guild was loaded
+    """
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self.loads = 0
+        self._guilds = {}
+        self._loading = {}
+
+    async def get_flow(self, guild_id):
+        """The Contribution Flow records of a guild sorted by order"""
+        guild = await self._get(guild_id)
+        return [guild.flow[order] for order in sorted(guild.flow)]
+
+    async def get_contribution_id(self, guild_id, order):
+        guild = await self._get(guild_id)
+        record = guild.flow.get(order)
+        if record is None:
+            raise Exception(f"No contribution {order} in guild {guild_id}")
+        return record.get("id")
+
+    async def has_completed(self, guild_id, user_id, order):
+        """Whether a user reached the contribution with the given order"""
+        guild = await self._get(guild_id)
+        return order in guild.completed.get(str(user_id), ())
+
+    def record(self, guild_id, user_id, order):
+        """Add progress that is being written to Airtable"""
+        guild = self._guilds.get(str(guild_id))
+        if guild is not None:
+            guild.add(user_id, order)
+        task = self._loading.get(str(guild_id))
+        if task is not None:
+            # The load may have read the progress before it was written
+            task.add_done_callback(
+                lambda t: t.cancelled()
+                or t.exception()
+                or t.result().add(user_id, order)
+            )
+
+    def invalidate(self, guild_id):
+        self._guilds.pop(str(guild_id), None)
+
+    async def _get(self, guild_id):
+        guild_id = str(guild_id)
+        guild = self._guilds.get(guild_id)
+        if guild is not None and time.monotonic() - guild.loaded_at < self.ttl:
+            return guild
+        task = self._loading.get(guild_id)
+        if task is None:
+            task = asyncio.ensure_future(self._load(guild_id))
+            self._loading[guild_id] = task
+            task.add_done_callback(lambda _: self._loading.pop(guild_id, None))
+        return await asyncio.shield(task)
+
+    async def _load(self, guild_id):
+        self.loads += 1
+        loaded_at = time.monotonic()
+        records, progress = await asyncio.gather(
+            airtable.get_contribution_records(guild_id),
+            airtable.get_guild_progress(guild_id),
+        )
+        flow = {}
+        for record in records or []:
+            flow[record.get("fields", {}).get("order")] = record
+        guild = GuildContributions(flow, progress, loaded_at)
+        # Keep progress recorded while the guild was loading
+        previous = self._guilds.get(guild_id)
+        if previous is not None:
+            for user_id, orders in previous.completed.items():
+                guild.completed.setdefault(user_id, set()).update(orders)
+        self._guilds[guild_id] = guild
+        logger.info(f"Loaded {len(flow)} contributions of guild {guild_id}")
+        return guild
+
+
+contributions = ContributionIndex(ttl=constants.Contributions.ttl)
@@ -0,0 +1,172 @@
+import asyncio
+import logging
+import os
+import signal
+import sys
+import threading
+import time
+
+from collections import Counter
+from distutils.util import strtobool
+
+from bot import constants
+from bot.common.metrics import registry
+
+logger = logging.getLogger(__name__)
+
+# Whether diagnostics start with the bot, they make the event loop
+# slower and are meant for tracking down blocking work
+ENABLED = bool(strtobool(constants.Diagnostics.enabled))
+
+LOOP_LAG_SECONDS = registry.histogram(
+    "loop_lag_seconds",
+    "Seconds the event loop ran a timer later than it was due",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 5),
+)
+
+
+def fold_stack(frame):
+    """A stack as one line of root first frames joined by semicolons
+
+    This is the folded format flamegraph.pl, speedscope and inferno
+    read, with the number of samples appended to each line.
+    """
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        filename = os.path.basename(code.co_filename)
+        names.append(f"{code.co_name} ({filename}:{code.co_firstlineno})")
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+class Diagnostics:
+    """Finds work that blocks the event loop
+
+    While running, asyncio debug mode logs every callback that ran
+    longer than slow_callback seconds, a thread samples the stack of
+    the loop every sample_interval seconds and a task measures how late
+    the loop wakes it up every lag_interval seconds. The samples are
+    written as folded stacks by dump.
+
+    Args:
+      sample_interval: Seconds between stack samples
+      slow_callback: Seconds after which a callback is logged as slow
+      lag_interval: Seconds between loop lag measurements
+      dump_dir: The directory profiles are written to
+
+    Attributes:
+      samples: Counts of the folded stacks sampled since the last dump
+      max_lag: The most seconds the loop was late since the last dump
+    """
+
+    def __init__(self, sample_interval, slow_callback, lag_interval, dump_dir):
+        self.sample_interval = sample_interval
+        self.slow_callback = slow_callback
+        self.lag_interval = lag_interval
+        self.dump_dir = dump_dir
+        self.samples = Counter()
+        self.max_lag = 0
+        self._loop = None
+        self._loop_thread_id = None
+        self._stopped = threading.Event()
+        self._sampler = None
+        self._lag_task = None
+        self._lock = threading.Lock()
+
+    @property
+    def running(self):
+        return self._loop is not None
+
+    def start(self):
+        """Start diagnosing the running loop
+
+        Also dumps a profile on SIGUSR1 where the platform has it.
+        """
+        if self.running:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread_id = threading.get_ident()
+        self._loop.set_debug(True)
+        self._loop.slow_callback_duration = self.slow_callback
+        self._stopped.clear()
+        self._sampler = threading.Thread(
+            target=self._sample, name="diagnostics-sampler", daemon=True
+        )
+        self._sampler.start()
+        self._lag_task = self._loop.create_task(self._measure_lag())
+        if hasattr(signal, "SIGUSR1"):
+            try:
+                self._loop.add_signal_handler(signal.SIGUSR1, self.dump)
+            except (NotImplementedError, RuntimeError):
+                pass
+        logger.warning(
+            f"Diagnostics running, callbacks over {self.slow_callback}s are "
+            f"logged and stacks sampled every {self.sample_interval}s"
+        )
+
+    def stop(self):
+        if not self.running:
+            return
+        self._stopped.set()
+        self._lag_task.cancel()
+        self._loop.set_debug(False)
+        if hasattr(signal, "SIGUSR1"):
+            try:
+                self._loop.remove_signal_handler(signal.SIGUSR1)
+            except (NotImplementedError, RuntimeError):
+                pass
+        self._loop = None
+
+    def _sample(self):
+        # Runs in its own thread so it sees the loop while it is blocked
+        while not self._stopped.wait(self.sample_interval):
+            frame = sys._current_frames().get(self._loop_thread_id)
+            if frame is None:
+                continue
+            stack = fold_stack(frame)
+            with self._lock:
+                self.samples[stack] += 1
+
+    async def _measure_lag(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            due = loop.time() + self.lag_interval
+            await asyncio.sleep(self.lag_interval)
+            lag = max(loop.time() - due, 0)
+            LOOP_LAG_SECONDS.observe(lag)
+            self.max_lag = max(self.max_lag, lag)
+            if lag >= self.slow_callback:
+                logger.warning(f"Event loop lagged {lag:.3f}s")
+
+    def dump(self):
+        """Write the samples since the last dump as folded stacks
+
+        Returns:
+          The path of the profile and a summary of it
+        """
+        with self._lock:
+            samples, self.samples = self.samples, Counter()
+        max_lag, self.max_lag = self.max_lag, 0
+        os.makedirs(self.dump_dir, exist_ok=True)
+        path = os.path.join(
+            self.dump_dir, f"profile-{os.getpid()}-{int(time.time())}.folded"
+        )
+        with open(path, "w") as f:
+            for stack, count in samples.most_common():
+                f.write(f"{stack} {count}\n")
+        total = sum(samples.values())
+        summary = (
+            f"{total} samples of {len(samples)} stacks, "
+            f"max loop lag {max_lag * 1000:.0f}ms"
+        )
+        logger.warning(f"Wrote profile {path}: {summary}")
+        return path, summary
+
+
+diagnostics = Diagnostics(
+    sample_interval=constants.Diagnostics.sample_interval,
+    slow_callback=constants.Diagnostics.slow_callback,
+    lag_interval=constants.Diagnostics.lag_interval,
+    dump_dir=constants.Diagnostics.dump_dir,
+)
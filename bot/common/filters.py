@@ -0,0 +1,89 @@
+import logging
+
+from bot.common.keys import build_scan_pattern, parse_key
+
+logger = logging.getLogger(__name__)
+
+SCAN_BATCH = 500
+
+
+class OpenThreads:
+    """The users that may have an open conversation
+
+    Threads opened or closed by this process are tracked as they are
+    flushed and threads written by other processes are added when
+    their cache invalidation message arrives. The set can hold users
+    whose conversation ended elsewhere or expired, those are dropped
+    once an event finds no state for them, but it never misses a user
+    with an open conversation. Until the set has been loaded from
+    redis every user may have one.
+
+    Attributes:
+      users: The ids of users that may have an open conversation
+      ready: Whether the set has been loaded and can rule users out
+    """
+
+    def __init__(self):
+        self.users = set()
+        self.ready = False
+        self._added = None
+
+    def add(self, user_id):
+        self.users.add(str(user_id))
+        if self._added is not None:
+            self._added.add(str(user_id))
+
+    def discard(self, user_id):
+        self.users.discard(str(user_id))
+
+    def may_have(self, user_id):
+        return not self.ready or str(user_id) in self.users
+
+    def add_key(self, key):
+        """Track the user of a thread key written by another process"""
+        parsed = parse_key(key)
+        if parsed is not None and parsed[1] == "thread":
+            self.add(parsed[0])
+
+    async def load(self, redis):
+        """Rebuild the set from the thread keys stored in redis"""
+        users = set()
+        self._added = set()
+        async for key in redis.scan_iter(
+            match=build_scan_pattern("thread"), count=SCAN_BATCH
+        ):
+            parsed = parse_key(key)
+            if parsed is not None:
+                users.add(parsed[0])
+        # Keep threads opened while the scan was running
+        self.users = users | self._added
+        self._added = None
+        self.ready = True
+        logger.info(f"Tracking {len(self.users)} open conversations")
+
+
+open_threads = OpenThreads()
+
+
+def accept_reaction(payload, bot_user_id):
+    """Whether a raw reaction could continue a conversation
+
+    Only uses the payload so ignored reactions cost no requests.
+    Conversations happen in DMs, so reactions in guilds, the bot's own
+    reactions and reactions of users without an open conversation are
+    rejected.
+    """
+    if payload.guild_id is not None:
+        return False
+    if payload.user_id == bot_user_id:
+        return False
+    if payload.member is not None and payload.member.bot:
+        return False
+    return open_threads.may_have(payload.user_id)
+
+
+def accept_message(message):
+    """Whether a message could continue a conversation"""
+    if message.author.bot or message.guild is not None:
+        return False
+    return open_threads.may_have(message.author.id)
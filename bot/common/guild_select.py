@@ -1,42 +1,45 @@
-import json
 import hashlib
+import logging
+
+from bot.common.cache import RedisCache
+from bot.common.jobs import job
+from bot.common.resolver import resolver
 from bot.common.threads.thread_builder import (
     BaseThread,
+    SavedMessage,
+    ThreadState,
     ThreadKeys,
     Step,
     BaseStep,
     StepKeys,
-    build_cache_value,
+    get_thread,
+    register_thread,
 )
 from bot.common.threads.shared_steps import SelectGuildEmojiStep
 
-from bot.common.threads.onboarding import Onboarding  # noqa: E402
-from bot.common.threads.update import UpdateProfile  # noqa: E402
-from bot.common.threads.initial_contribution import InitialContributions
-from bot.common.threads.report import Report
-from bot.common.threads.points import Points
-from bot.config import Redis
-
-
-async def get_thread(user_id, key, cache=None):
-    val = json.loads(key)
-    thread = val.get("thread")
-    step = val.get("step")
-    message_id = val.get("message_id")
-    guild_id = val.get("guild_id")
-    if thread == ThreadKeys.ONBOARDING.value:
-        return await Onboarding(user_id, step, message_id, guild_id, cache)
-    elif thread == ThreadKeys.UPDATE_PROFILE.value:
-        return await UpdateProfile(user_id, step, message_id, guild_id, cache)
-    elif thread == ThreadKeys.INITIAL_CONTRIBUTIONS.value:
-        return await InitialContributions(user_id, step, message_id, guild_id, cache)
-    elif thread == ThreadKeys.GUILD_SELECT.value:
-        return await GuildSelect(user_id, step, message_id, guild_id, cache)
-    elif thread == ThreadKeys.REPORT.value:
-        return await Report(user_id, step, message_id, guild_id, cache)
-    elif thread == ThreadKeys.POINTS.value:
-        return await Points(user_id, step, message_id, guild_id, cache)
-    raise Exception("Unknown Thread!")
+logger = logging.getLogger(__name__)
+
+
+async def notify_save_failed(error, user_id, values, message):
+    user = await resolver.get_user(user_id)
+    await user.send(
+        f"Sorry, we could not save your answer `{message['content']}`. "
+        "Please try again later with /update"
+    )
+
+
+@job("save_step", on_failure=notify_save_failed)
+async def save_step(user_id, values, message):
+    """Run the save of a step queued by a thread in write behind mode"""
+    state = ThreadState.new(RedisCache(), user_id)
+    state.values = values
+    thread = await get_thread(user_id, values, state=state)
+    if thread.step is None:
+        raise Exception(f"No step {values.get('step')} in {values.get('thread')}")
+    logger.info(f"Save {thread.step.hash_} for {user_id}")
+    await thread.step.current.save(
+        SavedMessage.from_dict(message), values.get("guild_id"), user_id
+    )
 
 
 class OverrideThreadStep(BaseStep):
@@ -56,13 +59,14 @@ class OverrideThreadStep(BaseStep):
     async def send(self, message, user_id):
         thread = await get_thread(
             user_id,
-            build_cache_value(
-                self.cls.command_name,
-                hashlib.sha256("".encode()).hexdigest(),
-                self.cls.guild_id,
-                message.id,
-            ),
+            {
+                "thread": self.cls.command_name,
+                "step": hashlib.sha256("".encode()).hexdigest(),
+                "guild_id": self.cls.guild_id,
+                "message_id": message.id,
+            },
             self.cls.cache,
+            self.cls.state,
         )
         # this is dangerous
         self.cls.get_steps = thread.get_steps
@@ -73,6 +77,7 @@ class OverrideThreadStep(BaseStep):
         return message, metadata
 
 
+@register_thread
 class GuildSelect(BaseThread):
     """A thread that sets the guild_id for another thread
 
@@ -87,11 +92,9 @@ class GuildSelect(BaseThread):
     def __await__(self):
         async def init(self):
             await self._init_steps()
-            key_vals = await Redis.get(self.user_id)
-            if key_vals:
-                self.command_name = (
-                    json.loads(key_vals).get("metadata").get("thread_name")
-                )
+            state = await self.state.load()
+            if state.values:
+                self.command_name = state.metadata.get("thread_name")
             return self
 
         return init(self).__await__()
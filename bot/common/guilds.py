@@ -0,0 +1,164 @@
+import asyncio
+import json
+import logging
+import os
+import time
+
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Optional
+
+from bot import constants
+from bot.common import airtable
+
+logger = logging.getLogger(__name__)
+
+# Relative config paths are resolved from the root of the repository
+# so the bot can be started from any directory
+ROOT = Path(__file__).resolve().parents[2]
+
+
+@dataclass
+class GuildConfig:
+    """Everything the bot knows about a guild's setup
+
+    Attributes:
+      guild_id: The discord guild id
+      name: The name from the guilds config or the Guilds table
+      report_link: Where members report contributions, from the
+        guild config file
+      fields: The fields of the guild's Guilds table record
+    """
+
+    guild_id: int
+    name: Optional[str] = None
+    report_link: Optional[str] = None
+    fields: dict = field(default_factory=dict)
+
+
+class GuildRegistry:
+    """Guild settings merged from the config, a file and Airtable
+
+    The ``guilds`` section of the config is the base, the Guilds table
+    adds its record fields and the guild config file the report links.
+    The file is checked for changes at most every reload_interval
+    seconds and reloaded when its mtime changed, a file that fails to
+    parse keeps the previous links. The table is read the first time a
+    guild is looked up and refreshed in the background every table_ttl
+    seconds, so lookups are a dict access.
+
+    Args:
+      path: The guild config file mapping guild ids to report links
+      guilds: The guilds config entries with an id and name
+      reload_interval: Seconds between checks of the file
+      table_ttl: Seconds the Guilds table is kept
+
+    Attributes:
+      reloads: The number of times the file was read
+    """
+
+    def __init__(self, path, guilds, reload_interval, table_ttl):
+        path = Path(path)
+        self.path = path if path.is_absolute() else ROOT / path
+        self.defaults = guilds
+        self.reload_interval = reload_interval
+        self.table_ttl = table_ttl
+        self.reloads = 0
+        self._links = {}
+        self._records = {}
+        self._guilds = {}
+        self._mtime = None
+        self._checked_at = None
+        self._table_loaded_at = None
+        self._table_task = None
+
+    async def get(self, guild_id):
+        """The config of a guild or None if the bot knows nothing of it"""
+        await self.load()
+        return self._guilds.get(str(guild_id))
+
+    async def load(self):
+        """Load the file and table unless they are loaded and current"""
+        await self._check_table()
+        self._check_file()
+
+    async def _load_table(self):
+        try:
+            records = await airtable.get_guilds()
+        except Exception:
+            logger.exception("Failed to load the Guilds table")
+            records = None
+        self._table_loaded_at = time.monotonic()
+        if records is None:
+            return
+        self._records = {
+            str(record["fields"]["guild_id"]): record["fields"]
+            for record in records
+            if record.get("fields", {}).get("guild_id")
+        }
+        self._merge()
+
+    async def _check_table(self):
+        if self._table_task is None:
+            self._table_task = asyncio.ensure_future(self._load_table())
+        if self._table_loaded_at is None:
+            await asyncio.shield(self._table_task)
+        elif (
+            time.monotonic() - self._table_loaded_at >= self.table_ttl
+            and self._table_task.done()
+        ):
+            self._table_task = asyncio.ensure_future(self._load_table())
+
+    def _check_file(self):
+        now = time.monotonic()
+        if (
+            self._checked_at is not None
+            and now - self._checked_at < self.reload_interval
+        ):
+            return
+        self._checked_at = now
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except OSError:
+            logger.exception(f"Cannot read the guild config {self.path}")
+            return
+        if mtime == self._mtime:
+            return
+        try:
+            with open(self.path) as f:
+                links = json.load(f)
+        except (OSError, ValueError):
+            logger.exception(f"Failed to load the guild config {self.path}")
+            return
+        self._mtime = mtime
+        self._links = {str(guild_id): link for guild_id, link in links.items()}
+        self.reloads += 1
+        logger.info(f"Loaded {len(self._links)} report links from {self.path}")
+        self._merge()
+
+    def _merge(self):
+        guilds = {}
+
+        def guild(guild_id):
+            guild_id = str(guild_id)
+            if guild_id not in guilds:
+                guilds[guild_id] = GuildConfig(guild_id=int(guild_id))
+            return guilds[guild_id]
+
+        for entry in self.defaults:
+            guild(entry["id"]).name = entry.get("name")
+        for guild_id, fields in self._records.items():
+            config = guild(guild_id)
+            config.fields = fields
+            config.name = fields.get("guild_name") or config.name
+        for guild_id, link in self._links.items():
+            guild(guild_id).report_link = link
+        self._guilds = guilds
+
+
+guild_registry = GuildRegistry(
+    constants.Guilds.config_path,
+    constants.Guilds.guilds,
+    reload_interval=constants.Guilds.reload_interval,
+    table_ttl=constants.Guilds.table_ttl,
+)
@@ -0,0 +1,322 @@
+import asyncio
+import json
+import logging
+import zlib
+
+from dataclasses import dataclass
+from distutils.util import strtobool
+from typing import Callable, Optional
+
+from bot import constants
+from bot.common.keys import build_key
+from bot.config import Redis
+
+logger = logging.getLogger(__name__)
+
+# Whether conversations save answers through the queue instead of
+# before sending the next prompt
+WRITE_BEHIND = bool(strtobool(constants.Jobs.write_behind))
+
+GROUP = "workers"
+
+# How many jobs a worker reads from its stream at a time, also the
+# largest batch a batched job is run with
+READ_COUNT = 10
+
+
+@dataclass
+class Job:
+    name: str
+    run: Callable
+    on_failure: Optional[Callable] = None
+    batch_size: int = 1
+
+
+# Jobs by name, see job
+JOBS = {}
+
+
+def job(name, on_failure=None, batch_size=1):
+    """Register a coroutine function as a job the queue can run
+
+    The job is awaited with the keyword arguments it was queued with,
+    which have to be json serializable. Once every attempt failed
+    on_failure is awaited with the last exception and the same
+    arguments.
+
+    A job with a batch size above one is awaited with a list of the
+    keyword arguments of up to that many jobs queued one after the
+    other instead.
+    """
+
+    def register(fn):
+        if name in JOBS:
+            raise Exception(f"Job {name} is already registered")
+        JOBS[name] = Job(name, fn, on_failure, batch_size)
+        return fn
+
+    return register
+
+
+def build_stream_key(queue, partition):
+    return build_key(f"{queue}:{partition}", "stream")
+
+
+def build_lease_key(queue, partition):
+    return build_key(f"{queue}:{partition}", "lease")
+
+
+def build_dead_letter_key(queue):
+    return build_key(queue, "dead")
+
+
+def build_batches(entries):
+    """Split stream entries into the groups of jobs that run together
+
+    Consecutive jobs of a batched job are grouped up to its batch
+    size, every other job runs on its own.
+    """
+    batch, size, name = [], 1, None
+    for entry_id, fields in entries:
+        entry_name = fields[b"job"].decode() if fields else None
+        if batch and (entry_name != name or len(batch) >= size):
+            yield batch
+            batch = []
+        if not batch:
+            name = entry_name
+            job = JOBS.get(name)
+            size = job.batch_size if job is not None else 1
+        batch.append((entry_id, fields))
+    if batch:
+        yield batch
+
+
+class JobQueue:
+    """A durable queue of jobs run in the background
+
+    Jobs are appended to redis streams so they survive a restart of
+    the process that queued them or was running them. Every job is
+    queued with a partition key and the jobs of a key all land in the
+    same stream. A stream is worked by one process at a time, the one
+    holding its lease, which runs the jobs one after the other in the
+    order they were queued.
+
+    A failing job is retried in place with a doubling delay, holding
+    back the jobs queued after it, and once it ran out of attempts it
+    is moved to the dead letter stream and its on_failure hook runs.
+    Consecutive jobs of a batched job run together, if the batch fails
+    its jobs are retried one at a time so a bad one cannot take the
+    others with it.
+
+    Each stream is read by a consumer named after its partition, so
+    whoever takes over a partition first runs the jobs the previous
+    owner read but never finished.
+
+    Args:
+      redis: The aioredis client holding the streams
+      name: The name of the queue its keys are built from
+      partitions: The number of streams jobs are spread over
+      max_attempts: How many times a job is run before giving up
+      retry_delay: Seconds before the first retry of a job
+      lease_ttl: Seconds a partition stays leased to a process that
+        stopped renewing it
+      block: Seconds a worker waits for new jobs per read
+
+    Attributes:
+      completed: The number of jobs that ran successfully
+      failed: The number of jobs moved to the dead letter stream
+    """
+
+    def __init__(
+        self, redis, name, partitions, max_attempts, retry_delay, lease_ttl, block
+    ):
+        self.redis = redis
+        self.name = name
+        self.partitions = partitions
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.lease_ttl = lease_ttl
+        self.block = block
+        self.dead_letter_key = build_dead_letter_key(name)
+        self.completed = 0
+        self.failed = 0
+        self._tasks = []
+
+    def partition(self, key):
+        return zlib.crc32(str(key).encode()) % self.partitions
+
+    async def enqueue(self, name, key, **kwargs):
+        """Queue a job to run after the jobs queued before with the key
+
+        Returns:
+          The id of the job in its stream
+        """
+        if name not in JOBS:
+            raise Exception(f"Unknown job {name}")
+        stream = build_stream_key(self.name, self.partition(key))
+        return await self.redis.xadd(stream, {"job": name, "args": json.dumps(kwargs)})
+
+    def start(self):
+        """Work every partition this process can get the lease of"""
+        if self._tasks:
+            return
+        logger.info(f"Starting {self.partitions} workers of the {self.name} queue")
+        self._tasks = [
+            asyncio.ensure_future(self._work(partition))
+            for partition in range(self.partitions)
+        ]
+
+    async def run(self):
+        """Work the partitions until cancelled"""
+        self.start()
+        try:
+            await asyncio.gather(*self._tasks)
+        finally:
+            await self.stop()
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def _work(self, partition):
+        from aioredis.exceptions import LockError
+
+        stream = build_stream_key(self.name, partition)
+        lease = self.redis.lock(
+            build_lease_key(self.name, partition),
+            timeout=self.lease_ttl,
+            thread_local=False,
+        )
+        while True:
+            try:
+                if not await lease.acquire(blocking=False):
+                    await asyncio.sleep(self.lease_ttl / 3)
+                    continue
+                try:
+                    await self._create_group(stream)
+                    await self._drain(stream, f"partition-{partition}", lease)
+                finally:
+                    await self._release(lease)
+            except LockError:
+                logger.warning(f"Lost the lease of {stream}")
+            except Exception:
+                logger.exception(f"The worker of {stream} failed")
+                await asyncio.sleep(self.retry_delay)
+
+    async def _create_group(self, stream):
+        from aioredis.exceptions import ResponseError
+
+        try:
+            await self.redis.xgroup_create(stream, GROUP, id="0", mkstream=True)
+        except ResponseError as e:
+            if "BUSYGROUP" not in str(e):
+                raise
+
+    async def _release(self, lease):
+        from aioredis.exceptions import LockError
+
+        try:
+            await lease.release()
+        except LockError:
+            pass
+
+    async def _drain(self, stream, consumer, lease):
+        # Jobs read by a previous owner are still pending for the
+        # consumer, read those before any new ones
+        last_id = "0"
+        while True:
+            response = await self.redis.xreadgroup(
+                GROUP,
+                consumer,
+                {stream: last_id},
+                count=READ_COUNT,
+                block=None if last_id == "0" else int(self.block * 1000),
+            )
+            entries = response[0][1] if response else []
+            if last_id == "0" and not entries:
+                last_id = ">"
+            for batch in build_batches(entries):
+                await self._run(stream, batch, lease)
+            await lease.reacquire()
+
+    async def _run(self, stream, entries, lease):
+        _, fields = entries[0]
+        if fields:
+            name = fields[b"job"].decode()
+            args = [json.loads(fields[b"args"]) for _, fields in entries]
+            await self._attempt(stream, entries, name, args, lease)
+        # The jobs are done with either way, the dead letter stream has
+        # a copy of those that failed
+        entry_ids = [entry_id for entry_id, _ in entries]
+        pipe = self.redis.pipeline(transaction=True)
+        pipe.xack(stream, GROUP, *entry_ids)
+        pipe.xdel(stream, *entry_ids)
+        await pipe.execute()
+
+    async def _attempt(self, stream, entries, name, args, lease):
+        job = JOBS.get(name)
+        if job is None:
+            for entry_id, fields in entries:
+                await self._dead_letter(
+                    stream, entry_id, fields, Exception(f"Unknown job {name}")
+                )
+            return
+        if len(entries) > 1:
+            try:
+                await job.run(args)
+                self.completed += len(entries)
+                return
+            except Exception:
+                logger.warning(
+                    f"A batch of {len(entries)} {name} jobs failed, "
+                    "retrying them one at a time",
+                    exc_info=True,
+                )
+            for entry, kwargs in zip(entries, args):
+                await self._attempt(stream, [entry], name, [kwargs], lease)
+            return
+
+        (entry_id, fields), (kwargs,) = entries[0], args
+        error = None
+        for attempt in range(self.max_attempts):
+            if attempt:
+                await asyncio.sleep(self.retry_delay * 2 ** (attempt - 1))
+                await lease.reacquire()
+            try:
+                await (job.run(args) if job.batch_size > 1 else job.run(**kwargs))
+                self.completed += 1
+                return
+            except Exception as e:
+                error = e
+                logger.warning(
+                    f"Job {name} {entry_id} failed on attempt {attempt + 1} "
+                    f"of {self.max_attempts}",
+                    exc_info=True,
+                )
+        await self._dead_letter(stream, entry_id, fields, error)
+        if job.on_failure is not None:
+            try:
+                await job.on_failure(error, **kwargs)
+            except Exception:
+                logger.exception(f"The failure hook of job {name} failed")
+
+    async def _dead_letter(self, stream, entry_id, fields, error):
+        self.failed += 1
+        logger.error(f"Giving up on job {entry_id} of {stream}: {error!r}")
+        await self.redis.xadd(
+            self.dead_letter_key,
+            {**fields, b"stream": stream, b"id": entry_id, b"error": repr(error)},
+        )
+
+
+queue = JobQueue(
+    Redis,
+    "jobs",
+    partitions=constants.Jobs.partitions,
+    max_attempts=constants.Jobs.max_attempts,
+    retry_delay=constants.Jobs.retry_delay,
+    lease_ttl=constants.Jobs.lease_ttl,
+    block=constants.Jobs.block,
+)
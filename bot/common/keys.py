@@ -0,0 +1,60 @@
+import re
+
+from bot import constants
+
+# Bump when the layout of keys changes, keys of older schemas are left
+# for the migration in bot.common.maintenance to move
+SCHEMA_VERSION = 1
+
+NAMESPACE = constants.Cache.namespace
+
+if "{" in NAMESPACE or "}" in NAMESPACE or ":" in NAMESPACE:
+    raise Exception(f"Invalid cache namespace {NAMESPACE}")
+
+# Keys look like "kevin:v1:{1234}:thread". The user id in braces is the
+# redis cluster hash tag, so every key of a user lands in the same slot
+# and scripts touching a value and its version can run in a cluster.
+KEY_PATTERN = re.compile(
+    rf"^{re.escape(NAMESPACE)}:v{SCHEMA_VERSION}:\{{(?P<user_id>[^}}]+)\}}:"
+    r"(?P<kind>[a-z_]+)$"
+)
+
+
+def build_key(user_id, kind):
+    return f"{NAMESPACE}:v{SCHEMA_VERSION}:{{{user_id}}}:{kind}"
+
+
+def build_thread_key(user_id):
+    return build_key(user_id, "thread")
+
+
+def build_congrats_key(user_id):
+    return build_key(user_id, "congrats")
+
+
+def build_lock_key(user_id):
+    return build_key(user_id, "lock")
+
+
+def build_version_key(key):
+    return f"{key}:version"
+
+
+def build_scan_pattern(kind="*"):
+    """A SCAN match pattern for keys of the given kind of every user"""
+    return f"{NAMESPACE}:v{SCHEMA_VERSION}:*:{kind}"
+
+
+def parse_key(key):
+    """Split a key into the user id and kind it was built from
+
+    Returns:
+      A tuple of the user id and kind or None if the key does not
+      belong to this namespace and schema version
+    """
+    if isinstance(key, bytes):
+        key = key.decode()
+    match = KEY_PATTERN.match(key)
+    if not match:
+        return None
+    return match.group("user_id"), match.group("kind")
@@ -0,0 +1,88 @@
+import asyncio
+import logging
+
+from contextlib import asynccontextmanager
+from distutils.util import strtobool
+
+from bot import constants
+from bot.common.keys import build_lock_key
+from bot.config import Redis
+
+logger = logging.getLogger(__name__)
+
+
+class KeyedLock:
+    """Serializes coroutines that share a key
+
+    Coroutines acquiring the same key run one at a time in the
+    order they arrived while coroutines with different keys run
+    concurrently. Locks are dropped once nobody is holding or
+    waiting on them so the table only grows with the number of
+    users that currently have events in flight.
+    """
+
+    def __init__(self):
+        self._locks = {}
+        self._waiters = {}
+
+    @asynccontextmanager
+    async def acquire(self, key):
+        lock = self._locks.get(key)
+        if lock is None:
+            lock = self._locks[key] = asyncio.Lock()
+        self._waiters[key] = self._waiters.get(key, 0) + 1
+        try:
+            async with lock:
+                yield
+        finally:
+            self._waiters[key] -= 1
+            if not self._waiters[key]:
+                del self._waiters[key]
+                del self._locks[key]
+
+
+class RedisKeyedLock(KeyedLock):
+    """A KeyedLock that also holds a Redis lock for the key
+
+    Used when several bot processes share a Redis instance. The
+    in-process lock is taken first so only one coroutine per
+    process polls Redis for a given key.
+
+    Args:
+      redis: The aioredis client holding the locks
+      timeout: Seconds after which Redis releases a lock whose holder
+        died without releasing it
+      blocking_timeout: Seconds to wait for the Redis lock before
+        giving up
+    """
+
+    def __init__(self, redis, timeout, blocking_timeout):
+        super().__init__()
+        self.redis = redis
+        self.timeout = timeout
+        self.blocking_timeout = blocking_timeout
+
+    @asynccontextmanager
+    async def acquire(self, key):
+        async with super().acquire(key):
+            async with self.redis.lock(
+                build_lock_key(key),
+                timeout=self.timeout,
+                blocking_timeout=self.blocking_timeout,
+                thread_local=False,
+            ):
+                yield
+
+
+def build_user_lock():
+    if bool(strtobool(constants.Locks.distributed)):
+        logger.info("Using redis backed user locks")
+        return RedisKeyedLock(
+            Redis,
+            timeout=constants.Locks.timeout,
+            blocking_timeout=constants.Locks.blocking_timeout,
+        )
+    return KeyedLock()
+
+
+user_lock = build_user_lock()
@@ -0,0 +1,201 @@
+import json
+import logging
+import re
+
+from bot.common.keys import (
+    build_congrats_key,
+    build_scan_pattern,
+    build_thread_key,
+    build_version_key,
+)
+from bot.common.serializers import decode_cache_value
+from bot.common.threads.thread_builder import get_thread_ttl
+
+logger = logging.getLogger(__name__)
+
+SCAN_BATCH = 500
+
+# Conversations are either hashes with a json encoded thread field or
+# a single serialized value
+GET_THREAD_SCRIPT = """
+local kind = redis.call("TYPE", KEYS[1]).ok
+if kind == "hash" then
+    return {kind, redis.call("HGET", KEYS[1], "thread")}
+elseif kind == "string" then
+    return {kind, redis.call("GET", KEYS[1])}
+end
+return {kind}
+"""
+
+
+async def conversation_stats(redis, reap=False):
+    """Count live conversations per thread and the memory they use
+
+    Conversations are found by scanning for thread keys. Conversations
+    stored before thread state expired have no ttl; when ``reap`` is
+    set those are deleted if they have been idle for longer than their
+    thread's ttl and otherwise expire after the rest of it.
+
+    Args:
+      redis: The aioredis client conversations are stored in
+      reap: Whether to expire conversations without a ttl
+
+    Returns:
+      A dict with the number of conversations, the bytes they use,
+      conversations per thread, how many had no ttl and how many of
+      those were reaped
+    """
+    stats = {
+        "conversations": 0,
+        "memory": 0,
+        "threads": {},
+        "without_expiry": 0,
+        "reaped": 0,
+    }
+    get_thread = redis.register_script(GET_THREAD_SCRIPT)
+    keys = []
+    async for key in redis.scan_iter(
+        match=build_scan_pattern("thread"), count=SCAN_BATCH
+    ):
+        keys.append(key)
+        if len(keys) >= SCAN_BATCH:
+            await _collect(redis, get_thread, keys, stats, reap)
+            keys = []
+    if keys:
+        await _collect(redis, get_thread, keys, stats, reap)
+    return stats
+
+
+def _thread_name(result):
+    kind, *value = result
+    if not value or value[0] is None:
+        return None
+    if kind == b"hash":
+        return json.loads(value[0])
+    return decode_cache_value(value[0]).get("thread")
+
+
+async def _collect(redis, get_thread, keys, stats, reap):
+    async with redis.pipeline(transaction=False) as pipe:
+        for key in keys:
+            await get_thread(keys=[key], client=pipe)
+            pipe.ttl(key)
+            pipe.object("idletime", key)
+            pipe.memory_usage(key)
+        results = await pipe.execute()
+
+    expired = []
+    async with redis.pipeline(transaction=False) as pipe:
+        for i, key in enumerate(keys):
+            value, ttl, idle, memory = results[i * 4 : (i + 1) * 4]
+            if len(value) < 2:
+                continue
+            thread = _thread_name(value)
+            stats["conversations"] += 1
+            stats["memory"] += memory or 0
+            stats["threads"][thread] = stats["threads"].get(thread, 0) + 1
+            if ttl != -1:
+                continue
+            stats["without_expiry"] += 1
+            if not reap:
+                continue
+            remaining = get_thread_ttl(thread) - (idle or 0)
+            if remaining <= 0:
+                pipe.delete(key, build_version_key(key))
+                expired.append(key)
+            else:
+                pipe.expire(key, remaining)
+                pipe.expire(build_version_key(key), remaining)
+            stats["reaped"] += 1
+        await pipe.execute()
+    if expired:
+        logger.info(f"Deleted {len(expired)} abandoned conversations")
+
+
+# Keys written before keys were namespaced, a regex for each and the
+# builder of the key it moves to
+LEGACY_KEYS = (
+    (re.compile(r"^(\d+)$"), build_thread_key),
+    (re.compile(r"^(\d+)-version$"), lambda i: build_version_key(build_thread_key(i))),
+    (re.compile(r"^(\d+)-congrats$"), build_congrats_key),
+)
+
+
+def migrated_key(key):
+    """The key a key of the unversioned layout moves to, or None"""
+    if isinstance(key, bytes):
+        key = key.decode()
+    for pattern, build in LEGACY_KEYS:
+        match = pattern.match(key)
+        if match:
+            return build(match.group(1))
+    return None
+
+
+async def migrate_keys(redis, dry_run=False):
+    """Move keys stored under bare user ids to the namespaced schema
+
+    Keys are copied with DUMP and RESTORE rather than RENAME, which
+    keeps their ttl and works across redis cluster slots, and the old
+    key is deleted afterwards. If the bot already wrote the new key it
+    is kept and only the old one is deleted. Locks are short lived and
+    are not migrated.
+
+    Args:
+      redis: The aioredis client the keys are stored in
+      dry_run: Whether to only count the keys that would be moved
+
+    Returns:
+      A dict with the number of keys found, moved and skipped because
+      the new key already existed
+    """
+    stats = {"found": 0, "moved": 0, "skipped": 0}
+    batch = []
+    async for key in redis.scan_iter(count=SCAN_BATCH):
+        new_key = migrated_key(key)
+        if new_key is None:
+            continue
+        stats["found"] += 1
+        batch.append((key, new_key))
+        if len(batch) >= SCAN_BATCH:
+            await _migrate(redis, batch, stats, dry_run)
+            batch = []
+    if batch:
+        await _migrate(redis, batch, stats, dry_run)
+    logger.info(f"Key migration: {stats}")
+    return stats
+
+
+async def _migrate(redis, batch, stats, dry_run):
+    from aioredis.exceptions import ResponseError
+
+    if dry_run:
+        return
+    async with redis.pipeline(transaction=False) as pipe:
+        for key, _ in batch:
+            pipe.dump(key)
+            pipe.pttl(key)
+        dumps = await pipe.execute()
+
+    async with redis.pipeline(transaction=False) as pipe:
+        moved = []
+        for i, (key, new_key) in enumerate(batch):
+            data, ttl = dumps[i * 2 : i * 2 + 2]
+            if data is None:
+                # Expired or deleted since the scan
+                continue
+            pipe.restore(new_key, max(ttl, 0), data)
+            moved.append(key)
+        results = await pipe.execute(raise_on_error=False)
+
+    async with redis.pipeline(transaction=False) as pipe:
+        for key, result in zip(moved, results):
+            if isinstance(result, ResponseError):
+                if "BUSYKEY" not in str(result):
+                    logger.error(f"Could not migrate {key}: {result}")
+                    continue
+                stats["skipped"] += 1
+            else:
+                stats["moved"] += 1
+            pipe.delete(key)
+        await pipe.execute()
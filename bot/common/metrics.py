@@ -0,0 +1,327 @@
+import logging
+import threading
+import time
+
+from distutils.util import strtobool
+
+from bot import constants
+
+logger = logging.getLogger(__name__)
+
+# Whether metrics are collected, when they are not timers do nothing
+# and the clients are left as they are
+ENABLED = bool(strtobool(constants.Metrics.enabled))
+
+PREFIX = "kevin"
+
+# Seconds, from a fast Redis command to a slow Airtable page
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+def _format_labels(names, values):
+    if not names:
+        return ""
+    pairs = []
+    for name, value in zip(names, values):
+        value = str(value).replace("\\", "\\\\").replace('"', '\\"')
+        value = value.replace("\n", "\\n")
+        pairs.append(f'{name}="{value}"')
+    return "{" + ",".join(pairs) + "}"
+
+
+class _NullTimer:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+NULL_TIMER = _NullTimer()
+
+
+class _Timer:
+    __slots__ = ("histogram", "labels", "start")
+
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start, *self.labels)
+        return False
+
+
+class Counter:
+    """A count per set of label values
+
+    Args:
+      registry: The Registry the counter is rendered by
+      name: The metric name, without the prefix
+      documentation: The help text of the metric
+      labels: The label names, values are passed in this order
+    """
+
+    kind = "counter"
+
+    def __init__(self, registry, name, documentation, labels=()):
+        self.registry = registry
+        self.name = f"{PREFIX}_{name}"
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount=1):
+        if not self.registry.enabled:
+            return
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            values = dict(self._values)
+        for labels, value in sorted(values.items()):
+            yield f"{self.name}{_format_labels(self.labels, labels)} {value}"
+
+
+class Histogram:
+    """Observations per set of label values, counted into buckets
+
+    Observations can come from the executor threads Airtable requests
+    run in, so updates hold a lock.
+
+    Args:
+      registry: The Registry the histogram is rendered by
+      name: The metric name, without the prefix
+      documentation: The help text of the metric
+      labels: The label names, values are passed in this order
+      buckets: The upper bounds of the buckets in increasing order
+    """
+
+    kind = "histogram"
+
+    def __init__(self, registry, name, documentation, labels=(), buckets=None):
+        self.registry = registry
+        self.name = f"{PREFIX}_{name}"
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets or DEFAULT_BUCKETS)
+        # Label values to [bucket counts..., count, sum]
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        if not self.registry.enabled:
+            return
+        with self._lock:
+            values = self._values.get(labels)
+            if values is None:
+                values = self._values[labels] = [0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    values[i] += 1
+                    break
+            values[-2] += 1
+            values[-1] += value
+
+    def time(self, *labels):
+        """A context manager that observes the seconds its block took"""
+        if not self.registry.enabled:
+            return NULL_TIMER
+        return _Timer(self, labels)
+
+    def count(self, *labels):
+        """The number of observations with the given label values"""
+        values = self._values.get(labels)
+        return values[-2] if values else 0
+
+    def samples(self):
+        with self._lock:
+            values = {labels: list(v) for labels, v in self._values.items()}
+        names = self.labels + ("le",)
+        for labels, counts in sorted(values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                yield (
+                    f"{self.name}_bucket"
+                    f"{_format_labels(names, labels + (bound,))} {cumulative}"
+                )
+            yield (
+                f"{self.name}_bucket"
+                f"{_format_labels(names, labels + ('+Inf',))} {counts[-2]}"
+            )
+            label_text = _format_labels(self.labels, labels)
+            yield f"{self.name}_count{label_text} {counts[-2]}"
+            yield f"{self.name}_sum{label_text} {counts[-1]}"
+
+
+class Registry:
+    """The metrics of a process, rendered in the Prometheus text format
+
+    Args:
+      enabled: Whether the metrics record anything
+    """
+
+    def __init__(self, enabled):
+        self.enabled = enabled
+        self.metrics = []
+
+    def counter(self, name, documentation, labels=()):
+        metric = Counter(self, name, documentation, labels)
+        self.metrics.append(metric)
+        return metric
+
+    def histogram(self, name, documentation, labels=(), buckets=None):
+        metric = Histogram(self, name, documentation, labels, buckets)
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.samples())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry(ENABLED)
+
+EVENT_SECONDS = registry.histogram(
+    "thread_event_seconds",
+    "Seconds a thread took to handle an event, including saving its state",
+    ("thread", "event"),
+)
+STEP_SECONDS = registry.histogram(
+    "step_seconds",
+    "Seconds a step spent in each phase",
+    ("thread", "step", "phase"),
+)
+AIRTABLE_SECONDS = registry.histogram(
+    "airtable_request_seconds",
+    "Seconds Airtable API requests took",
+    ("table", "method"),
+)
+AIRTABLE_ERRORS = registry.counter(
+    "airtable_request_errors_total",
+    "Airtable API requests that failed",
+    ("table", "method"),
+)
+REDIS_SECONDS = registry.histogram(
+    "redis_command_seconds",
+    "Seconds Redis commands and pipelines took",
+    ("command",),
+)
+DISCORD_SECONDS = registry.histogram(
+    "discord_request_seconds",
+    "Seconds Discord REST requests took",
+    ("method", "route"),
+)
+
+
+def instrument_airtable(table):
+    """Time the API requests a pyairtable Table makes
+
+    Every page of a listing is a request of its own.
+    """
+    if not registry.enabled:
+        return table
+    request = table._request
+    name = table.table_name
+
+    def _request(method, url, *args, **kwargs):
+        with AIRTABLE_SECONDS.time(name, method):
+            try:
+                return request(method, url, *args, **kwargs)
+            except Exception:
+                AIRTABLE_ERRORS.inc(name, method)
+                raise
+
+    table._request = _request
+    return table
+
+
+def _instrument_pipeline(pipe):
+    execute = pipe.execute
+
+    async def _execute(*args, **kwargs):
+        with REDIS_SECONDS.time("pipeline"):
+            return await execute(*args, **kwargs)
+
+    pipe.execute = _execute
+    return pipe
+
+
+def instrument_redis(client):
+    """Time the commands and pipelines of an aioredis client
+
+    Scripts are timed as EVALSHA.
+    """
+    if not registry.enabled:
+        return client
+    execute_command = client.execute_command
+    pipeline = client.pipeline
+
+    async def _execute_command(*args, **options):
+        with REDIS_SECONDS.time(str(args[0]).upper()):
+            return await execute_command(*args, **options)
+
+    def _pipeline(*args, **kwargs):
+        return _instrument_pipeline(pipeline(*args, **kwargs))
+
+    client.execute_command = _execute_command
+    client.pipeline = _pipeline
+    return client
+
+
+def instrument_discord(bot):
+    """Time the REST requests of a discord client by route"""
+    if not registry.enabled:
+        return bot
+    request = bot.http.request
+
+    async def _request(route, **kwargs):
+        with DISCORD_SECONDS.time(route.method, route.path):
+            return await request(route, **kwargs)
+
+    bot.http.request = _request
+    return bot
+
+
+_runner = None
+
+
+async def start_server(host=None, port=None):
+    """Serve the metrics on http://host:port/metrics
+
+    Only the first call starts a server, so it can be called whenever
+    the bot (re)connects.
+
+    Returns:
+      The aiohttp AppRunner, or None when metrics are disabled
+    """
+    global _runner
+    if not registry.enabled or _runner is not None:
+        return _runner
+    from aiohttp import web
+
+    async def handle(request):
+        return web.Response(
+            text=registry.render(), content_type="text/plain", charset="utf-8"
+        )
+
+    host = host or constants.Metrics.host
+    port = int(port or constants.Metrics.port)
+    app = web.Application()
+    app.router.add_get("/metrics", handle)
+    _runner = web.AppRunner(app, access_log=None)
+    await _runner.setup()
+    await web.TCPSite(_runner, host, port).start()
+    logger.info(f"Serving metrics on http://{host}:{port}/metrics")
+    return _runner
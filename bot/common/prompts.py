@@ -0,0 +1,145 @@
+import asyncio
+import logging
+
+from collections import deque
+
+import discord
+
+from bot import constants
+from bot.common.keys import NAMESPACE
+
+logger = logging.getLogger(__name__)
+
+
+class ReactionQueue:
+    """Adds reactions to messages in the background
+
+    Each channel has a single worker adding its reactions in the order
+    they were queued. Discord rate limits reactions per channel, so one
+    worker waits out the limit for every prompt in the channel instead
+    of each prompt waiting in turn, and whoever queued the reactions
+    does not wait at all.
+
+    Attributes:
+      failed: The number of reactions that could not be added
+    """
+
+    def __init__(self):
+        self.failed = 0
+        self._queues = {}
+        self._workers = {}
+
+    def add(self, message, emojis):
+        channel_id = message.channel.id
+        queue = self._queues.setdefault(channel_id, deque())
+        queue.extend((message, emoji) for emoji in emojis)
+        if channel_id not in self._workers:
+            self._workers[channel_id] = asyncio.ensure_future(self._drain(channel_id))
+
+    async def join(self):
+        """Wait until every queued reaction was added"""
+        while self._workers:
+            await asyncio.gather(*self._workers.values())
+
+    async def _drain(self, channel_id):
+        queue = self._queues[channel_id]
+        try:
+            while queue:
+                message, emoji = queue.popleft()
+                try:
+                    await message.add_reaction(emoji)
+                except discord.HTTPException:
+                    self.failed += 1
+                    logger.exception(f"Failed to add {emoji} to {message.id}")
+        finally:
+            del self._workers[channel_id]
+            del self._queues[channel_id]
+
+
+reactions = ReactionQueue()
+
+# Prompts with more choices than fit in a row of buttons get a select menu
+MAX_BUTTONS = 5
+SELECT_CHOICE = "select"
+
+
+def build_custom_id(user_id, choice):
+    return f"{NAMESPACE}:prompt:{user_id}:{choice}"
+
+
+def build_prompt_view(user_id, emojis):
+    """Buttons, or a select menu, to answer a prompt with one of the emojis
+
+    The custom id of each component carries the user the prompt is for
+    and the emoji it stands for. Answers are routed by the interaction
+    listener in bot.common.commands, so the view is stopped before it
+    is sent and the library never dispatches to it.
+    """
+    view = discord.ui.View(timeout=None)
+    if len(emojis) <= MAX_BUTTONS:
+        for emoji in emojis:
+            view.add_item(
+                discord.ui.Button(
+                    emoji=emoji, custom_id=build_custom_id(user_id, emoji)
+                )
+            )
+    else:
+        view.add_item(
+            discord.ui.Select(
+                custom_id=build_custom_id(user_id, SELECT_CHOICE),
+                options=[
+                    discord.SelectOption(label=emoji, value=emoji, emoji=emoji)
+                    for emoji in emojis
+                ],
+            )
+        )
+    view.stop()
+    return view
+
+
+def parse_prompt_interaction(interaction):
+    """The user and emoji a prompt component interaction answers with
+
+    Returns:
+      A tuple of the user id the prompt was sent to and the chosen
+      emoji or None if the interaction is not an answer to a prompt
+    """
+    if interaction.type != discord.InteractionType.component:
+        return None
+    data = interaction.data or {}
+    parts = data.get("custom_id", "").split(":", 3)
+    if len(parts) != 4 or parts[0] != NAMESPACE or parts[1] != "prompt":
+        return None
+    _, _, user_id, choice = parts
+    if choice == SELECT_CHOICE:
+        values = data.get("values") or [None]
+        choice = values[0]
+    if not user_id.isdigit() or choice is None:
+        return None
+    return int(user_id), choice
+
+
+async def send_prompt(destination, *args, emojis=(), user_id=None, **kwargs):
+    """Send a message the user answers by picking one of the emojis
+
+    Depending on ``prompts.style`` the emojis are either added as
+    reactions in the background or sent as buttons or a select menu
+    along with the message. The message is returned as soon as it was
+    sent so the thread can move on and store its state.
+
+    Args:
+      destination: Anything with a ``send`` coroutine, a channel, user
+        or interaction followup
+      emojis: The emojis to choose from in order
+      user_id: The user answering the prompt, needed for components
+      args, kwargs: Passed on to ``send``
+
+    Returns:
+      The sent message
+    """
+    if constants.Prompts.style == "components" and user_id is not None:
+        view = build_prompt_view(user_id, list(emojis))
+        return await destination.send(*args, view=view, **kwargs)
+    message = await destination.send(*args, **kwargs)
+    reactions.add(message, emojis)
+    return message
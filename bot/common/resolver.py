@@ -0,0 +1,99 @@
+import asyncio
+import logging
+
+from discord.utils import find
+
+from bot import constants
+from bot.common.bot.bot import bot as discord_bot
+from bot.common.cache import LRUCache
+
+logger = logging.getLogger(__name__)
+
+
+class EntityResolver:
+    """Looks up discord users, channels, guilds and messages
+
+    The gateway cache of the bot is checked first. Only when an entity
+    is missing from it is it fetched over REST; users, channels and
+    guilds fetched that way are kept in an LRU cache for a while and
+    concurrent fetches of the same entity share a single request.
+
+    Messages are not kept since their reactions change, a message
+    missing from the gateway cache is always fetched.
+
+    Args:
+      bot: The discord bot client
+      maxsize: The number of entities of each kind kept after a fetch
+      ttl: Seconds a fetched entity is kept for
+
+    Attributes:
+      fetches: The number of REST requests made
+    """
+
+    def __init__(self, bot, maxsize, ttl):
+        self.bot = bot
+        self.users = LRUCache(maxsize, ttl)
+        self.channels = LRUCache(maxsize, ttl)
+        self.guilds = LRUCache(maxsize, ttl)
+        self.fetches = 0
+        self._inflight = {}
+
+    async def get_user(self, user_id):
+        user_id = int(user_id)
+        user = self.bot.get_user(user_id)
+        if user is not None:
+            return user
+        return await self._fetch(self.users, user_id, self.bot.fetch_user)
+
+    async def get_channel(self, channel_id):
+        channel_id = int(channel_id)
+        channel = self.bot.get_channel(channel_id)
+        if channel is not None:
+            return channel
+        return await self._fetch(self.channels, channel_id, self.bot.fetch_channel)
+
+    async def get_guild(self, guild_id):
+        guild_id = int(guild_id)
+        guild = self.bot.get_guild(guild_id)
+        if guild is not None:
+            return guild
+        return await self._fetch(self.guilds, guild_id, self.bot.fetch_guild)
+
+    async def get_message(self, channel, message_id):
+        message = find(lambda m: m.id == message_id, reversed(self.bot.cached_messages))
+        if message is not None:
+            return message
+        self.fetches += 1
+        return await channel.fetch_message(message_id)
+
+    async def _fetch(self, cache, id_, fetch):
+        entity = cache.get(id_)
+        if entity is not None:
+            return entity
+        key = (id(cache), id_)
+        task = self._inflight.get(key)
+        if task is None:
+            self.fetches += 1
+            task = asyncio.ensure_future(fetch(id_))
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        # A waiter being cancelled must not cancel the fetch for the others
+        entity = await asyncio.shield(task)
+        cache.set(id_, entity)
+        return entity
+
+
+resolver = EntityResolver(
+    discord_bot,
+    maxsize=constants.Resolver.maxsize,
+    ttl=constants.Resolver.ttl,
+)
+
+
+def get_resolver(bot):
+    """The resolver of the given bot, shared for the bot the app runs"""
+    if bot is discord_bot:
+        return resolver
+    return EntityResolver(
+        bot, maxsize=constants.Resolver.maxsize, ttl=constants.Resolver.ttl
+    )
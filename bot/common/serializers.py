@@ -0,0 +1,193 @@
+import json
+import struct
+import zlib
+
+from abc import ABC, abstractmethod
+
+try:
+    import msgpack
+except ImportError:  # pragma: no cover
+    msgpack = None
+
+# Values starting with "{" are the json encoding every state was
+# stored with before serializers were pluggable
+JSON_MARKER = b"{"
+COMPACT_MARKER = b"\x01"
+MSGPACK_MARKER = b"\x02"
+
+# Thread names are stored as their index in this tuple plus one, only
+# ever append to it or states already in the cache will decode wrong
+THREAD_CODES = (
+    "onboarding",
+    "update_profile",
+    "initial_contributions",
+    "guild_select",
+    "report",
+    "points",
+)
+
+# Metadata larger than this is zlib compressed
+COMPRESS_THRESHOLD = 128
+
+_NONE = 0
+_INT = 1
+_STR = 2
+_SHA256 = 3
+
+_HEADER_FIELDS = ("thread", "step", "guild_id", "message_id")
+
+
+class Serializer(ABC):
+    """Encodes the thread state dict stored in the cache"""
+
+    @abstractmethod
+    def encode(self, values):
+        pass
+
+    @abstractmethod
+    def decode(self, data):
+        pass
+
+
+class JsonSerializer(Serializer):
+    def encode(self, values):
+        return json.dumps(values)
+
+    def decode(self, data):
+        return json.loads(data)
+
+
+class CompactSerializer(Serializer):
+    """A binary encoding of the thread state
+
+    The thread, step, guild_id and message_id are packed into a small
+    header: thread names become a one byte code, step hashes their 32
+    raw bytes and discord ids 8 byte integers. The remaining values,
+    usually just the metadata, are stored as json and compressed once
+    they grow past COMPRESS_THRESHOLD bytes.
+    """
+
+    def encode(self, values):
+        out = bytearray(COMPACT_MARKER)
+        thread = values.get("thread")
+        code = THREAD_CODES.index(thread) + 1 if thread in THREAD_CODES else 0
+        out.append(code)
+        if not code:
+            _pack(out, thread)
+        _pack(out, values.get("step"), is_step=True)
+        _pack(out, values.get("guild_id"))
+        _pack(out, values.get("message_id"))
+
+        rest = {k: v for k, v in values.items() if k not in _HEADER_FIELDS}
+        body = json.dumps(rest, separators=(",", ":")).encode()
+        if len(body) > COMPRESS_THRESHOLD:
+            out.append(1)
+            out += zlib.compress(body)
+        else:
+            out.append(0)
+            out += body
+        return bytes(out)
+
+    def decode(self, data):
+        view = memoryview(data)
+        pos = 1
+        code = view[pos]
+        pos += 1
+        if code:
+            thread = THREAD_CODES[code - 1]
+        else:
+            thread, pos = _unpack(view, pos)
+        step, pos = _unpack(view, pos)
+        guild_id, pos = _unpack(view, pos)
+        message_id, pos = _unpack(view, pos)
+        compressed = view[pos]
+        body = bytes(view[pos + 1 :])
+        if compressed:
+            body = zlib.decompress(body)
+        return {
+            "thread": thread,
+            "step": step,
+            "guild_id": guild_id,
+            "message_id": message_id,
+            **json.loads(body),
+        }
+
+
+class MsgpackSerializer(Serializer):
+    def __init__(self):
+        if msgpack is None:
+            raise Exception("The msgpack serializer requires msgpack to be installed")
+
+    def encode(self, values):
+        return MSGPACK_MARKER + msgpack.packb(values)
+
+    def decode(self, data):
+        return msgpack.unpackb(data[1:])
+
+
+def _pack(out, value, is_step=False):
+    if value is None:
+        out.append(_NONE)
+    elif isinstance(value, int) and 0 <= value < 2**64:
+        out.append(_INT)
+        out += struct.pack(">Q", value)
+    elif is_step and _is_sha256(value):
+        out.append(_SHA256)
+        out += bytes.fromhex(value)
+    else:
+        encoded = str(value).encode()
+        out.append(_STR)
+        out += struct.pack(">H", len(encoded))
+        out += encoded
+
+
+def _unpack(view, pos):
+    kind = view[pos]
+    pos += 1
+    if kind == _NONE:
+        return None, pos
+    if kind == _INT:
+        return struct.unpack_from(">Q", view, pos)[0], pos + 8
+    if kind == _SHA256:
+        return bytes(view[pos : pos + 32]).hex(), pos + 32
+    (length,) = struct.unpack_from(">H", view, pos)
+    pos += 2
+    return bytes(view[pos : pos + length]).decode(), pos + length
+
+
+def _is_sha256(value):
+    if not isinstance(value, str) or len(value) != 64:
+        return False
+    try:
+        bytes.fromhex(value)
+    except ValueError:
+        return False
+    return value == value.lower()
+
+
+SERIALIZERS = {
+    "json": JsonSerializer,
+    "compact": CompactSerializer,
+    "msgpack": MsgpackSerializer,
+}
+
+_json = JsonSerializer()
+_compact = CompactSerializer()
+
+
+def get_serializer(name):
+    if name not in SERIALIZERS:
+        raise Exception(f"Unknown serializer {name}")
+    return SERIALIZERS[name]()
+
+
+def decode_cache_value(data):
+    """Decode a cached thread state whichever serializer wrote it"""
+    if isinstance(data, str):
+        data = data.encode()
+    marker = data[:1]
+    if marker == COMPACT_MARKER:
+        return _compact.decode(data)
+    if marker == MSGPACK_MARKER:
+        return MsgpackSerializer().decode(data)
+    return _json.decode(data)
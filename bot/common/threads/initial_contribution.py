@@ -1,17 +1,15 @@
 import discord
 import hashlib
-from bot.common.airtable import (
-    add_user_to_contribution,
-    get_highest_contribution_records,
-    get_contribution_records,
-    get_user_record,
-)
+from bot.common.contributions import contributions
+from bot.common.prompts import send_prompt
+from bot.common.writes import save_contribution_user
 from bot.common.threads.thread_builder import (
     BaseThread,
     BaseStep,
     StepKeys,
     Step,
     ThreadKeys,
+    register_thread,
 )
 from bot.config import YES_EMOJI, NO_EMOJI, INFO_EMBED_COLOR
 
@@ -38,15 +36,9 @@ class SendContributionInstructions(BaseStep):
 
     async def send(self, message, user_id):
         channel = message.channel
-        user_record = await get_user_record(user_id, self.guild_id)
-        user_dao_id = user_record.get("fields").get("user_dao_id")
-
-        record = await get_highest_contribution_records(
-            self.guild_id,
-            user_dao_id,
-            self.total_contributions,
-        )
-        if record:
+        if await contributions.has_completed(
+            self.guild_id, user_id, self.total_contributions
+        ):
             embed = discord.Embed(
                 colour=INFO_EMBED_COLOR,
                 description="You have already completed all of the"
@@ -62,11 +54,11 @@ class SendContributionInstructions(BaseStep):
             description=self.instruction,
             title="Have you completed the below?",
         )
-        sent_message = await channel.send(embed=embed)
-        await sent_message.add_reaction(YES_EMOJI)
-        await sent_message.add_reaction(NO_EMOJI)
+        sent_message = await send_prompt(
+            channel, embed=embed, emojis=[YES_EMOJI, NO_EMOJI], user_id=user_id
+        )
 
-        await add_user_to_contribution(self.guild_id, user_id, self.contribution_number)
+        await save_contribution_user(user_id, self.guild_id, self.contribution_number)
 
         return sent_message, None
 
@@ -141,13 +133,14 @@ class InitialContributionReportCommand(BaseStep):
         return message, None
 
 
+@register_thread
 class InitialContributions(BaseThread):
     name = ThreadKeys.INITIAL_CONTRIBUTIONS.value
 
     async def build_steps(self):
         if not self.guild_id:
             raise Exception("No provided guild_id for Initial Contribution thread")
-        contribution_records = await get_contribution_records(self.guild_id)
+        contribution_records = await contributions.get_flow(self.guild_id)
         previous_step = None
         for i, record in enumerate(
             sorted(
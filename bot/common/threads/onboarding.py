@@ -2,11 +2,8 @@ from bot import constants
 import discord
 from bot.common.airtable import (
     find_user,
-    update_member,
-    update_user,
     get_guild_by_guild_id,
     get_user_record,
-    create_user,
 )
 from bot.config import (
     YES_EMOJI,
@@ -14,12 +11,16 @@ from bot.config import (
     SKIP_EMOJI,
     INFO_EMBED_COLOR,
 )
+from bot.common.prompts import send_prompt
+from bot.common.resolver import get_resolver
+from bot.common.writes import save_member_fields, save_new_user, save_user_fields
 from bot.common.threads.thread_builder import (
     BaseStep,
     StepKeys,
     Step,
     ThreadKeys,
     BaseThread,
+    register_thread,
 )
 
 
@@ -43,11 +44,14 @@ class UserDisplayConfirmationStep(BaseStep):
         return [YES_EMOJI, NO_EMOJI]
 
     async def send(self, message, user_id):
-        user = await self.bot.fetch_user(user_id)
+        user = await get_resolver(self.bot).get_user(user_id)
         channel = message.channel
-        sent_message = await channel.send(f"{self.msg} `{user.display_name}`")
-        await sent_message.add_reaction(YES_EMOJI)
-        await sent_message.add_reaction(NO_EMOJI)
+        sent_message = await send_prompt(
+            channel,
+            f"{self.msg} `{user.display_name}`",
+            emojis=[YES_EMOJI, NO_EMOJI],
+            user_id=user_id,
+        )
         return sent_message, None
 
 
@@ -74,12 +78,9 @@ class UserDisplayConfirmationEmojiStep(BaseStep):
         raise Exception("Reacted with the wrong emoji")
 
     async def save(self, message, guild_id, user_id):
-        user = await self.bot.fetch_user(user_id)
-        record_id = await find_user(user_id, guild_id)
-        await update_user(record_id, "display_name", user.name)
-        user_record = await get_user_record(user_id, guild_id)
-        member_id = user_record.get("fields").get("Members")[0]
-        await update_member(member_id, "Name", user.name)
+        user = await get_resolver(self.bot).get_user(user_id)
+        await save_user_fields(user_id, guild_id, {"display_name": user.name})
+        await save_member_fields(user_id, guild_id, {"Name": user.name})
 
 
 class UserDisplaySubmitStep(BaseStep):
@@ -95,12 +96,9 @@ class UserDisplaySubmitStep(BaseStep):
         return sent_message, None
 
     async def save(self, message, guild_id, user_id):
-        record_id = await find_user(user_id, guild_id)
         val = message.content.strip()
-        await update_user(record_id, "display_name", val)
-        user_record = await get_user_record(user_id, guild_id)
-        member_id = user_record.get("fields").get("Members")[0]
-        await update_member(member_id, "Name", val)
+        await save_user_fields(user_id, guild_id, {"display_name": val})
+        await save_member_fields(user_id, guild_id, {"Name": val})
 
     async def handle_emoji(self, raw_reaction):
         return _handle_skip_emoji(raw_reaction, self.guild_id)
@@ -123,9 +121,10 @@ class AddUserTwitterStep(BaseStep):
         return sent_message, None
 
     async def save(self, message, guild_id, user_id):
-        record_id = await find_user(message.author.id, guild_id)
-        await update_user(
-            record_id, "twitter", message.content.strip().replace("@", "")
+        await save_user_fields(
+            message.author.id,
+            guild_id,
+            {"twitter": message.content.strip().replace("@", "")},
         )
 
     async def handle_emoji(self, raw_reaction):
@@ -149,8 +148,9 @@ class AddUserWalletAddressStep(BaseStep):
         return sent_message, None
 
     async def save(self, message, guild_id, user_id):
-        record_id = await find_user(message.author.id, guild_id)
-        await update_user(record_id, "wallet", message.content.strip())
+        await save_user_fields(
+            message.author.id, guild_id, {"wallet": message.content.strip()}
+        )
 
     async def handle_emoji(self, raw_reaction):
         return _handle_skip_emoji(raw_reaction, self.guild_id)
@@ -173,8 +173,9 @@ class AddDiscourseStep(BaseStep):
         return sent_message, None
 
     async def save(self, message, guild_id, user_id):
-        record_id = await find_user(message.author.id, guild_id)
-        await update_user(record_id, "discourse", message.content.strip())
+        await save_user_fields(
+            message.author.id, guild_id, {"discourse": message.content.strip()}
+        )
 
     async def handle_emoji(self, raw_reaction):
         return _handle_skip_emoji(raw_reaction, self.guild_id)
@@ -192,7 +193,7 @@ class CongratsStep(BaseStep):
 
     async def send(self, message, user_id):
         channel = message.channel
-        guild = await self.bot.fetch_guild(self.guild_id)
+        guild = await get_resolver(self.bot).get_guild(self.guild_id)
         sent_message = await channel.send(
             f"Congratulations on completeing onboarding to {guild.name}"
         )
@@ -200,8 +201,8 @@ class CongratsStep(BaseStep):
 
     async def handle_emoji(self, raw_reaction):
         if SKIP_EMOJI in raw_reaction.emoji.name:
-            channel = await self.bot.fetch_channel(raw_reaction.channel_id)
-            guild = await self.bot.fetch_guild(self.guild_id)
+            channel = await get_resolver(self.bot).get_channel(raw_reaction.channel_id)
+            guild = await get_resolver(self.bot).get_guild(self.guild_id)
             await channel.send(
                 f"Congratulations on completeing onboarding to {guild.name}"
             )
@@ -222,11 +223,12 @@ class GovrnProfilePrompt(BaseStep):
 
     async def send(self, message, user_id):
         channel = message.channel
-        sent_message = await channel.send(
-            "Would you like to be onboarded to the govrn guild as well?"
+        sent_message = await send_prompt(
+            channel,
+            "Would you like to be onboarded to the govrn guild as well?",
+            emojis=[YES_EMOJI, NO_EMOJI],
+            user_id=user_id,
         )
-        await sent_message.add_reaction(YES_EMOJI)
-        await sent_message.add_reaction(NO_EMOJI)
         return sent_message, None
 
 
@@ -274,12 +276,13 @@ class GovrnProfilePromptSuccess(BaseStep):
         record = await get_guild_by_guild_id(self.guild_id)
         fields = record.get("fields")
 
-        sent_message = await channel.send(
+        sent_message = await send_prompt(
+            channel,
             "Would you like to reuse your profile data from "
-            f"{fields.get('guild_name')} guild?"
+            f"{fields.get('guild_name')} guild?",
+            emojis=[YES_EMOJI, NO_EMOJI],
+            user_id=user_id,
         )
-        await sent_message.add_reaction(YES_EMOJI)
-        await sent_message.add_reaction(NO_EMOJI)
         return sent_message, None
 
 
@@ -297,7 +300,7 @@ class GovrnProfilePromptSuccessEmoji(BaseStep):
 
     async def handle_emoji(self, raw_reaction):
         if raw_reaction.emoji.name in self.emojis:
-            await create_user(self.parent.user_id, constants.Bot.govrn_guild_id)
+            await save_new_user(self.parent.user_id, constants.Bot.govrn_guild_id)
             if NO_EMOJI in raw_reaction.emoji.name:
                 self.parent.guild_id = constants.Bot.govrn_guild_id
                 return StepKeys.USER_DISPLAY_SUBMIT.value, None
@@ -315,13 +318,12 @@ class GovrnProfilePromptReuse(BaseStep):
         channel = message.channel
         current_profile = await get_user_record(user_id, self.guild_id)
         fields = current_profile.get("fields")
-
-        govrn_profile = await get_user_record(user_id, constants.Bot.govrn_guild_id)
-        record_id = govrn_profile.get("id")
-        await update_user(record_id, "display_name", fields.get("display_name"))
-        await update_user(record_id, "twitter", fields.get("twitter"))
-        await update_user(record_id, "wallet", fields.get("wallet"))
-        await update_user(record_id, "discourse", fields.get("discourse"))
+        profile_fields = ("display_name", "twitter", "wallet", "discourse")
+        await save_user_fields(
+            user_id,
+            constants.Bot.govrn_guild_id,
+            {field: fields.get(field) for field in profile_fields},
+        )
 
         embed = discord.Embed(
             colour=INFO_EMBED_COLOR,
@@ -339,6 +341,7 @@ class GovrnProfilePromptReuse(BaseStep):
 # Threads #
 
 
+@register_thread
 class Onboarding(BaseThread):
     name = ThreadKeys.ONBOARDING.value
 
@@ -12,12 +12,13 @@ from bot.common.threads.thread_builder import (
     BaseStep,
     StepKeys,
     Step,
-    build_cache_value,
+    register_thread,
 )
 from bot.common.airtable import (
     get_user_record,
     get_contributions,
 )
+from bot.common.prompts import send_prompt
 from bot.config import (
     YES_EMOJI,
     NO_EMOJI,
@@ -79,9 +80,9 @@ class DisplayPointsStep(BaseStep):
     name = StepKeys.DISPLAY_POINTS.value
     trigger = True
 
-    def __init__(self, guild_id, cache, bot, context, days=None):
+    def __init__(self, guild_id, state, bot, context, days=None):
         self.guild_id = guild_id
-        self.cache = cache
+        self.state = state
         self.bot = bot
         self.context = context
         self.days = days
@@ -131,12 +132,11 @@ class DisplayPointsStep(BaseStep):
 
         fields = record.get("fields")
         global_id = fields.get("global_id")
-        cache_entry = await self.cache.get(user_id)
-        cache_values = json.loads(cache_entry)
-        metadata = cache_values.get("metadata")
+        state = await self.state.load()
+        metadata = state.metadata
         print("points " + str(user_id))
         days = self.days
-        if cache_entry:
+        if state.values:
             days = metadata.get("days")
         date = None
         td = (
@@ -168,8 +168,7 @@ class DisplayPointsStep(BaseStep):
             return sent_message, metadata
 
         metadata["contribution_rows"] = contribution_rows
-        cache_values["metadata"] = metadata
-        await self.cache.set(user_id, build_cache_value(**cache_values))
+        self.state.set_metadata(metadata)
 
         return sent_message, metadata
 
@@ -184,11 +183,12 @@ class GetContributionsCsvPropmt(BaseStep):
     name = StepKeys.POINTS_CSV_PROMPT.value
 
     async def send(self, message, user_id):
-        sent_message = await message.channel.send(
-            content="Would you like a .csv file of your contributions?"
+        sent_message = await send_prompt(
+            message.channel,
+            content="Would you like a .csv file of your contributions?",
+            emojis=[YES_EMOJI, NO_EMOJI],
+            user_id=user_id,
         )
-        await sent_message.add_reaction(YES_EMOJI)
-        await sent_message.add_reaction(NO_EMOJI)
 
         return sent_message, None
 
@@ -217,13 +217,12 @@ class GetContributionsCsvPropmtAccept(BaseStep):
 
     name = StepKeys.POINTS_CSV_PROMPT_ACCEPT.value
 
-    def __init__(self, cache):
-        self.cache = cache
+    def __init__(self, state):
+        self.state = state
 
     async def send(self, message, user_id):
-        cache_entry = await self.cache.get(user_id)
-        cache_values = json.loads(cache_entry)
-        contributions = cache_values.get("metadata").get("contribution_rows")
+        state = await self.state.load()
+        contributions = state.metadata.get("contribution_rows")
 
         csv_file = build_csv_file(contributions[0], contributions[1], user_id)
 
@@ -232,6 +231,7 @@ class GetContributionsCsvPropmtAccept(BaseStep):
         return msg, None
 
 
+@register_thread
 class Points(BaseThread):
     name = ThreadKeys.POINTS.value
 
@@ -239,13 +239,13 @@ class Points(BaseThread):
         display_points_step = Step(
             current=DisplayPointsStep(
                 guild_id=self.guild_id,
-                cache=self.cache,
+                state=self.state,
                 bot=self.bot,
                 context=self.context,
             )
         )
 
-        points_csv_accept = Step(current=GetContributionsCsvPropmtAccept(self.cache))
+        points_csv_accept = Step(current=GetContributionsCsvPropmtAccept(self.state))
 
         return (
             display_points_step.add_next_step(GetContributionsCsvPropmt())
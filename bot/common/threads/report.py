@@ -6,14 +6,15 @@ from bot.common.threads.thread_builder import (
     BaseStep,
     StepKeys,
     Step,
+    register_thread,
 )
-from bot.config import read_file
 from bot.common.airtable import (
-    get_guild_by_guild_id,
     get_contribution_count,
     get_user_record,
 )
-from bot.common.cache import build_congrats_key
+from bot.common.guilds import guild_registry
+from bot.common.keys import build_congrats_key
+from bot.common.resolver import get_resolver
 
 logger = logging.getLogger(__name__)
 
@@ -34,8 +35,8 @@ class ReportStep(BaseStep):
         if message:
             channel = message.channel
 
-        airtableLinks = read_file()
-        airtableLink = airtableLinks.get(str(self.guild_id))
+        guild = await guild_registry.get(self.guild_id)
+        airtableLink = guild.report_link if guild else None
 
         msg = (
             f"Woohoo! Nice job! Community contributions are what keeps"
@@ -45,14 +46,15 @@ class ReportStep(BaseStep):
         if message:
             await channel.send(msg)
         if not await self.cache.get(build_congrats_key(user_id)):
-            fields = await get_guild_by_guild_id(self.guild_id)
-            congrats_channel_id = fields.get("fields").get("congrats_channel_id")
-            base_id = fields.get("fields").get("base_id")
+            fields = guild.fields if guild else {}
+            congrats_channel_id = fields.get("congrats_channel_id")
+            base_id = fields.get("base_id")
             if not congrats_channel_id:
                 logger.warn("No congrats channel id!")
                 return None, {"msg": msg}
-            channel = self.bot.get_channel(int(congrats_channel_id))
-            user = self.bot.get_user(user_id)
+            resolver = get_resolver(self.bot)
+            channel = await resolver.get_channel(congrats_channel_id)
+            user = await resolver.get_user(user_id)
             # get count of uses
             record = await get_user_record(user_id, self.guild_id)
             fields = record.get("fields")
@@ -69,6 +71,7 @@ class ReportStep(BaseStep):
         return None, {"msg": msg}
 
 
+@register_thread
 class Report(BaseThread):
     name = ThreadKeys.REPORT.value
 
@@ -1,8 +1,4 @@
-import json
-from bot.config import Redis
-
 from bot.common.threads.thread_builder import BaseStep, StepKeys
-from bot.common.bot.bot import bot
 
 
 class SelectGuildEmojiStep(BaseStep):
@@ -21,18 +17,13 @@ class SelectGuildEmojiStep(BaseStep):
         self.cls = cls
 
     async def handle_emoji(self, raw_reaction):
-        channel = await bot.fetch_channel(raw_reaction.channel_id)
-        message = await channel.fetch_message(raw_reaction.message_id)
-        key_vals = await Redis.get(raw_reaction.user_id)
-        if not key_vals:
+        state = await self.cls.state.load()
+        if not state.values:
             return None, None
-        daos = json.loads(key_vals).get("metadata").get("daos")
-        selected_guild_reaction = None
-        for reaction in message.reactions:
-            if reaction.count >= 2:
-                selected_guild_reaction = reaction
-                self.cls.guild_id = daos.get(reaction.emoji)
-                break
-        if not selected_guild_reaction:
+        # The guilds were offered as reactions on the message, the
+        # reaction the user added is the guild they picked
+        guild_id = state.metadata.get("daos").get(raw_reaction.emoji.name)
+        if guild_id is None:
             raise Exception("Reacted with the wrong emoji")
+        self.cls.guild_id = guild_id
         return None, None
@@ -1,20 +1,39 @@
 import copy
-import json
 import hashlib
+import importlib
+import json
 import logging
 
+from contextlib import contextmanager
+
+import discord
+
+from bot import constants
 from bot.common.bot.bot import bot
 from bot.common.cache import RedisCache
+from bot.common.filters import open_threads
+from bot.common.jobs import WRITE_BEHIND, queue
+from bot.common.keys import build_thread_key
+from bot.common.metrics import EVENT_SECONDS, STEP_SECONDS
+from bot.common.resolver import get_resolver
+from bot.common.serializers import decode_cache_value, get_serializer
+from bot.common.tracing import span
 from enum import Enum
 from typing import Dict, Optional
 
-from dataclasses import dataclass, field
+from dataclasses import asdict, dataclass, field
 
 logger = logging.getLogger(__name__)
 
+# How many times a thread retries storing its state when another
+# writer bumped the version without moving the conversation forward
+MAX_SAVE_ATTEMPTS = 3
+
+serializer = get_serializer(constants.Cache.serializer)
+
 
 def build_cache_value(thread, step, guild_id, message_id="", **kwargs):
-    return json.dumps(
+    return serializer.encode(
         {
             "thread": thread,
             "step": step,
@@ -25,6 +44,12 @@ def build_cache_value(thread, step, guild_id, message_id="", **kwargs):
     )
 
 
+def get_thread_ttl(thread):
+    """Seconds an idle conversation of the given thread is kept"""
+    ttls = constants.Cache.thread_ttls
+    return ttls.get(thread, ttls["default"])
+
+
 class ThreadKeys(Enum):
     ONBOARDING = "onboarding"
     UPDATE_PROFILE = "update_profile"
@@ -34,6 +59,79 @@ class ThreadKeys(Enum):
     POINTS = "points"
 
 
+# The module each thread is defined in, imported the first time a
+# conversation of the thread is built
+THREAD_MODULES = {
+    ThreadKeys.ONBOARDING.value: "bot.common.threads.onboarding",
+    ThreadKeys.UPDATE_PROFILE.value: "bot.common.threads.update",
+    ThreadKeys.INITIAL_CONTRIBUTIONS.value: "bot.common.threads.initial_contribution",
+    ThreadKeys.GUILD_SELECT.value: "bot.common.guild_select",
+    ThreadKeys.REPORT.value: "bot.common.threads.report",
+    ThreadKeys.POINTS.value: "bot.common.threads.points",
+}
+
+# Thread classes by name, filled in by register_thread
+THREADS = {}
+
+
+def register_thread(cls):
+    """Class decorator that makes a thread available to get_thread
+
+    The thread is registered under its name, a ThreadKeys value, and
+    its module has to be listed in THREAD_MODULES.
+    """
+    THREADS[cls.name] = cls
+    return cls
+
+
+def get_thread_class(name):
+    """The thread class registered under a name
+
+    Raises:
+      Exception: If no thread has the name
+    """
+    cls = THREADS.get(name)
+    if cls is None:
+        module = THREAD_MODULES.get(name)
+        if module is None:
+            raise Exception(f"Unknown Thread {name}!")
+        importlib.import_module(module)
+        cls = THREADS.get(name)
+        if cls is None:
+            raise Exception(f"{module} does not register the thread {name}")
+    return cls
+
+
+async def get_thread(user_id, values, cache=None, state=None):
+    """Build the thread a conversation is in from its state values
+
+    The thread class is looked up from the thread name and awaited,
+    which builds its steps and resolves the current one from the step
+    hash.
+
+    Args:
+      user_id: Discord user id of the user in the conversation
+      values: The state values with the thread, step, message_id and
+        guild_id of the conversation
+      cache: The cache the thread stores its state in
+      state: The ThreadState the values were loaded from
+
+    Returns:
+      The thread at the step of the conversation
+    """
+    name = values.get("thread")
+    with span("get_thread", user_id=user_id, thread=name):
+        cls = get_thread_class(name)
+        return await cls(
+            user_id,
+            values.get("step"),
+            values.get("message_id"),
+            values.get("guild_id"),
+            cache,
+            state=state,
+        )
+
+
 class StepKeys(Enum):
     USER_DISPLAY_CONFIRM = "user_display_confirm"
     USER_DISPLAY_CONFIRM_EMOJI = "user_display_confirm_emoji"
@@ -68,6 +166,251 @@ class StepKeys(Enum):
     POINTS_CSV_PROMPT_ACCEPT = "points_csv_prompt_accept"
 
 
+class StringStateStore:
+    """Stores each thread state as one serialized value
+
+    Every write re-encodes the whole state, which keeps the state in a
+    single compact value.
+    """
+
+    def __init__(self, cache):
+        self.cache = cache
+
+    async def load(self, key):
+        value, version = await self.cache.get_versioned(key)
+        return (decode_cache_value(value) if value else None), version, None
+
+    def snapshot(self, values):
+        return None
+
+    async def save(self, key, values, snapshot, version, ex):
+        return await self.cache.compare_and_set(
+            key, build_cache_value(**values), version, ex=ex
+        )
+
+
+class HashStateStore:
+    """Stores each thread state as a redis hash
+
+    The thread, step, guild_id and message_id are fields of their own
+    and every metadata entry is stored in a ``metadata.<name>`` field,
+    all json encoded. A save only writes the fields that changed since
+    the state was loaded and removes the ones that went away, all in a
+    single round trip. States stored as one value by the
+    StringStateStore are read as well and converted on their next save.
+    """
+
+    def __init__(self, cache):
+        self.cache = cache
+
+    async def load(self, key):
+        value, version = await self.cache.get_hash(key)
+        if not value:
+            return None, version, None
+        if not isinstance(value, dict):
+            return decode_cache_value(value), version, None
+        return decode_hash_fields(value), version, value
+
+    def snapshot(self, values):
+        return encode_hash_fields(values)
+
+    async def save(self, key, values, snapshot, version, ex):
+        fields = encode_hash_fields(values)
+        if snapshot is None:
+            return await self.cache.compare_and_set_hash(
+                key, fields, version=version, ex=ex, replace=True
+            )
+        changed = {
+            field: value
+            for field, value in fields.items()
+            if _as_bytes(snapshot.get(field)) != _as_bytes(value)
+        }
+        removed = [field for field in snapshot if field not in fields]
+        return await self.cache.compare_and_set_hash(
+            key, changed, removed, version=version, ex=ex
+        )
+
+
+def encode_hash_fields(values):
+    fields = {}
+    for name, value in values.items():
+        if name == "metadata" and isinstance(value, dict):
+            for key, item in value.items():
+                fields[f"metadata.{key}"] = json.dumps(item)
+        else:
+            fields[name] = json.dumps(value)
+    return fields
+
+
+def decode_hash_fields(fields):
+    values = {}
+    for name, value in fields.items():
+        if name.startswith("metadata."):
+            metadata = values.get("metadata")
+            if not isinstance(metadata, dict):
+                metadata = values["metadata"] = {}
+            metadata[name[len("metadata.") :]] = json.loads(value)
+        elif name == "metadata" and isinstance(values.get("metadata"), dict):
+            continue
+        else:
+            values[name] = json.loads(value)
+    return values
+
+
+def _as_bytes(value):
+    return value.encode() if isinstance(value, str) else value
+
+
+STATE_STORES = {
+    "string": StringStateStore,
+    "hash": HashStateStore,
+}
+
+
+def build_state_store(cache):
+    """Build the store thread states are kept in, see cache.state_store"""
+    name = constants.Cache.state_store
+    if name not in STATE_STORES:
+        raise Exception(f"Unknown state store {name}")
+    return STATE_STORES[name](cache)
+
+
+class ThreadState:
+    """The cached conversation state of a user during a single event
+
+    The state is read from the cache once, steps read and change it
+    in memory and it is written back with a single compare-and-set
+    when the event has been handled. This keeps an event at one cache
+    read and at most one cache write no matter how many steps run.
+
+    The state is loaded lazily, so anything reading it should await
+    ``load`` first. A state that was never loaded is written
+    unconditionally. Every flush restarts the expiry of the state so
+    only conversations that go quiet expire.
+
+    Args:
+      cache: The cache the state is stored in
+      user_id: Discord user id of the user the state belongs to
+      store: How the state is laid out in the cache, defaults to the
+        configured store
+
+    Attributes:
+      key: The cache key the state is stored under
+      values: A dict with the thread, step, guild_id, message_id and
+        metadata of the conversation or None if there is no open
+        conversation
+      version: The version of the cached state when it was loaded or
+        last flushed
+      loaded: Whether the state has been read from the cache
+    """
+
+    def __init__(self, cache, user_id, store=None):
+        self.cache = cache
+        self.user_id = user_id
+        self.key = build_thread_key(user_id)
+        self.store = store if store is not None else build_state_store(cache)
+        self.values = None
+        self.version = None
+        self.loaded = False
+        self._step = None
+        self._snapshot = None
+        self._dirty = False
+
+    @classmethod
+    def new(cls, cache, user_id, store=None):
+        """A state for a conversation that starts from scratch
+
+        Nothing is read from the cache and the state is written
+        unconditionally, replacing any conversation the user had open.
+        """
+        state = cls(cache, user_id, store)
+        state.loaded = True
+        return state
+
+    @property
+    def metadata(self):
+        if not self.values:
+            return None
+        return self.values.get("metadata")
+
+    @property
+    def ttl(self):
+        return get_thread_ttl(self.values.get("thread") if self.values else None)
+
+    async def load(self):
+        """Read the state from the cache unless it was already read"""
+        if self.loaded:
+            return self
+        self.values, self.version, self._snapshot = await self.store.load(self.key)
+        self._step = self.values.get("step") if self.values else None
+        self.loaded = True
+        return self
+
+    def set(self, thread, step, guild_id, message_id="", **kwargs):
+        self.values = {
+            "thread": thread,
+            "step": step,
+            "guild_id": guild_id,
+            "message_id": message_id,
+            **kwargs,
+        }
+        self._dirty = True
+        return True
+
+    def set_metadata(self, metadata):
+        if not self.values:
+            raise Exception(f"No thread state for {self.user_id}")
+        self.values["metadata"] = metadata
+        self._dirty = True
+        return True
+
+    def delete(self):
+        self.values = None
+        self._dirty = True
+        return True
+
+    async def flush(self):
+        """Write the state back to the cache if it changed
+
+        The write only succeeds if the cached state is still at the
+        version that was loaded. If another writer bumped the version
+        but the conversation is still on the step this event started
+        from, the write is retried on top of the new version. If the
+        conversation moved on or ended the write is dropped.
+
+        Returns:
+          A boolean indicating whether the cache holds this state
+        """
+        if not self._dirty:
+            if self.values:
+                await self.cache.expire(self.key, self.ttl)
+            return True
+        self._dirty = False
+        if self.values is None:
+            await self.cache.delete(self.key)
+            self._snapshot = None
+            open_threads.discard(self.user_id)
+            return True
+        for _ in range(MAX_SAVE_ATTEMPTS):
+            version = await self.store.save(
+                self.key, self.values, self._snapshot, self.version, ex=self.ttl
+            )
+            if version is not None:
+                self.version = version
+                self._snapshot = self.store.snapshot(self.values)
+                open_threads.add(self.user_id)
+                return True
+            current, self.version, self._snapshot = await self.store.load(self.key)
+            if not current or current.get("step") != self._step:
+                logger.warning(
+                    f"Thread state for {self.user_id} was changed by another "
+                    "event, dropping this update"
+                )
+                return False
+        logger.error(f"Could not store thread state for {self.user_id}")
+        return False
+
+
 class BaseThread:
     """Base class for handling multi-interaction bot conversations
 
@@ -88,6 +431,8 @@ class BaseThread:
         discord api
       context: the context of the interaction which was triggered by
         the user
+      state: The ThreadState of the user, shared with the event that
+        built the thread so the cache is only read once
 
     Attributes:
       user_id: Discord user id of the user interacting with the bot
@@ -101,9 +446,14 @@ class BaseThread:
         discord api
       steps: A tree of the interaction flow from the root node
       step: A Step object of the current step of the interaction
+      state: The ThreadState steps read and update; it is flushed to
+        the cache at the end of send and handle_reaction
+      name: The ThreadKeys value of the thread, set by each thread
 
     """
 
+    name = None
+
     def __init__(
         self,
         user_id,
@@ -113,11 +463,12 @@ class BaseThread:
         cache=None,
         discord_bot=None,
         context=None,
+        state=None,
     ):
         if not current_step:
             raise Exception(f"No step for {current_step}")
         if cache is None:
-            cache = RedisCache()
+            cache = state.cache if state is not None else RedisCache()
         self.user_id = user_id
         self.message_id = message_id
         self.guild_id = guild_id
@@ -128,6 +479,8 @@ class BaseThread:
         if not self.bot:
             self.bot = bot
         self.context = context
+        self.resolver = get_resolver(self.bot)
+        self.state = state if state is not None else ThreadState(cache, user_id)
 
     @classmethod
     def find_step(cls, steps, hash_):
@@ -179,6 +532,11 @@ class BaseThread:
           A boolean indicating whether the next step was set in the cache
           or if it is the final step whether it was deleted from the cache
         """
+        with self._event("message"):
+            await self._send(message)
+            return await self.state.flush()
+
+    async def _send(self, message):
         self._check_step()
         logger.info(f"Send {self.step.hash_}")
         if self.step.current.emoji is True:
@@ -188,43 +546,85 @@ class BaseThread:
             return
         if self._should_save_previous_step():
             await self._save_previous_step(message)
-        msg, metadata = await self.step.current.send(message, self.user_id)
+        with self._step_phase(self.step, "send"):
+            msg, metadata = await self.step.current.send(message, self.user_id)
 
         if not metadata:
-            u = await self.cache.get(self.user_id)
-            if u:
-                metadata = json.loads(u).get("metadata")
+            metadata = (await self.state.load()).metadata
         if not self.step.next_steps:
-            return await self.cache.delete(self.user_id)
+            return self.state.delete()
         step = list(self.step.next_steps.values())[0]
-        override_step = await self.step.current.control_hook(message, self.user_id)
+        with self._step_phase(self.step, "control_hook"):
+            override_step = await self.step.current.control_hook(message, self.user_id)
         if override_step == StepKeys.END.value:
-            return await self.cache.delete(self.user_id)
+            return self.state.delete()
         if override_step:
             step = self.step.get_next_step(override_step)
             # TODO: I am guessing this metadata will need to be refactored
             self.step = step
-            return await self.send(message)
+            return await self._send(message)
 
         # Trigger next send
         if self.step.current.trigger:
             self.step = step
-            return await self.send(msg)
-
-        return await self.cache.set(
-            self.user_id,
-            build_cache_value(
-                self.name,
-                step.hash_,
-                self.guild_id,
-                msg.id,
-                metadata=metadata,
-            ),
+            return await self._send(msg)
+
+        return self.state.set(
+            self.name,
+            step.hash_,
+            self.guild_id,
+            msg.id,
+            metadata=metadata,
         )
 
+    @contextmanager
+    def _event(self, event):
+        step = self.step.current.name if getattr(self, "step", None) else None
+        with EVENT_SECONDS.time(self.name, event), span(
+            f"thread.{event}",
+            user_id=self.user_id,
+            guild_id=self.guild_id,
+            thread=self.name,
+            step=step,
+        ):
+            yield
+
+    @contextmanager
+    def _step_phase(self, step, phase):
+        name = step.current.name
+        with STEP_SECONDS.time(self.name, name, phase), span(
+            f"step.{phase}", step=name
+        ):
+            yield
+
     async def _save_previous_step(self, message):
-        return await self.step.previous_step.current.save(
-            message, self.guild_id, self.user_id
+        if WRITE_BEHIND:
+            with self._step_phase(self.step.previous_step, "queue_save"):
+                return await self._queue_previous_step_save(message)
+        with self._step_phase(self.step.previous_step, "save"):
+            return await self.step.previous_step.current.save(
+                message, self.guild_id, self.user_id
+            )
+
+    async def _queue_previous_step_save(self, message):
+        """Save the previous step in the background
+
+        The save job rebuilds the thread on the previous step from the
+        state the event started with, so the step reads the same
+        metadata it would have read here. Jobs of a user run in the
+        order they were queued.
+        """
+        values = dict((await self.state.load()).values or {})
+        # Threads can hand over to another thread after a guild select
+        values.update(
+            thread=self.name, step=self.step.previous_step.hash_, guild_id=self.guild_id
+        )
+        await queue.enqueue(
+            "save_step",
+            self.user_id,
+            user_id=self.user_id,
+            values=values,
+            message=SavedMessage.from_message(message).to_dict(),
         )
 
     def _should_save_previous_step(self):
@@ -253,11 +653,16 @@ class BaseThread:
           None
 
         """
+        with self._event("reaction"):
+            await self._handle_reaction(reaction, user)
+            await self.state.flush()
+
+    async def _handle_reaction(self, reaction, user):
         self._check_step()
         logger.info(f"Emoji {reaction}")
         # TODO: Add some error handling
-        channel = await self.bot.fetch_channel(reaction.channel_id)
-        message = await channel.fetch_message(reaction.message_id)
+        channel = await self.resolver.get_channel(reaction.channel_id)
+        message = await self.resolver.get_message(channel, reaction.message_id)
 
         if reaction.message_id != self.message_id:
             await channel.send(
@@ -265,8 +670,42 @@ class BaseThread:
                 "Please react to your most recent message"
             )
             return
+        await self._handle_choice(reaction, channel, message)
+
+    async def handle_interaction(self, interaction, choice):
+        """Run the handle emoji method on a step for a prompt component
+
+        A button or select menu option sent with a prompt stands for
+        one of its emojis, so picking it moves the thread on the same
+        way a reaction with that emoji does.
+
+        Args:
+          interaction: The discord component interaction on the last
+            message in the thread
+          choice: The emoji the component stands for
+
+        Returns:
+          None
+        """
+        self._check_step()
+        logger.info(f"Component {choice}")
+        reaction = ComponentChoice(
+            emoji=discord.PartialEmoji(name=choice),
+            user_id=interaction.user.id,
+            channel_id=interaction.channel_id,
+            message_id=interaction.message.id,
+        )
+        with self._event("interaction"):
+            channel = interaction.channel
+            if not hasattr(channel, "send"):
+                channel = await self.resolver.get_channel(interaction.channel_id)
+            await self._handle_choice(reaction, channel, interaction.message)
+            await self.state.flush()
+
+    async def _handle_choice(self, reaction, channel, message):
         try:
-            step_name, skip = await self.step.current.handle_emoji(reaction)
+            with self._step_phase(self.step, "handle_emoji"):
+                step_name, skip = await self.step.current.handle_emoji(reaction)
         except Exception:
             logger.exception("Failed to handle the emoji")
             await channel.send(
@@ -283,13 +722,55 @@ class BaseThread:
                 if not list(self.step.next_steps.values()):
                     if self._should_save_previous_step():
                         await self._save_previous_step(message)
-                    return await self.cache.delete(self.user_id)
+                    return self.state.delete()
                 step_name = list(self.step.next_steps.values())[0].current.name
             next_step = self.step.get_next_step(step_name)
         if not next_step:
-            return await self.cache.delete(self.user_id)
+            return self.state.delete()
         self.step = next_step
-        await self.send(message)
+        await self._send(message)
+
+
+@dataclass
+class SavedUser:
+    id: int
+
+
+@dataclass
+class SavedMessage:
+    """The parts of a message step saves read, for saves run by a job"""
+
+    id: int
+    channel_id: int
+    content: str
+    author: SavedUser
+
+    @classmethod
+    def from_message(cls, message):
+        return cls(
+            id=message.id,
+            channel_id=message.channel.id,
+            content=message.content,
+            author=SavedUser(id=message.author.id),
+        )
+
+    @classmethod
+    def from_dict(cls, values):
+        return cls(**{**values, "author": SavedUser(**values["author"])})
+
+    def to_dict(self):
+        return asdict(self)
+
+
+@dataclass
+class ComponentChoice:
+    """The parts of a reaction steps read, for an answer given with a
+    prompt component instead"""
+
+    emoji: discord.PartialEmoji
+    user_id: int
+    channel_id: int
+    message_id: int
 
 
 class BaseStep:
@@ -1,9 +1,9 @@
 import discord
-import json
 
-from bot.common.airtable import find_user, update_user, get_user_record
+from bot.common.airtable import get_user_record
+from bot.common.prompts import send_prompt
+from bot.common.writes import save_user_fields
 from bot.config import (
-    Redis,
     INFO_EMBED_COLOR,
     get_list_of_emojis,
 )
@@ -13,12 +13,13 @@ from bot.common.threads.thread_builder import (
     Step,
     ThreadKeys,
     BaseThread,
-    build_cache_value,
+    register_thread,
 )
 
 from bot.common.threads.shared_steps import SelectGuildEmojiStep
 
 
+@register_thread
 class UpdateProfile(BaseThread):
     """A thread to update a Govrn Guild Profile
 
@@ -35,7 +36,7 @@ class UpdateProfile(BaseThread):
             Step(current=SelectGuildEmojiStep(cls=self))
             .add_next_step(UserUpdateFieldSelectStep(cls=self))
             .add_next_step(UpdateProfileFieldEmojiStep(cls=self))
-            .add_next_step(UpdateFieldStep())
+            .add_next_step(UpdateFieldStep(cls=self))
             .add_next_step(CongratsFieldUpdateStep())
         )
         return steps.build()
@@ -72,9 +73,9 @@ class UserUpdateFieldSelectStep(BaseStep):
         )
 
         channel = message.channel
-        sent_message = await channel.send(embed=embed)
-        for emoji in emojis:
-            await sent_message.add_reaction(emoji)
+        sent_message = await send_prompt(
+            channel, embed=embed, emojis=emojis, user_id=user_id
+        )
         return (
             sent_message,
             {
@@ -97,17 +98,10 @@ class UpdateProfileFieldEmojiStep(BaseStep):
         self.cls = cls
 
     async def handle_emoji(self, raw_reaction):
-        key_vals = await Redis.get(raw_reaction.user_id)
-        if not key_vals:
+        state = await self.cls.state.load()
+        if not state.values:
             return None, None
-        values = json.loads(key_vals)
-        values["metadata"] = {
-            "field": values.get("metadata").get(raw_reaction.emoji.name)
-        }
-        await Redis.set(
-            raw_reaction.user_id,
-            build_cache_value(**values),
-        )
+        state.set_metadata({"field": state.metadata.get(raw_reaction.emoji.name)})
         return None, None
 
 
@@ -116,21 +110,23 @@ class UpdateFieldStep(BaseStep):
 
     name = StepKeys.UPDATE_FIELD.value
 
+    def __init__(self, cls):
+        super().__init__()
+        self.cls = cls
+
     async def send(self, message, user_id):
         channel = message.channel
         sent_message = await channel.send("What value would you like to use instead")
         return sent_message, None
 
     async def save(self, message, guild_id, user_id):
-        key_vals = await Redis.get(user_id)
-        if not key_vals:
+        metadata = (await self.cls.state.load()).metadata
+        if metadata is None:
             return
-        metadata = json.loads(key_vals).get("metadata")
         field = metadata.get("field")
         if not field:
             raise Exception("No field present to update")
-        record_id = await find_user(user_id, guild_id)
-        await update_user(record_id, field, message.content.strip())
+        await save_user_fields(user_id, guild_id, {field: message.content.strip()})
 
 
 class CongratsFieldUpdateStep(BaseStep):
@@ -0,0 +1,304 @@
+import contextvars
+import functools
+import json
+import logging
+import os
+import threading
+import time
+
+from distutils.util import strtobool
+
+from bot import constants
+
+logger = logging.getLogger(__name__)
+
+# Whether spans are recorded, when they are not span() does nothing and
+# traced functions are left as they are
+ENABLED = bool(strtobool(constants.Tracing.enabled))
+
+# Attributes a span passes on to the spans started inside it, so every
+# Redis, Discord and Airtable call shows the conversation it was for
+PROPAGATED = ("user_id", "guild_id", "thread", "step")
+
+_current = contextvars.ContextVar("span", default=None)
+
+
+class Span:
+    """A timed operation within a trace
+
+    Ids and times follow OpenTelemetry: a 16 byte trace id and an 8 byte
+    span id in hex, and times in nanoseconds since the epoch.
+
+    Attributes:
+      name: What the span times
+      trace_id: The id shared by every span of the trace
+      span_id: The id of the span
+      parent: The span it was started in, None for the root of a trace
+      attributes: Key value pairs describing the span
+      error: The exception the span ended with, if any
+    """
+
+    def __init__(self, name, parent, attributes):
+        self.name = name
+        self.parent = parent
+        self.trace_id = parent.trace_id if parent else os.urandom(16).hex()
+        self.span_id = os.urandom(8).hex()
+        self.attributes = {}
+        if parent is not None:
+            for key in PROPAGATED:
+                if key in parent.attributes:
+                    self.attributes[key] = parent.attributes[key]
+        self.attributes.update(attributes)
+        self.start = time.time_ns()
+        self.end = None
+        self.error = None
+
+    def set_attribute(self, key, value):
+        self.attributes[key] = value
+
+    def to_dict(self):
+        """The span in the OTLP JSON encoding of a span"""
+        span = {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "startTimeUnixNano": self.start,
+            "endTimeUnixNano": self.end,
+            "attributes": [
+                {"key": key, "value": {"stringValue": str(value)}}
+                for key, value in self.attributes.items()
+            ],
+            "status": {"code": 2, "message": repr(self.error)}
+            if self.error
+            else {"code": 1},
+        }
+        if self.parent is not None:
+            span["parentSpanId"] = self.parent.span_id
+        return span
+
+
+class FileExporter:
+    """Appends finished spans to a file as JSON lines
+
+    Spans are kept until the root span of their trace ends and then
+    written together, so the event loop writes once per event.
+
+    Args:
+      path: The file to append to
+      service_name: Added to every span as service.name
+    """
+
+    def __init__(self, path, service_name):
+        self.path = path
+        self.service_name = service_name
+        self._pending = []
+        self._lock = threading.Lock()
+
+    def export(self, span):
+        record = span.to_dict()
+        record["attributes"].append(
+            {"key": "service.name", "value": {"stringValue": self.service_name}}
+        )
+        with self._lock:
+            self._pending.append(json.dumps(record))
+            if span.parent is not None:
+                return
+            lines, self._pending = self._pending, []
+        with open(self.path, "a") as f:
+            f.write("\n".join(lines) + "\n")
+
+
+class _NullSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def set_attribute(self, key, value):
+        pass
+
+
+NULL_SPAN = _NullSpan()
+
+
+class _ActiveSpan:
+    __slots__ = ("tracer", "name", "attributes", "span", "token")
+
+    def __init__(self, tracer, name, attributes):
+        self.tracer = tracer
+        self.name = name
+        self.attributes = attributes
+
+    def __enter__(self):
+        self.span = Span(self.name, _current.get(), self.attributes)
+        self.token = _current.set(self.span)
+        return self.span
+
+    def __exit__(self, exc_type, exc, tb):
+        _current.reset(self.token)
+        self.span.end = time.time_ns()
+        self.span.error = exc
+        try:
+            self.tracer.exporter.export(self.span)
+        except Exception:
+            logger.exception(f"Failed to export span {self.name}")
+        return False
+
+
+class _OpenTelemetrySpan:
+    __slots__ = ("tracer", "name", "attributes", "manager")
+
+    def __init__(self, tracer, name, attributes):
+        self.tracer = tracer
+        self.name = name
+        self.attributes = attributes
+
+    def __enter__(self):
+        from opentelemetry import trace
+
+        attributes = dict(self.attributes)
+        parent = trace.get_current_span()
+        for key in PROPAGATED:
+            value = getattr(parent, "attributes", {}).get(key)
+            if value is not None and key not in attributes:
+                attributes[key] = value
+        self.manager = self.tracer.start_as_current_span(
+            self.name,
+            attributes={key: str(value) for key, value in attributes.items()},
+        )
+        return self.manager.__enter__()
+
+    def __exit__(self, *exc):
+        return self.manager.__exit__(*exc)
+
+
+class Tracer:
+    """Starts spans and hands finished ones to an exporter
+
+    With the ``file`` exporter spans are recorded here and appended to
+    a file. With ``otlp`` spans are started with the OpenTelemetry SDK,
+    which has to be installed and configured through its usual
+    OTEL_EXPORTER_OTLP_* environment variables.
+
+    Args:
+      enabled: Whether spans are recorded
+      exporter: file or otlp
+      path: The file the file exporter appends to
+      service_name: The service.name of the spans
+    """
+
+    def __init__(self, enabled, exporter="file", path=None, service_name="kevin"):
+        self.enabled = enabled
+        self.exporter = None
+        self._otel = None
+        if not enabled:
+            return
+        if exporter == "file":
+            self.exporter = FileExporter(path, service_name)
+        elif exporter == "otlp":
+            self._otel = _build_otel_tracer(service_name)
+        else:
+            raise Exception(f"Unknown trace exporter {exporter}")
+
+    def span(self, name, **attributes):
+        """A context manager that records its block as a span"""
+        if not self.enabled:
+            return NULL_SPAN
+        if self._otel is not None:
+            return _OpenTelemetrySpan(self._otel, name, attributes)
+        return _ActiveSpan(self, name, attributes)
+
+
+def _build_otel_tracer(service_name):
+    try:
+        from opentelemetry import trace
+        from opentelemetry.exporter.otlp.proto.grpc.trace_exporter import (
+            OTLPSpanExporter,
+        )
+        from opentelemetry.sdk.resources import Resource
+        from opentelemetry.sdk.trace import TracerProvider
+        from opentelemetry.sdk.trace.export import BatchSpanProcessor
+    except ImportError:
+        raise Exception(
+            "The otlp trace exporter needs opentelemetry-sdk and "
+            "opentelemetry-exporter-otlp installed"
+        )
+    provider = TracerProvider(resource=Resource.create({"service.name": service_name}))
+    provider.add_span_processor(BatchSpanProcessor(OTLPSpanExporter()))
+    trace.set_tracer_provider(provider)
+    return trace.get_tracer(__name__)
+
+
+tracer = Tracer(
+    ENABLED,
+    constants.Tracing.exporter,
+    constants.Tracing.path,
+    constants.Tracing.service_name,
+)
+
+
+def span(name, **attributes):
+    """A span of the bot's tracer, see Tracer.span"""
+    return tracer.span(name, **attributes)
+
+
+def traced(name):
+    """Decorator that records each call of a coroutine function as a span
+
+    Functions are returned as they are when tracing is disabled.
+    """
+
+    def decorator(func):
+        if not tracer.enabled:
+            return func
+
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            with tracer.span(name):
+                return await func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def trace_redis(client):
+    """Record the commands and pipelines of an aioredis client as spans"""
+    if not tracer.enabled:
+        return client
+    execute_command = client.execute_command
+    pipeline = client.pipeline
+
+    async def _execute_command(*args, **options):
+        with tracer.span(f"redis.{str(args[0]).upper()}"):
+            return await execute_command(*args, **options)
+
+    def _pipeline(*args, **kwargs):
+        pipe = pipeline(*args, **kwargs)
+        execute = pipe.execute
+
+        async def _execute(*args, **kwargs):
+            with tracer.span("redis.pipeline", commands=len(pipe.command_stack)):
+                return await execute(*args, **kwargs)
+
+        pipe.execute = _execute
+        return pipe
+
+    client.execute_command = _execute_command
+    client.pipeline = _pipeline
+    return client
+
+
+def trace_discord(bot):
+    """Record the REST requests of a discord client as spans"""
+    if not tracer.enabled:
+        return bot
+    request = bot.http.request
+
+    async def _request(route, **kwargs):
+        with tracer.span(f"discord.{route.method} {route.path}"):
+            return await request(route, **kwargs)
+
+    bot.http.request = _request
+    return bot
@@ -0,0 +1,148 @@
+import asyncio
+import logging
+
+from distutils.util import strtobool
+
+from bot import constants
+from bot.common import airtable
+from bot.common.contributions import contributions
+from bot.common.jobs import JobQueue, job
+from bot.config import Redis
+
+logger = logging.getLogger(__name__)
+
+# Whether Airtable writes are queued for bot/worker.py instead of
+# being made by the event handler
+AIRTABLE_WORKER = bool(strtobool(constants.Jobs.airtable_worker))
+
+airtable_queue = JobQueue(
+    Redis,
+    "airtable",
+    partitions=constants.Jobs.partitions,
+    max_attempts=constants.Jobs.max_attempts,
+    retry_delay=constants.Jobs.retry_delay,
+    lease_ttl=constants.Jobs.lease_ttl,
+    block=constants.Jobs.block,
+)
+
+
+async def _write(name, run, user_id, **kwargs):
+    # Writes of a user are queued under the user so they run in order,
+    # a profile update always runs after the user was created
+    if AIRTABLE_WORKER:
+        return await airtable_queue.enqueue(name, user_id, user_id=user_id, **kwargs)
+    return await run(user_id=user_id, **kwargs)
+
+
+async def save_user_fields(user_id, guild_id, fields):
+    """Update fields of the Users record of a user in a guild"""
+    await _write(
+        "update_user_fields",
+        _run_single(update_user_fields),
+        user_id,
+        guild_id=guild_id,
+        fields=fields,
+    )
+
+
+async def save_member_fields(user_id, guild_id, fields):
+    """Update fields of the Members record of a user in a guild"""
+    await _write(
+        "update_member_fields",
+        _run_single(update_member_fields),
+        user_id,
+        guild_id=guild_id,
+        fields=fields,
+    )
+
+
+async def save_new_user(user_id, guild_id):
+    """Create the Users record of a user in a guild if it is missing"""
+    await _write("create_user", create_user, user_id, guild_id=guild_id)
+
+
+async def save_contribution_user(user_id, guild_id, order):
+    """Add a user to the contribution of a guild with the given order
+
+    Does nothing when the user already reached the contribution.
+    """
+    if await contributions.has_completed(guild_id, user_id, order):
+        return
+    contributions.record(guild_id, user_id, order)
+    await _write(
+        "add_user_to_contribution",
+        add_user_to_contribution,
+        user_id,
+        guild_id=guild_id,
+        order=order,
+    )
+
+
+def _run_single(batched):
+    async def run(**kwargs):
+        return await batched([kwargs])
+
+    return run
+
+
+async def _update_records(batcher, updates):
+    """Update records in as few requests as Airtable allows
+
+    Updates of the same record are merged in order, so the last value
+    of each field wins. They go through the batcher of the table, which
+    also merges them with the updates of other events sent meanwhile.
+    """
+    records = {}
+    for record_id, fields in updates:
+        records.setdefault(record_id, {}).update(fields)
+    await asyncio.gather(
+        *(batcher.update(record_id, fields) for record_id, fields in records.items())
+    )
+
+
+async def _find_records(batch, find):
+    """The record ids of the users in a batch, looked up once per user"""
+    record_ids = {}
+    for kwargs in batch:
+        key = (kwargs["user_id"], kwargs["guild_id"])
+        if key not in record_ids:
+            record_ids[key] = await find(*key)
+        if not record_ids[key]:
+            raise Exception(f"No Airtable record of user {key[0]} in guild {key[1]}")
+    return [record_ids[(kwargs["user_id"], kwargs["guild_id"])] for kwargs in batch]
+
+
+@job("update_user_fields", batch_size=airtable.BATCH_SIZE)
+async def update_user_fields(batch):
+    record_ids = await _find_records(batch, airtable.find_user)
+    await _update_records(
+        airtable.user_updates,
+        [(r, kwargs["fields"]) for r, kwargs in zip(record_ids, batch)],
+    )
+
+
+async def _find_member(user_id, guild_id):
+    user_record = await airtable.get_user_record(user_id, guild_id)
+    if not user_record:
+        return None
+    return user_record.get("fields").get("Members")[0]
+
+
+@job("update_member_fields", batch_size=airtable.BATCH_SIZE)
+async def update_member_fields(batch):
+    member_ids = await _find_records(batch, _find_member)
+    await _update_records(
+        airtable.member_updates,
+        [(m, kwargs["fields"]) for m, kwargs in zip(member_ids, batch)],
+    )
+
+
+@job("create_user")
+async def create_user(user_id, guild_id):
+    await airtable.create_user(user_id, guild_id)
+
+
+@job("add_user_to_contribution")
+async def add_user_to_contribution(user_id, guild_id, order):
+    contribution_id = await contributions.get_contribution_id(guild_id, order)
+    await airtable.add_user_to_contribution(guild_id, user_id, order, contribution_id)
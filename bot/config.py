@@ -1,6 +1,4 @@
 import discord
-import json
-import aioredis
 from bot import constants
 
 GUILD_IDS = [747131845317230695, 799328534988193793]
@@ -21,14 +19,56 @@ CLOWN_EMOJI = "\U0001F921"
 emojis = [ALIEN_EMOJI, ALIEN_MONSTER_EMOJI, ROBOT_EMOJI, GHOST_EMOJI, CLOWN_EMOJI]
 
 
-def read_file():
-    with open("govrn_config.json") as f:
-        return json.load(f)
-
-
 def get_list_of_emojis(num):
     return emojis[0:num]
 
 
+def build_redis(url=REDIS_URL):
+    """Build an aioredis client with the pool settings from the config
+
+    Connects over ``redis.unix_socket`` instead of the url when it is set.
+    """
+    import aioredis
+
+    from bot.common.metrics import instrument_redis
+    from bot.common.tracing import trace_redis
+
+    settings = constants.Redis
+    if settings.unix_socket:
+        url = f"unix://{settings.unix_socket}"
+    pool = aioredis.BlockingConnectionPool.from_url(
+        f"{url}",
+        max_connections=settings.max_connections,
+        timeout=settings.pool_timeout,
+        socket_timeout=settings.socket_timeout or None,
+        socket_connect_timeout=settings.socket_connect_timeout or None,
+        health_check_interval=settings.health_check_interval,
+        retry_on_timeout=True,
+    )
+    return trace_redis(instrument_redis(aioredis.Redis(connection_pool=pool)))
+
+
+class LazyClient:
+    """A client that is built the first time it is used
+
+    Attribute lookups are passed on to the client, so it can be used in
+    place of the client it builds.
+
+    Args:
+      build: Called without arguments to build the client
+    """
+
+    def __init__(self, build):
+        self._build = build
+        self._client = None
+
+    def __getattr__(self, name):
+        if self._client is None:
+            self._client = self._build()
+        return getattr(self._client, name)
+
+
 INFO_EMBED_COLOR = discord.Colour.blue()
-Redis = aioredis.from_url(f"{REDIS_URL}")
+# Built on first use so importing the bot neither imports aioredis nor
+# sets up a connection pool before the first event needs it
+Redis = LazyClient(build_redis)
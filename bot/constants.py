@@ -71,15 +71,18 @@ def _join_var_constructor(loader, node):
     return "".join(str(x) for x in fields)
 
 
-yaml.SafeLoader.add_constructor("!ENV", _env_var_constructor)
-yaml.SafeLoader.add_constructor("!JOIN", _join_var_constructor)
+# The libyaml parser is several times faster, use it when PyYAML has it
+Loader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+
+Loader.add_constructor("!ENV", _env_var_constructor)
+Loader.add_constructor("!JOIN", _join_var_constructor)
 
 # Pointing old tag to !ENV constructor to avoid breaking existing configs
-yaml.SafeLoader.add_constructor("!REQUIRED_ENV", _env_var_constructor)
+Loader.add_constructor("!REQUIRED_ENV", _env_var_constructor)
 
 
 with open("config-default.yml", encoding="UTF-8") as f:
-    _CONFIG_YAML = yaml.safe_load(f)
+    _CONFIG_YAML = yaml.load(f, Loader=Loader)
 
 
 def _recursive_update(original, new):
@@ -104,7 +107,7 @@ def _recursive_update(original, new):
 if Path("config.yml").exists():
     print("Found `config.yml` file, loading constants from it.")
     with open("config.yml", encoding="UTF-8") as f:
-        user_config = yaml.safe_load(f)
+        user_config = yaml.load(f, Loader=Loader)
     _recursive_update(_CONFIG_YAML, user_config)
 
 
@@ -295,6 +298,114 @@ class Icons(metaclass=YAMLGetter):
 class Guilds(metaclass=YAMLGetter):
     section = "guilds"
     guilds: List[dict]
+    config_path: str
+    reload_interval: int
+    table_ttl: int
+
+
+class Redis(metaclass=YAMLGetter):
+    section = "redis"
+
+    max_connections: int
+    pool_timeout: int
+    socket_timeout: int
+    socket_connect_timeout: int
+    health_check_interval: int
+    unix_socket: str
+
+
+class Cache(metaclass=YAMLGetter):
+    section = "cache"
+
+    namespace: str
+    l1_size: int
+    l1_ttl: int
+    invalidation_channel: str
+    serializer: str
+    state_store: str
+    thread_ttls: Dict[str, int]
+
+
+class Metrics(metaclass=YAMLGetter):
+    section = "metrics"
+
+    enabled: str
+    host: str
+    port: str
+
+
+class Tracing(metaclass=YAMLGetter):
+    section = "tracing"
+
+    enabled: str
+    exporter: str
+    path: str
+    service_name: str
+
+
+class Diagnostics(metaclass=YAMLGetter):
+    section = "diagnostics"
+
+    enabled: str
+    sample_interval: float
+    slow_callback: float
+    lag_interval: float
+    dump_dir: str
+
+
+class Gateway(metaclass=YAMLGetter):
+    section = "gateway"
+
+    features: List[str]
+    extra_intents: List[str]
+    all_intents: str
+    max_messages: int
+    record_path: str
+
+
+class Prompts(metaclass=YAMLGetter):
+    section = "prompts"
+
+    style: str
+
+
+class Resolver(metaclass=YAMLGetter):
+    section = "resolver"
+
+    maxsize: int
+    ttl: int
+
+
+class Airtable(metaclass=YAMLGetter):
+    section = "airtable"
+
+    batch_delay: float
+
+
+class Jobs(metaclass=YAMLGetter):
+    section = "jobs"
+
+    write_behind: str
+    airtable_worker: str
+    partitions: int
+    max_attempts: int
+    retry_delay: int
+    lease_ttl: int
+    block: int
+
+
+class Contributions(metaclass=YAMLGetter):
+    section = "contributions"
+
+    ttl: int
+
+
+class Locks(metaclass=YAMLGetter):
+    section = "locks"
+
+    distributed: str
+    timeout: int
+    blocking_timeout: int
 
 
 # Debug mode
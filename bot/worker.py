@@ -0,0 +1,34 @@
+import asyncio
+import logging
+
+from bot.common.diagnostics import ENABLED as DIAGNOSTICS, diagnostics
+from bot.common.metrics import start_server
+from bot.common.writes import airtable_queue
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+async def run():
+    await start_server()
+    if DIAGNOSTICS:
+        diagnostics.start()
+    await airtable_queue.run()
+
+
+def main():
+    """Run the Airtable writes the bot queued
+
+    Start as many workers as needed with ``python -m bot.worker``,
+    each one takes over the partitions of the queue nobody else is
+    working.
+    """
+    logger.info("Starting Airtable worker...")
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        logger.info("Stopped Airtable worker")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+"""Create Contribution Progress records from Contribution Flow users
+
+Progress used to be kept in the users list of each Contribution Flow
+record. This creates a Contribution Progress record for every user in
+those lists that does not have one yet. The lists are left as they are.
+
+    python -m scripts.backfill_contribution_progress [--dry-run]
+"""
+import argparse
+import asyncio
+
+from pyairtable import Table
+
+from bot.common.airtable import PROGRESS_TABLE, batch_create, build_progress_fields
+from bot.config import AIRTABLE_BASE, AIRTABLE_KEY
+
+
+def first(values):
+    return values[0] if values else None
+
+
+def load_progress():
+    """Every missing progress record, as the fields to create it with"""
+
+    def table(name):
+        return Table(AIRTABLE_KEY, AIRTABLE_BASE, name)
+
+    # Linked fields hold record ids, resolve them to discord ids
+    discord_ids = {
+        r["id"]: r["fields"].get("discord_id") for r in table("global").all()
+    }
+    guild_ids = {r["id"]: r["fields"].get("guild_id") for r in table("Guilds").all()}
+    users = {}
+    for record in table("Users").all():
+        fields = record["fields"]
+        users[record["id"]] = (
+            guild_ids.get(first(fields.get("guild_id"))),
+            discord_ids.get(first(fields.get("discord_id"))),
+        )
+    existing = {
+        (first(r["fields"].get("user")), first(r["fields"].get("contribution")))
+        for r in table(PROGRESS_TABLE).all()
+    }
+
+    missing = []
+    for contribution in table("Contribution Flow").all():
+        fields = contribution["fields"]
+        for user_record_id in fields.get("users", []):
+            if (user_record_id, contribution["id"]) in existing:
+                continue
+            guild_id, user_id = users.get(user_record_id, (None, None))
+            if guild_id is None or user_id is None:
+                print(f"Skipping unknown user {user_record_id}")
+                continue
+            missing.append(
+                build_progress_fields(
+                    guild_id,
+                    user_id,
+                    fields.get("order"),
+                    contribution["id"],
+                    user_record_id,
+                )
+            )
+    return missing
+
+
+async def run(dry_run):
+    loop = asyncio.get_running_loop()
+    missing = await loop.run_in_executor(None, load_progress)
+    print(f"{len(missing)} progress records missing")
+    if not dry_run and missing:
+        created = await batch_create(PROGRESS_TABLE, missing)
+        print(f"Created {len(created)} progress records")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--dry-run", action="store_true")
+    asyncio.run(run(parser.parse_args().dry_run))
+
+
+if __name__ == "__main__":
+    main()
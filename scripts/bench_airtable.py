@@ -0,0 +1,134 @@
+"""Compare record writes one by one with batched writes
+
+A local stand-in for the Airtable API answers record creates and
+updates after a fixed latency and rejects requests with more records
+than Airtable accepts. The same records are written one request per
+record the way update_user used to, with batch_update, and through a
+RecordBatcher fed by concurrent writers, and the requests made and
+records written per second are reported.
+
+    python -m scripts.bench_airtable [--records 200] [--latency 0.05]
+"""
+import argparse
+import asyncio
+import itertools
+import time
+
+from aiohttp import web
+from pyairtable import Table
+from pyairtable.api.abstract import ApiAbstract
+
+from bot.common.airtable import BATCH_SIZE, RecordBatcher, batch_create, batch_update
+from bot.config import AIRTABLE_BASE, AIRTABLE_KEY
+
+TABLE = "Users"
+
+
+class StandIn:
+    """Answers record writes like Airtable, after a delay"""
+
+    def __init__(self, latency):
+        self.latency = latency
+        self.requests = 0
+        self._ids = itertools.count()
+
+    def routes(self):
+        return [
+            web.post("/v0/{base}/{table}", self.create),
+            web.patch("/v0/{base}/{table}", self.update),
+            web.patch("/v0/{base}/{table}/{record_id}", self.update_one),
+        ]
+
+    async def _respond(self, records):
+        self.requests += 1
+        await asyncio.sleep(self.latency)
+        if len(records) > BATCH_SIZE:
+            return web.json_response({"error": "TOO_MANY_RECORDS"}, status=422)
+        return web.json_response({"records": records})
+
+    async def create(self, request):
+        records = (await request.json())["records"]
+        return await self._respond(
+            [{"id": f"rec{next(self._ids)}", **record} for record in records]
+        )
+
+    async def update(self, request):
+        return await self._respond((await request.json())["records"])
+
+    async def update_one(self, request):
+        fields = (await request.json())["fields"]
+        return await self._respond([{"fields": fields}])
+
+
+async def one_by_one(records):
+    loop = asyncio.get_running_loop()
+
+    def _update(record):
+        Table(AIRTABLE_KEY, AIRTABLE_BASE, TABLE).update(record["id"], record["fields"])
+
+    await asyncio.gather(
+        *(loop.run_in_executor(None, _update, record) for record in records)
+    )
+
+
+async def batched(records):
+    await batch_update(TABLE, records)
+
+
+async def batcher(records):
+    writes = RecordBatcher(TABLE, max_delay=0.05)
+    await asyncio.gather(
+        *(writes.update(record["id"], record["fields"]) for record in records)
+    )
+
+
+async def created(records):
+    await batch_create(TABLE, [record["fields"] for record in records])
+
+
+async def run(args):
+    stand_in = StandIn(args.latency)
+    app = web.Application()
+    app.add_routes(stand_in.routes())
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    ApiAbstract.API_URL = f"http://127.0.0.1:{port}/v0"
+
+    records = [
+        {"id": f"rec{i}", "fields": {"twitter": f"user{i}"}}
+        for i in range(args.records)
+    ]
+    print(f"{args.records} records, {args.latency * 1000:.0f}ms per request")
+    try:
+        for name, write in (
+            ("one by one", one_by_one),
+            ("batch_update", batched),
+            ("RecordBatcher", batcher),
+            ("batch_create", created),
+        ):
+            stand_in.requests = 0
+            start = time.perf_counter()
+            await write(records)
+            elapsed = time.perf_counter() - start
+            print(
+                f"  {name:14} {stand_in.requests:5} requests"
+                f"  {args.records / elapsed:8.0f} records/s"
+            )
+    finally:
+        await runner.cleanup()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--records", type=int, default=200)
+    parser.add_argument(
+        "--latency", type=float, default=0.05, help="seconds per request"
+    )
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
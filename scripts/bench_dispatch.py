@@ -0,0 +1,81 @@
+"""Measure what picking and building the thread of an event costs
+
+Compares looking up the thread class with the if/elif chain get_thread
+used to walk against the registry, for the first and the last thread
+of the chain, and times a full get_thread which also builds the steps
+and resolves the current step.
+
+    python -m scripts.bench_dispatch [--number 100000]
+"""
+import argparse
+import asyncio
+import hashlib
+import time
+import timeit
+
+from bot.common.threads.thread_builder import (
+    ThreadKeys,
+    get_thread,
+    get_thread_class,
+)
+
+
+def chain(thread):
+    # The lookup get_thread did before the registry, classes replaced
+    # by their names
+    if thread == ThreadKeys.ONBOARDING.value:
+        return "Onboarding"
+    elif thread == ThreadKeys.UPDATE_PROFILE.value:
+        return "UpdateProfile"
+    elif thread == ThreadKeys.INITIAL_CONTRIBUTIONS.value:
+        return "InitialContributions"
+    elif thread == ThreadKeys.GUILD_SELECT.value:
+        return "GuildSelect"
+    elif thread == ThreadKeys.REPORT.value:
+        return "Report"
+    elif thread == ThreadKeys.POINTS.value:
+        return "Points"
+    raise Exception("Unknown Thread!")
+
+
+def per_call(seconds, number):
+    return f"{seconds / number * 1e9:8.0f}ns"
+
+
+async def build(values, number):
+    start = time.perf_counter()
+    for _ in range(number):
+        await get_thread(1, values)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--number", type=int, default=100_000)
+    args = parser.parse_args()
+    number = args.number
+
+    # Import every thread before timing
+    for key in ThreadKeys:
+        get_thread_class(key.value)
+
+    print("thread class lookup per event")
+    for key in (ThreadKeys.ONBOARDING, ThreadKeys.POINTS):
+        name = key.value
+        chained = timeit.timeit(lambda: chain(name), number=number)
+        registry = timeit.timeit(lambda: get_thread_class(name), number=number)
+        print(
+            f"  {name:24} if/elif {per_call(chained, number)}"
+            f"  registry {per_call(registry, number)}"
+        )
+
+    print("get_thread per event")
+    step = hashlib.sha256("".encode()).hexdigest()
+    for key in (ThreadKeys.UPDATE_PROFILE, ThreadKeys.REPORT):
+        values = {"thread": key.value, "step": step, "guild_id": 1}
+        elapsed = asyncio.run(build(values, number // 10))
+        print(f"  {key.value:24} {per_call(elapsed, number // 10)}")
+
+
+if __name__ == "__main__":
+    main()
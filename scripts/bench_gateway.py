@@ -0,0 +1,299 @@
+"""Compare gateway intent profiles on recorded gateway events
+
+Events recorded with GATEWAY_RECORD (record with ALL_INTENTS=true to
+see everything the bot could receive) are replayed into a discord
+client state for each profile. Events the gateway would not send for a
+profile's intents are dropped the way discord drops them, and the
+number of events delivered and the memory the client cache holds
+afterwards are reported. Without a recording a synthetic one with
+busy guilds is generated.
+
+    python -m scripts.bench_gateway [--record events.jsonl]
+"""
+import argparse
+import asyncio
+import copy
+import json
+import random
+import tracemalloc
+
+import discord
+from discord.state import ConnectionState
+
+from bot.common.bot.gateway import build_intents
+
+PROFILES = {
+    "all": {"all_intents": True},
+    "minimal": {"features": ["commands", "conversations"]},
+    "minimal+members": {
+        "features": ["commands", "conversations"],
+        "extra_intents": ["members"],
+    },
+}
+
+# Events delivered under an intent, those split by guild and DM
+# events are looked up with a guild_ or dm_ prefix
+EVENT_INTENTS = {
+    "GUILD_CREATE": "guilds",
+    "CHANNEL_CREATE": "guilds",
+    "GUILD_MEMBER_ADD": "members",
+    "GUILD_MEMBER_UPDATE": "members",
+    "GUILD_MEMBER_REMOVE": "members",
+    "PRESENCE_UPDATE": "presences",
+    "TYPING_START": "typing",
+    "MESSAGE_CREATE": "messages",
+    "MESSAGE_UPDATE": "messages",
+    "MESSAGE_REACTION_ADD": "reactions",
+    "MESSAGE_REACTION_REMOVE": "reactions",
+}
+
+BOT_ID = 1
+
+
+def delivered(event, intents):
+    """The payload discord would send for the intents or None"""
+    name, data = event["t"], event["d"]
+    intent = EVENT_INTENTS.get(name)
+    if intent in ("typing", "messages", "reactions"):
+        intent = f"{'guild' if data.get('guild_id') else 'dm'}_{intent}"
+    if intent is not None and not getattr(intents, intent):
+        return None
+    if name == "GUILD_CREATE":
+        data = dict(data)
+        if not intents.presences:
+            data["presences"] = []
+        if not intents.members:
+            data["members"] = [
+                m for m in data["members"] if int(m["user"]["id"]) == BOT_ID
+            ]
+    return data
+
+
+def replay(events, intents):
+    async def run():
+        state = ConnectionState(
+            dispatch=lambda *args: None,
+            handlers={},
+            hooks={},
+            http=None,
+            loop=asyncio.get_running_loop(),
+            intents=intents,
+            member_cache_flags=discord.MemberCacheFlags.from_intents(intents),
+            chunk_guilds_at_startup=False,
+            max_messages=1000,
+        )
+        count = 0
+        tracemalloc.start()
+        for event in events:
+            data = delivered(event, intents)
+            if data is None:
+                continue
+            count += 1
+            parse = state.parsers.get(event["t"])
+            if parse is not None:
+                parse(copy.deepcopy(data))
+        memory = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        if state._ready_task is not None:
+            state._ready_task.cancel()
+        return count, memory
+
+    return asyncio.run(run())
+
+
+def synthesize(guilds, members, events):
+    """A recording of busy guilds with a few DM conversations"""
+    rng = random.Random(0)
+
+    def user(id_):
+        return {
+            "id": str(id_),
+            "username": f"user{id_}",
+            "discriminator": "0001",
+            "avatar": None,
+        }
+
+    def member(id_):
+        return {
+            "user": user(id_),
+            "roles": [],
+            "joined_at": "2021-01-01T00:00:00+00:00",
+            "deaf": False,
+            "mute": False,
+        }
+
+    recording = [
+        {
+            "t": "READY",
+            "d": {
+                "v": 9,
+                "user": {**user(BOT_ID), "bot": True},
+                "guilds": [],
+                "session_id": "replay",
+                "application": {"id": str(BOT_ID), "flags": 0},
+            },
+        }
+    ]
+    user_ids = range(1000, 1000 + members)
+    for guild_id in range(10, 10 + guilds):
+        guild_members = rng.sample(user_ids, min(members, 500))
+        recording.append(
+            {
+                "t": "GUILD_CREATE",
+                "d": {
+                    "id": str(guild_id),
+                    "name": f"guild{guild_id}",
+                    "owner_id": str(guild_members[0]),
+                    "member_count": len(guild_members) + 1,
+                    "members": [member(BOT_ID)] + [member(i) for i in guild_members],
+                    "presences": [
+                        {
+                            "user": {"id": str(i)},
+                            "status": "online",
+                            "activities": [],
+                            "client_status": {},
+                        }
+                        for i in guild_members
+                    ],
+                    "channels": [
+                        {
+                            "id": str(guild_id * 100),
+                            "type": 0,
+                            "name": "general",
+                            "position": 0,
+                            "permission_overwrites": [],
+                        }
+                    ],
+                    "roles": [
+                        {
+                            "id": str(guild_id),
+                            "name": "@everyone",
+                            "permissions": "0",
+                            "position": 0,
+                            "color": 0,
+                            "hoist": False,
+                            "managed": False,
+                            "mentionable": False,
+                        }
+                    ],
+                    "emojis": [],
+                    "stickers": [],
+                    "features": [],
+                    "voice_states": [],
+                    "threads": [],
+                    "stage_instances": [],
+                },
+            }
+        )
+
+    for i in range(events):
+        guild_id = rng.randrange(10, 10 + guilds)
+        user_id = rng.choice(user_ids)
+        kind = rng.random()
+        if kind < 0.5:
+            recording.append(
+                {
+                    "t": "PRESENCE_UPDATE",
+                    "d": {
+                        "user": {"id": str(user_id)},
+                        "guild_id": str(guild_id),
+                        "status": rng.choice(["online", "idle", "offline"]),
+                        "activities": [],
+                        "client_status": {},
+                    },
+                }
+            )
+        elif kind < 0.7:
+            recording.append(
+                {
+                    "t": "TYPING_START",
+                    "d": {
+                        "channel_id": str(guild_id * 100),
+                        "guild_id": str(guild_id),
+                        "user_id": str(user_id),
+                        "timestamp": 0,
+                    },
+                }
+            )
+        elif kind < 0.9:
+            recording.append(
+                {
+                    "t": "MESSAGE_CREATE",
+                    "d": {
+                        "id": str(10**6 + i),
+                        "channel_id": str(guild_id * 100),
+                        "guild_id": str(guild_id),
+                        "author": user(user_id),
+                        "content": "gm " * rng.randrange(1, 30),
+                        "timestamp": "2021-01-01T00:00:00+00:00",
+                        "edited_timestamp": None,
+                        "tts": False,
+                        "mention_everyone": False,
+                        "mentions": [],
+                        "mention_roles": [],
+                        "attachments": [],
+                        "embeds": [],
+                        "pinned": False,
+                        "type": 0,
+                    },
+                }
+            )
+        else:
+            recording.append(
+                {
+                    "t": "MESSAGE_REACTION_ADD",
+                    "d": {
+                        "user_id": str(user_id),
+                        "channel_id": str(guild_id * 100),
+                        "message_id": str(10**6 + i),
+                        "guild_id": str(guild_id),
+                        "emoji": {"id": None, "name": "\U0001F44D"},
+                    },
+                }
+            )
+        if kind > 0.98:
+            # A DM reaction continuing a conversation
+            recording.append(
+                {
+                    "t": "MESSAGE_REACTION_ADD",
+                    "d": {
+                        "user_id": str(user_id),
+                        "channel_id": str(user_id * 10),
+                        "message_id": str(10**6 + i),
+                        "emoji": {"id": None, "name": "\U0001F44D"},
+                    },
+                }
+            )
+    return recording
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--record", help="a file recorded with GATEWAY_RECORD")
+    parser.add_argument("--guilds", type=int, default=20)
+    parser.add_argument("--members", type=int, default=5000)
+    parser.add_argument("--events", type=int, default=20000)
+    args = parser.parse_args()
+
+    if args.record:
+        with open(args.record) as f:
+            events = [json.loads(line) for line in f if line.strip()]
+    else:
+        events = synthesize(args.guilds, args.members, args.events)
+
+    print(f"{len(events)} recorded events")
+    for name, profile in PROFILES.items():
+        intents = build_intents(
+            profile.get("features", ()),
+            profile.get("extra_intents", ()),
+            profile.get("all_intents", False),
+        )
+        count, memory = replay(events, intents)
+        print(
+            f"  {name:16} {count:7} events delivered"
+            f"  {memory / 2**10:9.0f}KiB cached"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""Compare the thread state serializers
+
+Reports encode/decode throughput and the size of a typical state for
+each serializer. If REDIS_URL points at a reachable redis the states
+are also written to a scratch database to measure the memory 100k
+conversations take up.
+
+    python -m scripts.bench_serializers
+"""
+import asyncio
+import hashlib
+import os
+import timeit
+
+import aioredis
+
+from bot.common.serializers import SERIALIZERS, decode_cache_value
+
+CONVERSATIONS = 100_000
+SCRATCH_DB = 15
+
+
+def sample_states():
+    step = hashlib.sha256(b"step").hexdigest()
+    base = {
+        "thread": "onboarding",
+        "step": step,
+        "guild_id": 799328534988193793,
+        "message_id": "",
+    }
+    return {
+        "no metadata": base,
+        "small metadata": {**base, "metadata": {"guild_name": "govrn"}},
+        "dao list": {
+            **base,
+            "thread": "update_profile",
+            "metadata": {str(i): f"Some DAO {i}" for i in range(25)},
+        },
+    }
+
+
+def available_serializers():
+    for name, cls in SERIALIZERS.items():
+        try:
+            yield name, cls()
+        except Exception as e:
+            print(f"skipping {name}: {e}")
+
+
+async def redis_memory(serializer, values):
+    redis = aioredis.from_url(os.environ["REDIS_URL"], db=SCRATCH_DB)
+    await redis.flushdb()
+    before = (await redis.info("memory"))["used_memory"]
+    encoded = serializer.encode(values)
+    for start in range(0, CONVERSATIONS, 1000):
+        async with redis.pipeline(transaction=False) as pipe:
+            for user_id in range(start, start + 1000):
+                pipe.set(str(100000000000000000 + user_id), encoded)
+            await pipe.execute()
+    after = (await redis.info("memory"))["used_memory"]
+    await redis.flushdb()
+    await redis.close()
+    return after - before
+
+
+def main():
+    serializers = list(available_serializers())
+    for label, values in sample_states().items():
+        print(f"\n{label}")
+        for name, serializer in serializers:
+            encoded = serializer.encode(values)
+            number = 20000
+            encode = timeit.timeit(lambda: serializer.encode(values), number=number)
+            decode = timeit.timeit(lambda: decode_cache_value(encoded), number=number)
+            line = (
+                f"  {name:8} {len(encoded):5} bytes"
+                f"  encode {encode / number * 1e6:6.2f}us"
+                f"  decode {decode / number * 1e6:6.2f}us"
+                f"  {len(encoded) * CONVERSATIONS / 2**20:6.1f}MiB payload per 100k"
+            )
+            if os.getenv("REDIS_URL"):
+                used = asyncio.run(redis_memory(serializer, values))
+                line += f"  {used / 2**20:6.1f}MiB redis per 100k"
+            print(line)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+"""Profile how long importing the bot takes
+
+Imports a module in fresh interpreters started with ``-X importtime``
+and reports the median wall time of the import, and the modules that
+took longest including their own imports in the last run. The raw
+importtime report of the last run can be saved for tools like tuna.
+
+    python -m scripts.bench_startup [--module bot.common.commands]
+        [--runs 5] [--top 15] [--output importtime.txt]
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+
+def import_once(module):
+    """Import a module in a new interpreter, returns the seconds it
+    took and the importtime report"""
+    start = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True,
+        env={**os.environ, "PYTHONPATH": os.getcwd()},
+    )
+    elapsed = time.perf_counter() - start
+    if result.returncode:
+        sys.exit(result.stderr)
+    return elapsed, result.stderr
+
+
+def parse_report(report):
+    """The cumulative microseconds of each module in a report"""
+    times = {}
+    for line in report.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:") :].split("|")
+        times[name.strip()] = int(cumulative)
+    return times
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--module", default="bot.common.commands")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=15)
+    parser.add_argument("--output", help="file to save the last report to")
+    args = parser.parse_args()
+
+    # The first run warms the bytecode cache
+    import_once(args.module)
+    runs = [import_once(args.module) for _ in range(args.runs)]
+    report = runs[-1][1]
+    times = parse_report(report)
+
+    print(f"import {args.module}, {args.runs} runs")
+    print(f"  median wall time {statistics.median(r[0] for r in runs) * 1000:.0f}ms")
+    print(f"  import time      {times.get(args.module, 0) / 1000:.0f}ms")
+    for name in ("discord", "aioredis", "pyairtable", "yaml", "bot.constants"):
+        if name in times:
+            print(f"    {name:24} {times[name] / 1000:6.1f}ms")
+    print(f"  slowest of {len(times)} modules")
+    for name, cumulative in sorted(times.items(), key=lambda t: -t[1])[: args.top]:
+        print(f"    {name:40} {cumulative / 1000:6.1f}ms")
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(report)
+
+
+if __name__ == "__main__":
+    main()
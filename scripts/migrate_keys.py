@@ -0,0 +1,28 @@
+"""Move cache keys stored under bare user ids to the namespaced schema
+
+Run once after deploying namespaced keys, conversations stored under
+the old keys are invisible to the bot until they are moved.
+
+    python -m scripts.migrate_keys [--dry-run]
+"""
+import argparse
+import asyncio
+import logging
+
+from bot.common.maintenance import migrate_keys
+from bot.config import Redis
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--dry-run", action="store_true", help="only count the keys to move"
+    )
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    stats = asyncio.run(migrate_keys(Redis, dry_run=args.dry_run))
+    print(stats)
+
+
+if __name__ == "__main__":
+    main()
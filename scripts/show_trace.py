@@ -0,0 +1,92 @@
+"""Print the traces recorded by the file trace exporter as trees
+
+Each span is shown with its start offset from the root and duration in
+milliseconds. Redis, Discord and Airtable calls that started only after
+the previous call under the same span ended are marked with ``>``,
+these ran one after the other and are candidates to run concurrently.
+
+    python -m scripts.show_trace [traces.jsonl] [--last 5]
+"""
+import argparse
+import json
+
+from collections import defaultdict
+
+IO_PREFIXES = ("redis.", "discord.", "airtable.")
+
+
+def load_traces(path):
+    traces = defaultdict(list)
+    with open(path) as f:
+        for line in f:
+            if line.strip():
+                span = json.loads(line)
+                traces[span["traceId"]].append(span)
+    return traces
+
+
+def attributes(span):
+    return {a["key"]: a["value"]["stringValue"] for a in span["attributes"]}
+
+
+def is_io(span):
+    return span["name"].startswith(IO_PREFIXES)
+
+
+def print_trace(spans):
+    children = defaultdict(list)
+    ids = {span["spanId"] for span in spans}
+    roots = []
+    for span in spans:
+        parent = span.get("parentSpanId")
+        if parent in ids:
+            children[parent].append(span)
+        else:
+            roots.append(span)
+    serial = 0
+
+    def show(span, depth, origin, marker):
+        nonlocal serial
+        start = (span["startTimeUnixNano"] - origin) / 1e6
+        duration = (span["endTimeUnixNano"] - span["startTimeUnixNano"]) / 1e6
+        error = " ERROR" if span["status"]["code"] == 2 else ""
+        name = "  " * depth + span["name"]
+        print(f"{marker} {start:8.1f} {duration:8.1f}  {name}{error}")
+        previous_end = None
+        for child in sorted(
+            children[span["spanId"]], key=lambda s: s["startTimeUnixNano"]
+        ):
+            after = (
+                previous_end is not None and child["startTimeUnixNano"] >= previous_end
+            )
+            if is_io(child) and after:
+                serial += 1
+            show(child, depth + 1, origin, ">" if is_io(child) and after else " ")
+            if is_io(child):
+                previous_end = max(previous_end or 0, child["endTimeUnixNano"])
+
+    for root in sorted(roots, key=lambda s: s["startTimeUnixNano"]):
+        context = " ".join(
+            f"{k}={v}" for k, v in attributes(root).items() if k != "service.name"
+        )
+        print(f"trace {root['traceId']} {context}")
+        print("   start ms    dur ms")
+        show(root, 0, root["startTimeUnixNano"], " ")
+    print(f"  {serial} calls waited for the previous call under the same span\n")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("path", nargs="?", default="traces.jsonl")
+    parser.add_argument("--last", type=int, default=5, help="traces to show")
+    args = parser.parse_args()
+    traces = load_traces(args.path)
+    ordered = sorted(
+        traces.values(), key=lambda spans: min(s["startTimeUnixNano"] for s in spans)
+    )
+    for spans in ordered[-args.last :]:
+        print_trace(spans)
+
+
+if __name__ == "__main__":
+    main()
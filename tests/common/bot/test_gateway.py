@@ -0,0 +1,22 @@
+import discord
+import pytest
+
+from bot.common.bot.gateway import build_intents
+
+
+def test_build_intents_for_features():
+    intents = build_intents(["commands", "conversations"])
+    assert intents.guilds and intents.dm_messages and intents.dm_reactions
+    assert not intents.members
+    assert not intents.presences
+    assert not intents.guild_messages
+    assert not intents.guild_reactions
+
+
+def test_build_intents_extra_and_all():
+    assert build_intents(["commands"], ["members"]).members
+    assert build_intents([], all_intents=True) == discord.Intents.all()
+    with pytest.raises(Exception):
+        build_intents(["commands"], ["everything"])
+    with pytest.raises(Exception):
+        build_intents(["dancing"])
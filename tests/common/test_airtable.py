@@ -0,0 +1,120 @@
+import asyncio
+import pytest
+
+from bot.common.airtable import (
+    BATCH_SIZE,
+    RecordBatcher,
+    add_user_to_contribution,
+    chunks,
+)
+from unittest.mock import AsyncMock
+
+
+def echo_update(table_name, records, base_id):
+    return records
+
+
+def test_chunks():
+    assert [len(chunk) for chunk in chunks(list(range(25)))] == [10, 10, 5]
+
+
+@pytest.mark.asyncio
+async def test_batcher_flushes_on_size(mocker):
+    send = mocker.patch(
+        "bot.common.airtable.batch_update", new=AsyncMock(side_effect=echo_update)
+    )
+    batcher = RecordBatcher("Users", max_delay=60)
+    results = await asyncio.gather(
+        *(batcher.update(f"rec{i}", {"twitter": i}) for i in range(BATCH_SIZE))
+    )
+    assert send.await_count == 1
+    assert results[3] == {"id": "rec3", "fields": {"twitter": 3}}
+
+
+@pytest.mark.asyncio
+async def test_batcher_flushes_on_time_and_merges(mocker):
+    send = mocker.patch(
+        "bot.common.airtable.batch_update", new=AsyncMock(side_effect=echo_update)
+    )
+    batcher = RecordBatcher("Users", max_delay=0.01)
+    results = await asyncio.gather(
+        batcher.update("rec1", {"twitter": "a"}),
+        batcher.update("rec2", {"twitter": "b"}),
+        batcher.update("rec1", {"wallet": "c"}),
+    )
+    assert send.await_count == 1
+    assert send.await_args.args[1] == [
+        {"id": "rec1", "fields": {"twitter": "a", "wallet": "c"}},
+        {"id": "rec2", "fields": {"twitter": "b"}},
+    ]
+    assert results[0] is results[2]
+    assert batcher.requests == 1
+
+
+@pytest.mark.asyncio
+async def test_batcher_raises_for_every_write(mocker):
+    mocker.patch(
+        "bot.common.airtable.batch_create",
+        new=AsyncMock(side_effect=Exception("422")),
+    )
+    batcher = RecordBatcher("Users", max_delay=0.01)
+    results = await asyncio.gather(
+        batcher.create({"Name": "a"}),
+        batcher.create({"Name": "b"}),
+        return_exceptions=True,
+    )
+    assert [str(result) for result in results] == ["422", "422"]
+
+
+@pytest.mark.asyncio
+async def test_add_user_to_contribution_creates_progress(mocker):
+    table = mocker.patch("bot.common.airtable.Table").return_value
+    table.all.return_value = [{"id": "recFlow", "fields": {"users": ["recOld"]}}]
+    mocker.patch("bot.common.airtable.find_user", new=AsyncMock(return_value="recUser"))
+    mocker.patch("bot.common.airtable.find_progress", new=AsyncMock(return_value=None))
+    create = mocker.patch(
+        "bot.common.airtable.progress_creates.create", new=AsyncMock()
+    )
+
+    await add_user_to_contribution(2, 1, 3)
+    table.update.assert_not_called()
+    create.assert_awaited_once_with(
+        {
+            "contribution": ["recFlow"],
+            "user": ["recUser"],
+            "guild_id": "2",
+            "discord_id": "1",
+            "order": 3,
+        },
+        key=("2", "1", 3),
+    )
+
+
+@pytest.mark.asyncio
+async def test_add_user_to_contribution_skips_recorded_progress(mocker):
+    mocker.patch(
+        "bot.common.airtable.find_progress",
+        new=AsyncMock(return_value={"id": "recProgress"}),
+    )
+    create = mocker.patch(
+        "bot.common.airtable.progress_creates.create", new=AsyncMock()
+    )
+
+    assert await add_user_to_contribution(2, 1, 3) == {"id": "recProgress"}
+    create.assert_not_awaited()
+
+
+@pytest.mark.asyncio
+async def test_batcher_creates_once_per_key(mocker):
+    send = mocker.patch(
+        "bot.common.airtable.batch_create",
+        new=AsyncMock(side_effect=lambda table_name, records, base_id: records),
+    )
+    batcher = RecordBatcher("Contribution Progress", max_delay=0.01)
+    results = await asyncio.gather(
+        batcher.create({"order": 1}, key=("1", "2", 1)),
+        batcher.create({"order": 1}, key=("1", "2", 1)),
+        batcher.create({"order": 2}, key=("1", "2", 2)),
+    )
+    assert send.await_args.args[1] == [{"order": 1}, {"order": 2}]
+    assert results[0] is results[1]
@@ -0,0 +1,133 @@
+import asyncio
+
+import pytest
+
+from bot.common.cache import LRUCache, TieredCache
+from tests.test_utils import MockCache
+from unittest.mock import AsyncMock, Mock
+
+
+def test_lru_cache_evicts_least_recently_used():
+    cache = LRUCache(maxsize=2, ttl=60)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+    cache.set("c", 3)
+
+    assert cache.get("a") == 1
+    assert cache.get("b") is None
+    assert cache.get("c") == 3
+
+
+def test_lru_cache_expires_entries():
+    cache = LRUCache(maxsize=2, ttl=-1)
+    cache.set("a", 1)
+
+    assert cache.get("a") is None
+    assert len(cache) == 0
+
+
+@pytest.mark.asyncio
+async def test_tiered_cache_serves_own_writes_from_memory():
+    backend = MockCache()
+    backend.get_versioned = AsyncMock(wraps=backend.get_versioned)
+    cache = TieredCache(backend, maxsize=10, ttl=60)
+
+    version = await cache.compare_and_set("1", "value")
+    assert await cache.get_versioned("1") == ("value", version)
+    assert backend.get_versioned.await_count == 0
+    assert cache.hit_ratio == 1.0
+
+
+@pytest.mark.asyncio
+async def test_tiered_cache_merges_hash_writes():
+    backend = MockCache()
+    backend.get_hash = AsyncMock(wraps=backend.get_hash)
+    cache = TieredCache(backend, maxsize=10, ttl=60)
+
+    version = await cache.compare_and_set_hash("1", {"a": "1", "b": "2"}, replace=True)
+    version = await cache.compare_and_set_hash("1", {"c": "3"}, ["a"], version=version)
+    assert await cache.get_hash("1") == ({"b": "2", "c": "3"}, version)
+    assert backend.get_hash.await_count == 0
+
+
+@pytest.mark.asyncio
+async def test_tiered_cache_caches_missing_keys():
+    backend = MockCache()
+    backend.get = AsyncMock(wraps=backend.get)
+    cache = TieredCache(backend, maxsize=10, ttl=60)
+
+    assert await cache.get("1") is None
+    assert await cache.get("1") is None
+    assert backend.get.await_count == 1
+    assert cache.stats()["misses"] == 1
+
+
+@pytest.mark.asyncio
+async def test_tiered_cache_drops_stale_entry_on_conflict():
+    backend = MockCache()
+    cache = TieredCache(backend, maxsize=10, ttl=60)
+
+    version = await cache.compare_and_set("1", "mine")
+    # Another process writes behind our back
+    await backend.compare_and_set("1", "theirs")
+
+    assert await cache.compare_and_set("1", "again", version) is None
+    assert await cache.get_versioned("1") == ("theirs", version + 1)
+
+
+@pytest.mark.asyncio
+async def test_tiered_cache_delete():
+    backend = MockCache()
+    cache = TieredCache(backend, maxsize=10, ttl=60)
+
+    await cache.set("1", "value")
+    await cache.delete("1")
+    assert await cache.get("1") is None
+
+
+@pytest.mark.asyncio
+async def test_batch_returns_results_in_order():
+    cache = MockCache()
+    await cache.set("1", "a")
+
+    results = await cache.batch().get("1").set("2", "b", ex=10).delete("1").execute()
+    assert results == ["a", None, None]
+    assert cache.internal == {"2": "b"}
+    assert cache.ttls["2"] == 10
+
+
+@pytest.mark.asyncio
+async def test_tiered_batch_serves_gets_from_memory():
+    backend = MockCache()
+    backend.get = AsyncMock(wraps=backend.get)
+    cache = TieredCache(backend, maxsize=10, ttl=60)
+    await cache.set("1", "a")
+
+    batch = cache.batch().get("1").set("2", "b").get("2")
+    assert await batch.execute() == ["a", None, "b"]
+    # Only the read of the key written in the batch hit the backend
+    assert backend.get.await_count == 1
+    assert await cache.get("2") == "b"
+    assert cache.hits == 2
+
+
+@pytest.mark.asyncio
+async def test_tiered_cache_start_listener_waits_for_subscription():
+    backend = MockCache()
+
+    async def listen():
+        await asyncio.Event().wait()
+        yield
+
+    pubsub = AsyncMock()
+    pubsub.listen = listen
+    redis = Mock()
+    redis.pubsub.return_value = pubsub
+    cache = TieredCache(backend, maxsize=10, ttl=60, redis=redis, channel="c")
+
+    await cache.start_listener()
+    pubsub.subscribe.assert_awaited_once_with("c")
+    await cache.start_listener()
+    assert redis.pubsub.call_count == 1
+    cache._listener.cancel()
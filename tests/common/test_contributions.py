@@ -0,0 +1,68 @@
+import asyncio
+import pytest
+
+from bot.common.contributions import ContributionIndex
+from unittest.mock import AsyncMock
+
+FLOW = [
+    {"id": "recTwo", "fields": {"order": 2}},
+    {"id": "recOne", "fields": {"order": 1}},
+]
+PROGRESS = [{"fields": {"discord_id": "1", "order": 1}}]
+
+
+@pytest.fixture
+def airtable(mocker):
+    async def get_records(guild_id):
+        await asyncio.sleep(0.01)
+        return FLOW
+
+    return (
+        mocker.patch(
+            "bot.common.airtable.get_contribution_records",
+            new=AsyncMock(side_effect=get_records),
+        ),
+        mocker.patch(
+            "bot.common.airtable.get_guild_progress",
+            new=AsyncMock(return_value=PROGRESS),
+        ),
+    )
+
+
+@pytest.mark.asyncio
+async def test_index_loads_guild_once(airtable):
+    index = ContributionIndex(ttl=60)
+    flows = await asyncio.gather(index.get_flow(10), index.get_flow("10"))
+    assert [r["id"] for r in flows[0]] == ["recOne", "recTwo"]
+    assert await index.get_contribution_id(10, 2) == "recTwo"
+    assert await index.has_completed(10, 1, 1) is True
+    assert await index.has_completed(10, 1, 2) is False
+    assert index.loads == 1
+    assert airtable[0].await_count == 1
+
+
+@pytest.mark.asyncio
+async def test_index_records_progress(airtable):
+    index = ContributionIndex(ttl=60)
+    await index.get_flow(10)
+    index.record(10, 1, 2)
+    assert await index.has_completed(10, 1, 2) is True
+    assert index.loads == 1
+
+
+@pytest.mark.asyncio
+async def test_index_records_progress_while_loading(airtable):
+    index = ContributionIndex(ttl=60)
+    loading = asyncio.ensure_future(index.get_flow(10))
+    await asyncio.sleep(0)
+    index.record(10, 3, 2)
+    await loading
+    assert await index.has_completed(10, 3, 2) is True
+
+
+@pytest.mark.asyncio
+async def test_index_reloads_after_ttl(airtable):
+    index = ContributionIndex(ttl=0)
+    await index.get_flow(10)
+    await index.get_flow(10)
+    assert index.loads == 2
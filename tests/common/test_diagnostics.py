@@ -0,0 +1,39 @@
+import asyncio
+import pytest
+import time
+
+from bot.common.diagnostics import Diagnostics
+
+
+def block_loop():
+    time.sleep(0.2)
+
+
+@pytest.mark.asyncio
+async def test_diagnostics_samples_blocking_work(tmp_path):
+    diagnostics = Diagnostics(
+        sample_interval=0.005,
+        slow_callback=0.1,
+        lag_interval=0.01,
+        dump_dir=str(tmp_path),
+    )
+    diagnostics.start()
+    try:
+        await asyncio.sleep(0.02)
+        block_loop()
+        await asyncio.sleep(0.02)
+        assert diagnostics.max_lag >= 0.1
+        path, summary = diagnostics.dump()
+    finally:
+        diagnostics.stop()
+
+    with open(path) as f:
+        lines = f.read().splitlines()
+    blocked = [line for line in lines if "block_loop (test_diagnostics.py" in line]
+    assert blocked
+    stack, count = blocked[0].rsplit(" ", 1)
+    assert stack.split(";")[-1].startswith("block_loop")
+    assert int(count) > 1
+    assert "samples" in summary
+    assert diagnostics.samples == {}
+    assert not asyncio.get_running_loop().get_debug()
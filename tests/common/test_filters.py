@@ -0,0 +1,54 @@
+import pytest
+
+from bot.common.filters import OpenThreads, accept_reaction
+from bot.common.keys import build_thread_key
+from unittest.mock import MagicMock
+
+BOT_ID = 99
+
+
+def build_payload(**kwargs):
+    payload = MagicMock(guild_id=None, user_id=1, member=None)
+    for name, value in kwargs.items():
+        setattr(payload, name, value)
+    return payload
+
+
+def test_accept_reaction_uses_payload():
+    assert accept_reaction(build_payload(), BOT_ID) is True
+    assert accept_reaction(build_payload(guild_id=1), BOT_ID) is False
+    assert accept_reaction(build_payload(user_id=BOT_ID), BOT_ID) is False
+    assert accept_reaction(build_payload(member=MagicMock(bot=True)), BOT_ID) is False
+
+
+def test_open_threads_rule_out_users_once_ready(monkeypatch):
+    threads = OpenThreads()
+    monkeypatch.setattr("bot.common.filters.open_threads", threads)
+    assert threads.may_have(1) is True
+
+    threads.ready = True
+    assert accept_reaction(build_payload(), BOT_ID) is False
+    threads.add(1)
+    assert accept_reaction(build_payload(), BOT_ID) is True
+    threads.discard("1")
+    assert threads.may_have(1) is False
+    threads.add_key(build_thread_key(2).encode())
+    assert threads.may_have(2) is True
+
+
+@pytest.mark.asyncio
+async def test_open_threads_load():
+    threads = OpenThreads()
+    redis = MagicMock()
+
+    async def scan_iter(match, count):
+        # A conversation is opened while the scan runs
+        threads.add(3)
+        for key in (build_thread_key(1), build_thread_key(2)):
+            yield key.encode()
+
+    redis.scan_iter = scan_iter
+    threads.add(4)
+    await threads.load(redis)
+    assert threads.ready is True
+    assert threads.users == {"1", "2", "3"}
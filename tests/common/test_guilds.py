@@ -0,0 +1,70 @@
+import asyncio
+import json
+import os
+import pytest
+
+from bot.common.guilds import GuildRegistry
+from unittest.mock import AsyncMock
+
+GUILDS = [{"id": 10, "name": "Config"}, {"id": 20, "name": "Other"}]
+RECORDS = [
+    {"id": "recGuild", "fields": {"guild_id": "10", "guild_name": "Table"}},
+    {"id": "recEmpty", "fields": {}},
+]
+
+
+@pytest.fixture
+def get_guilds(mocker):
+    async def load():
+        await asyncio.sleep(0.01)
+        return RECORDS
+
+    return mocker.patch(
+        "bot.common.airtable.get_guilds", new=AsyncMock(side_effect=load)
+    )
+
+
+def write_links(path, links, mtime):
+    path.write_text(json.dumps(links))
+    os.utime(path, ns=(mtime, mtime))
+
+
+@pytest.mark.asyncio
+async def test_registry_merges_sources(tmp_path, get_guilds):
+    path = tmp_path / "guilds.json"
+    write_links(path, {"10": "https://report", "30": "https://new"}, 1)
+    registry = GuildRegistry(path, GUILDS, reload_interval=0, table_ttl=60)
+    guilds = await asyncio.gather(registry.get(10), registry.get("10"))
+    assert guilds[0].name == "Table"
+    assert guilds[0].report_link == "https://report"
+    assert guilds[0].fields["guild_name"] == "Table"
+    assert (await registry.get(20)).report_link is None
+    assert (await registry.get(30)).report_link == "https://new"
+    assert await registry.get(40) is None
+    assert get_guilds.await_count == 1
+
+
+@pytest.mark.asyncio
+async def test_registry_reloads_changed_file(tmp_path, get_guilds):
+    path = tmp_path / "guilds.json"
+    write_links(path, {"10": "https://old"}, 1)
+    registry = GuildRegistry(path, GUILDS, reload_interval=0, table_ttl=60)
+    assert (await registry.get(10)).report_link == "https://old"
+    await registry.get(10)
+    assert registry.reloads == 1
+
+    write_links(path, {"10": "https://new"}, 2)
+    assert (await registry.get(10)).report_link == "https://new"
+    assert registry.reloads == 2
+
+
+@pytest.mark.asyncio
+async def test_registry_keeps_links_of_bad_file(tmp_path, get_guilds):
+    path = tmp_path / "guilds.json"
+    write_links(path, {"10": "https://old"}, 1)
+    registry = GuildRegistry(path, GUILDS, reload_interval=0, table_ttl=60)
+    await registry.get(10)
+
+    path.write_text("{")
+    os.utime(path, ns=(2, 2))
+    assert (await registry.get(10)).report_link == "https://old"
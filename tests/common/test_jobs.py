@@ -0,0 +1,132 @@
+import json
+import pytest
+
+from bot.common.jobs import JOBS, JobQueue, build_batches, job
+from unittest.mock import AsyncMock, MagicMock
+
+
+def build_queue():
+    redis = MagicMock()
+    redis.xadd = AsyncMock()
+    return JobQueue(
+        redis,
+        "test",
+        partitions=4,
+        max_attempts=3,
+        retry_delay=0,
+        lease_ttl=30,
+        block=1,
+    )
+
+
+def build_fields(name, **kwargs):
+    return {b"job": name.encode(), b"args": json.dumps(kwargs).encode()}
+
+
+@pytest.fixture
+def jobs():
+    names = set(JOBS)
+    yield
+    for name in set(JOBS) - names:
+        del JOBS[name]
+
+
+def test_partition_is_stable():
+    queue = build_queue()
+    assert queue.partition(123) == queue.partition("123")
+    assert {queue.partition(i) for i in range(100)} == {0, 1, 2, 3}
+
+
+@pytest.mark.asyncio
+async def test_enqueue_unknown_job():
+    with pytest.raises(Exception):
+        await build_queue().enqueue("missing", 1)
+
+
+@pytest.mark.asyncio
+async def test_job_retries_until_it_succeeds(jobs):
+    calls = []
+
+    @job("flaky")
+    async def flaky(value):
+        calls.append(value)
+        if len(calls) < 3:
+            raise Exception("Airtable is down")
+
+    queue = build_queue()
+    lease = AsyncMock()
+    fields = build_fields("flaky", value=1)
+    await queue._attempt("stream", [(b"1-0", fields)], "flaky", [{"value": 1}], lease)
+    assert calls == [1, 1, 1]
+    assert lease.reacquire.await_count == 2
+    assert queue.completed == 1 and queue.failed == 0
+    queue.redis.xadd.assert_not_awaited()
+
+
+@pytest.mark.asyncio
+async def test_failed_job_is_dead_lettered(jobs):
+    failures = []
+
+    async def on_failure(error, value):
+        failures.append((str(error), value))
+
+    @job("broken", on_failure=on_failure)
+    async def broken(value):
+        raise Exception("Airtable is down")
+
+    queue = build_queue()
+    fields = build_fields("broken", value=1)
+    await queue._attempt(
+        "stream", [(b"1-0", fields)], "broken", [{"value": 1}], AsyncMock()
+    )
+    assert failures == [("Airtable is down", 1)]
+    assert queue.failed == 1
+    key, dead = queue.redis.xadd.await_args.args
+    assert key == queue.dead_letter_key
+    assert dead[b"job"] == b"broken" and dead[b"id"] == b"1-0"
+
+
+def test_batches_group_consecutive_jobs(jobs):
+    @job("batched", batch_size=2)
+    async def batched(batch):
+        pass
+
+    @job("single")
+    async def single(value):
+        pass
+
+    entries = [
+        (1, build_fields("batched")),
+        (2, build_fields("batched")),
+        (3, build_fields("batched")),
+        (4, build_fields("single")),
+        (5, build_fields("single")),
+        (6, build_fields("batched")),
+        (7, None),
+    ]
+    assert [[i for i, _ in batch] for batch in build_batches(entries)] == [
+        [1, 2],
+        [3],
+        [4],
+        [5],
+        [6],
+        [7],
+    ]
+
+
+@pytest.mark.asyncio
+async def test_failed_batch_runs_jobs_one_at_a_time(jobs):
+    runs = []
+
+    @job("batched", batch_size=10)
+    async def batched(batch):
+        runs.append([kwargs["value"] for kwargs in batch])
+        if any(kwargs["value"] == 2 for kwargs in batch):
+            raise Exception("Invalid record")
+
+    queue = build_queue()
+    entries = [(i, build_fields("batched", value=i)) for i in range(1, 4)]
+    args = [{"value": i} for i in range(1, 4)]
+    await queue._attempt("stream", entries, "batched", args, AsyncMock())
+    assert runs == [[1, 2, 3], [1], [2], [2], [2], [3]]
+    assert queue.completed == 2 and queue.failed == 1
@@ -0,0 +1,32 @@
+from bot.common.keys import (
+    build_congrats_key,
+    build_thread_key,
+    build_version_key,
+    parse_key,
+)
+from bot.common.maintenance import migrated_key
+
+
+def test_keys_share_hash_tag():
+    """
+    Every key of a user hashes to the same redis cluster slot
+    """
+    thread_key = build_thread_key(1234)
+    assert thread_key == "kevin:v1:{1234}:thread"
+    for key in (build_version_key(thread_key), build_congrats_key(1234)):
+        assert key[key.index("{") : key.index("}") + 1] == "{1234}"
+
+
+def test_parse_key():
+    assert parse_key(build_thread_key(1234)) == ("1234", "thread")
+    assert parse_key(build_congrats_key(1234).encode()) == ("1234", "congrats")
+    assert parse_key("other:v1:{1234}:thread") is None
+    assert parse_key("1234") is None
+
+
+def test_migrated_key():
+    assert migrated_key(b"1234") == build_thread_key("1234")
+    assert migrated_key("1234-version") == build_version_key(build_thread_key("1234"))
+    assert migrated_key("1234-congrats") == build_congrats_key("1234")
+    assert migrated_key("1234-lock") is None
+    assert migrated_key(build_thread_key("1234")) is None
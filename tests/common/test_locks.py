@@ -0,0 +1,63 @@
+import asyncio
+import pytest
+
+from bot.common.locks import KeyedLock
+
+
+@pytest.mark.asyncio
+async def test_keyed_lock_serializes_same_key():
+    """
+    Events for the same key run one after the other in arrival order
+    """
+    lock = KeyedLock()
+    events = []
+
+    async def handle(name):
+        async with lock.acquire("1"):
+            events.append(f"{name}-start")
+            await asyncio.sleep(0.01)
+            events.append(f"{name}-end")
+
+    await asyncio.gather(handle("a"), handle("b"), handle("c"))
+    assert events == ["a-start", "a-end", "b-start", "b-end", "c-start", "c-end"]
+
+
+@pytest.mark.asyncio
+async def test_keyed_lock_different_keys_run_concurrently():
+    """
+    Events for different keys are not blocked by each other
+    """
+    lock = KeyedLock()
+    events = []
+
+    async def handle(key):
+        async with lock.acquire(key):
+            events.append(f"{key}-start")
+            await asyncio.sleep(0.01)
+            events.append(f"{key}-end")
+
+    await asyncio.gather(handle("1"), handle("2"))
+    assert events[:2] == ["1-start", "2-start"]
+
+
+@pytest.mark.asyncio
+async def test_keyed_lock_cleans_up():
+    """
+    Locks are dropped once no one is holding or waiting on them
+    """
+    lock = KeyedLock()
+
+    async with lock.acquire("1"):
+        assert "1" in lock._locks
+    assert lock._locks == {}
+    assert lock._waiters == {}
+
+
+@pytest.mark.asyncio
+async def test_keyed_lock_releases_on_error():
+    lock = KeyedLock()
+
+    with pytest.raises(ValueError):
+        async with lock.acquire("1"):
+            raise ValueError()
+    assert lock._locks == {}
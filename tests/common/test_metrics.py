@@ -0,0 +1,67 @@
+import pytest
+
+from bot.common import metrics
+from bot.common.metrics import NULL_TIMER, Registry
+from unittest.mock import AsyncMock, MagicMock
+
+
+@pytest.fixture
+def enabled(mocker):
+    mocker.patch.object(metrics.registry, "enabled", True)
+
+
+def test_histogram_render():
+    registry = Registry(enabled=True)
+    histogram = registry.histogram("test_seconds", "Test", ("step",), (0.1, 1))
+    histogram.observe(0.05, "a")
+    histogram.observe(0.5, "a")
+    histogram.observe(5, 'say "hi"')
+    counter = registry.counter("test_total", "Test", ("step",))
+    counter.inc("a")
+    counter.inc("a", amount=2)
+
+    lines = registry.render().splitlines()
+    assert "# TYPE kevin_test_seconds histogram" in lines
+    assert 'kevin_test_seconds_bucket{step="a",le="0.1"} 1' in lines
+    assert 'kevin_test_seconds_bucket{step="a",le="1"} 2' in lines
+    assert 'kevin_test_seconds_bucket{step="a",le="+Inf"} 2' in lines
+    assert 'kevin_test_seconds_count{step="a"} 2' in lines
+    assert 'kevin_test_seconds_sum{step="a"} 0.55' in lines
+    assert 'kevin_test_seconds_bucket{step="say \\"hi\\"",le="+Inf"} 1' in lines
+    assert 'kevin_test_total{step="a"} 3' in lines
+
+
+def test_disabled_metrics_record_nothing():
+    registry = Registry(enabled=False)
+    histogram = registry.histogram("test_seconds", "Test", ("step",))
+    assert histogram.time("a") is NULL_TIMER
+    with histogram.time("a"):
+        pass
+    histogram.observe(1, "a")
+    assert histogram.count("a") == 0
+
+
+def test_instrument_airtable(enabled):
+    table = MagicMock(table_name="Users")
+    table._request.side_effect = [{"records": []}, Exception("rate limited")]
+    table = metrics.instrument_airtable(table)
+    count = metrics.AIRTABLE_SECONDS.count("Users", "get")
+
+    assert table._request("get", "url") == {"records": []}
+    with pytest.raises(Exception):
+        table._request("get", "url")
+    assert metrics.AIRTABLE_SECONDS.count("Users", "get") == count + 2
+
+
+@pytest.mark.asyncio
+async def test_instrument_redis(enabled):
+    client = MagicMock()
+    client.execute_command = AsyncMock(return_value=b"value")
+    client.pipeline.return_value.execute = AsyncMock(return_value=[])
+    client = metrics.instrument_redis(client)
+    count = metrics.REDIS_SECONDS.count("GET")
+
+    assert await client.execute_command("GET", "key") == b"value"
+    assert await client.pipeline(transaction=False).execute() == []
+    assert metrics.REDIS_SECONDS.count("GET") == count + 1
+    assert metrics.REDIS_SECONDS.count("pipeline") >= 1
@@ -0,0 +1,113 @@
+import asyncio
+import discord
+import pytest
+
+from bot.common.prompts import (
+    ReactionQueue,
+    build_custom_id,
+    build_prompt_view,
+    parse_prompt_interaction,
+    reactions,
+    send_prompt,
+)
+from unittest.mock import AsyncMock, MagicMock
+
+
+def build_message(channel_id, id_, added):
+    message = MagicMock(id=id_)
+    message.channel.id = channel_id
+
+    async def add_reaction(emoji):
+        await asyncio.sleep(0.01)
+        added.append((id_, emoji))
+
+    message.add_reaction = add_reaction
+    return message
+
+
+@pytest.mark.asyncio
+async def test_send_prompt_returns_before_reactions():
+    added = []
+    message = build_message(1, 1, added)
+    channel = AsyncMock()
+    channel.send.return_value = message
+
+    assert await send_prompt(channel, "hi", emojis=["a", "b"]) is message
+    channel.send.assert_awaited_with("hi")
+    assert added == []
+    await reactions.join()
+    assert added == [(1, "a"), (1, "b")]
+
+
+@pytest.mark.asyncio
+async def test_reaction_queue_orders_per_channel():
+    queue = ReactionQueue()
+    added = []
+    first, second = build_message(1, 1, added), build_message(1, 2, added)
+    other = build_message(2, 3, added)
+
+    queue.add(first, ["a", "b"])
+    queue.add(other, ["c"])
+    queue.add(second, ["d"])
+    assert len(queue._workers) == 2
+    await queue.join()
+    assert [a for a in added if a[0] != 3] == [(1, "a"), (1, "b"), (2, "d")]
+    assert (3, "c") in added
+    assert queue._workers == {} and queue._queues == {}
+
+
+@pytest.mark.asyncio
+async def test_reaction_queue_keeps_going_after_failure():
+    queue = ReactionQueue()
+    added = []
+    message = build_message(1, 1, added)
+    failing = build_message(1, 2, added)
+    failing.add_reaction = AsyncMock(
+        side_effect=discord.HTTPException(MagicMock(status=403), "forbidden")
+    )
+
+    queue.add(failing, ["a"])
+    queue.add(message, ["b"])
+    await queue.join()
+    assert added == [(1, "b")]
+    assert queue.failed == 1
+
+
+def build_interaction(custom_id, values=None):
+    data = {"custom_id": custom_id}
+    if values is not None:
+        data["values"] = values
+    return MagicMock(type=discord.InteractionType.component, data=data)
+
+
+@pytest.mark.asyncio
+async def test_prompt_view_buttons():
+    view = build_prompt_view(1, ["a", "b"])
+    assert [item.custom_id for item in view.children] == [
+        build_custom_id(1, "a"),
+        build_custom_id(1, "b"),
+    ]
+    assert view.is_finished()
+
+
+@pytest.mark.asyncio
+async def test_prompt_view_select():
+    emojis = [chr(0x1F600 + i) for i in range(8)]
+    view = build_prompt_view(1, emojis)
+    (select,) = view.children
+    assert isinstance(select, discord.ui.Select)
+    assert [option.value for option in select.options] == emojis
+
+    interaction = build_interaction(select.custom_id, values=[emojis[6]])
+    assert parse_prompt_interaction(interaction) == (1, emojis[6])
+
+
+def test_parse_prompt_interaction():
+    assert parse_prompt_interaction(build_interaction(build_custom_id(7, "a"))) == (
+        7,
+        "a",
+    )
+    assert parse_prompt_interaction(build_interaction("other:prompt:7:a")) is None
+    assert parse_prompt_interaction(build_interaction("something")) is None
+    command = MagicMock(type=discord.InteractionType.application_command)
+    assert parse_prompt_interaction(command) is None
@@ -0,0 +1,59 @@
+import asyncio
+import pytest
+
+from bot.common.resolver import EntityResolver
+from tests.test_utils import MockBot
+from unittest.mock import MagicMock
+
+
+@pytest.mark.asyncio
+async def test_resolver_prefers_gateway_cache():
+    bot = MockBot()
+    user = MagicMock()
+    bot.get_user.return_value = user
+    resolver = EntityResolver(bot, maxsize=10, ttl=60)
+
+    assert await resolver.get_user("1") is user
+    bot.get_user.assert_called_with(1)
+    assert bot.fetch_user.await_count == 0
+    assert resolver.fetches == 0
+
+
+@pytest.mark.asyncio
+async def test_resolver_caches_fetches():
+    bot = MockBot()
+    resolver = EntityResolver(bot, maxsize=10, ttl=60)
+
+    channel = await resolver.get_channel(1)
+    assert await resolver.get_channel(1) is channel
+    assert bot.fetch_channel.await_count == 1
+
+
+@pytest.mark.asyncio
+async def test_resolver_deduplicates_concurrent_fetches():
+    bot = MockBot()
+    guild = MagicMock()
+
+    async def fetch_guild(guild_id):
+        await asyncio.sleep(0.01)
+        return guild
+
+    bot.fetch_guild.side_effect = fetch_guild
+    resolver = EntityResolver(bot, maxsize=10, ttl=60)
+
+    guilds = await asyncio.gather(*[resolver.get_guild(1) for _ in range(5)])
+    assert guilds == [guild] * 5
+    assert bot.fetch_guild.await_count == 1
+    assert resolver._inflight == {}
+
+
+@pytest.mark.asyncio
+async def test_resolver_finds_cached_messages():
+    bot = MockBot()
+    message = MagicMock(id=5)
+    bot.cached_messages = [MagicMock(id=4), message]
+    channel = MagicMock()
+    resolver = EntityResolver(bot, maxsize=10, ttl=60)
+
+    assert await resolver.get_message(channel, 5) is message
+    assert not channel.fetch_message.called
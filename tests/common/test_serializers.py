@@ -0,0 +1,60 @@
+import json
+import pytest
+
+from bot.common.serializers import (
+    COMPACT_MARKER,
+    CompactSerializer,
+    JsonSerializer,
+    decode_cache_value,
+    get_serializer,
+)
+
+STEP = "a" * 64
+
+
+def build_values(**kwargs):
+    values = {
+        "thread": "onboarding",
+        "step": STEP,
+        "guild_id": 799328534988193793,
+        "message_id": "",
+        "metadata": {"guild_name": "govrn"},
+    }
+    values.update(kwargs)
+    return values
+
+
+@pytest.mark.parametrize(
+    "values",
+    [
+        build_values(),
+        build_values(thread="some_new_thread", step="not-a-hash"),
+        build_values(guild_id=None, message_id=906323512348672041),
+        build_values(metadata={"daos": {str(i): f"dao {i}" for i in range(50)}}),
+        {"thread": "report", "step": STEP, "guild_id": 1, "message_id": ""},
+    ],
+)
+def test_compact_round_trip(values):
+    encoded = CompactSerializer().encode(values)
+    assert encoded[:1] == COMPACT_MARKER
+    assert decode_cache_value(encoded) == values
+
+
+def test_compact_is_smaller_than_json():
+    values = build_values(metadata={"daos": {str(i): f"dao {i}" for i in range(50)}})
+    compact = CompactSerializer().encode(values)
+    assert len(compact) < len(JsonSerializer().encode(values)) / 2
+
+
+def test_decode_legacy_json():
+    """
+    States written before serializers were pluggable still decode
+    """
+    values = build_values()
+    assert decode_cache_value(json.dumps(values)) == values
+    assert decode_cache_value(json.dumps(values).encode()) == values
+
+
+def test_unknown_serializer():
+    with pytest.raises(Exception):
+        get_serializer("pickle")
@@ -0,0 +1,59 @@
+import asyncio
+import json
+import pytest
+
+from bot.common.tracing import NULL_SPAN, Tracer
+
+
+def read_spans(path):
+    with open(path) as f:
+        return {span["name"]: span for span in map(json.loads, f)}
+
+
+def attributes(span):
+    return {a["key"]: a["value"]["stringValue"] for a in span["attributes"]}
+
+
+@pytest.mark.asyncio
+async def test_spans_nest_and_propagate(tmp_path):
+    path = tmp_path / "traces.jsonl"
+    tracer = Tracer(True, "file", path, "test")
+
+    async def call(name):
+        with tracer.span(name):
+            await asyncio.sleep(0)
+
+    with tracer.span("event", user_id=1, other="x"):
+        with tracer.span("step", step="first"):
+            await asyncio.gather(call("redis.GET"), call("airtable.find_user"))
+        assert not path.exists()
+
+    spans = read_spans(path)
+    event, step = spans["event"], spans["step"]
+    assert "parentSpanId" not in event
+    assert step["parentSpanId"] == event["spanId"]
+    for name in ("redis.GET", "airtable.find_user"):
+        assert spans[name]["parentSpanId"] == step["spanId"]
+        assert spans[name]["traceId"] == event["traceId"]
+        assert attributes(spans[name]) == {
+            "user_id": "1",
+            "step": "first",
+            "service.name": "test",
+        }
+
+
+def test_span_records_error(tmp_path):
+    path = tmp_path / "traces.jsonl"
+    tracer = Tracer(True, "file", path, "test")
+    with pytest.raises(ValueError):
+        with tracer.span("event"):
+            raise ValueError("bad")
+    assert read_spans(path)["event"]["status"]["code"] == 2
+
+
+def test_disabled_tracer_records_nothing(tmp_path):
+    tracer = Tracer(False, "file", tmp_path / "traces.jsonl")
+    assert tracer.span("event", user_id=1) is NULL_SPAN
+    with tracer.span("event"):
+        pass
+    assert not (tmp_path / "traces.jsonl").exists()
@@ -0,0 +1,68 @@
+import pytest
+
+from bot.common import writes
+from unittest.mock import AsyncMock, MagicMock
+
+
+@pytest.mark.asyncio
+async def test_update_user_fields_batches_records(mocker):
+    find_user = mocker.patch(
+        "bot.common.airtable.find_user",
+        new=AsyncMock(side_effect=lambda user_id, guild_id: f"rec{user_id}"),
+    )
+    table = MagicMock()
+    mocker.patch("bot.common.airtable.Table", return_value=table)
+
+    await writes.update_user_fields(
+        [
+            {"user_id": 1, "guild_id": 2, "fields": {"twitter": "a"}},
+            {"user_id": 3, "guild_id": 2, "fields": {"twitter": "b"}},
+            {"user_id": 1, "guild_id": 2, "fields": {"wallet": "c", "twitter": "d"}},
+        ]
+    )
+    assert find_user.await_count == 2
+    table.batch_update.assert_called_once_with(
+        [
+            {"id": "rec1", "fields": {"twitter": "d", "wallet": "c"}},
+            {"id": "rec3", "fields": {"twitter": "b"}},
+        ]
+    )
+
+
+@pytest.mark.asyncio
+async def test_update_user_fields_without_record(mocker):
+    mocker.patch("bot.common.airtable.find_user", new=AsyncMock(return_value=""))
+    table = MagicMock()
+    mocker.patch("bot.common.airtable.Table", return_value=table)
+
+    with pytest.raises(Exception):
+        await writes.update_user_fields(
+            [{"user_id": 1, "guild_id": 2, "fields": {"twitter": "a"}}]
+        )
+    table.batch_update.assert_not_called()
+
+
+@pytest.mark.asyncio
+async def test_writes_are_queued_per_user(mocker):
+    mocker.patch("bot.common.writes.AIRTABLE_WORKER", True)
+    enqueue = mocker.patch("bot.common.writes.airtable_queue.enqueue", new=AsyncMock())
+    await writes.save_user_fields(1, 2, {"twitter": "a"})
+    enqueue.assert_awaited_once_with(
+        "update_user_fields", 1, user_id=1, guild_id=2, fields={"twitter": "a"}
+    )
+
+
+@pytest.mark.asyncio
+async def test_save_contribution_user_skips_completed(mocker):
+    mocker.patch("bot.common.writes.AIRTABLE_WORKER", True)
+    enqueue = mocker.patch("bot.common.writes.airtable_queue.enqueue", new=AsyncMock())
+    completed = mocker.patch(
+        "bot.common.writes.contributions.has_completed",
+        new=AsyncMock(side_effect=[False, True]),
+    )
+    await writes.save_contribution_user(1, 2, 3)
+    await writes.save_contribution_user(1, 2, 3)
+    completed.assert_awaited_with(2, 1, 3)
+    enqueue.assert_awaited_once_with(
+        "add_user_to_contribution", 1, user_id=1, guild_id=2, order=3
+    )
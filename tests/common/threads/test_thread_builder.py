@@ -1,9 +1,23 @@
 import pytest
 import hashlib
-import json
 
-from bot.common.threads.thread_builder import BaseThread, Step, BaseStep, StepKeys
-from tests.test_utils import MockCache
+from bot.common.keys import build_thread_key
+from bot.common.threads.thread_builder import (
+    BaseThread,
+    Step,
+    BaseStep,
+    StepKeys,
+    HashStateStore,
+    StringStateStore,
+    THREADS,
+    ThreadKeys,
+    ThreadState,
+    build_cache_value,
+    get_thread,
+    get_thread_class,
+    get_thread_ttl,
+)
+from tests.test_utils import MockBot, MockCache
 from unittest.mock import MagicMock, AsyncMock
 
 
@@ -250,7 +264,7 @@ async def test_thread_send_previous_step_no_skip():
         current_step=root_hash,
         message_id="",
         guild_id="",
-        discord_bot=AsyncMock(),
+        discord_bot=MockBot(),
         cache=cache,
     )
     hash_ = thread.step.get_next_step("emoji").hash_
@@ -259,7 +273,7 @@ async def test_thread_send_previous_step_no_skip():
         current_step=hash_,
         message_id="",
         guild_id="",
-        discord_bot=AsyncMock(),
+        discord_bot=MockBot(),
         cache=cache,
     )
 
@@ -301,7 +315,7 @@ async def test_thread_send_previous_step_skip(mocker):
         current_step=root_hash,
         message_id="",
         guild_id="",
-        discord_bot=AsyncMock(),
+        discord_bot=MockBot(),
     )
     await thread.handle_reaction(MagicMock(message_id=""), "")
     assert saved is False
@@ -346,7 +360,7 @@ async def test_thread_send_no_previous_step_skip(mocker):
         current_step=root_hash,
         message_id="",
         guild_id="",
-        discord_bot=AsyncMock(),
+        discord_bot=MockBot(),
     )
     hash_ = thread.step.get_next_step("emoji").hash_
     second_step = await MockThread(
@@ -355,7 +369,7 @@ async def test_thread_send_no_previous_step_skip(mocker):
         message_id="",
         guild_id="",
         cache=cache,
-        discord_bot=AsyncMock(),
+        discord_bot=MockBot(),
     )
 
     await second_step.handle_reaction(MagicMock(message_id=""), "")
@@ -405,7 +419,7 @@ async def test_thread_metadata_none(mocker):
         current_step=root_hash,
         message_id="",
         guild_id="",
-        discord_bot=AsyncMock(),
+        discord_bot=MockBot(),
         cache=cache,
     )
     await thread.send(AsyncMock(message_id="", id="1"))
@@ -416,11 +430,11 @@ async def test_thread_metadata_none(mocker):
         current_step=hash_,
         message_id="",
         guild_id="",
-        discord_bot=AsyncMock(),
+        discord_bot=MockBot(),
         cache=cache,
     )
     await t2.send(AsyncMock(message_id="", id="1"))
-    assert json.loads(await cache.get("1")).get("metadata") == {"example": 0}
+    assert (await cached_values(cache)).get("metadata") == {"example": 0}
 
 
 @pytest.mark.asyncio
@@ -465,7 +479,7 @@ async def test_thread_metadata_set(mocker):
         current_step=root_hash,
         message_id="",
         guild_id="",
-        discord_bot=AsyncMock(),
+        discord_bot=MockBot(),
         cache=cache,
     )
     await thread.send(AsyncMock(message_id="", id="1"))
@@ -476,11 +490,11 @@ async def test_thread_metadata_set(mocker):
         current_step=hash_,
         message_id="",
         guild_id="",
-        discord_bot=AsyncMock(),
+        discord_bot=MockBot(),
         cache=cache,
     )
     await t2.send(AsyncMock(message_id="", id="1"))
-    assert json.loads(await cache.get("1")).get("metadata") == {"example": 2}
+    assert (await cached_values(cache)).get("metadata") == {"example": 2}
 
 
 @pytest.mark.asyncio
@@ -528,11 +542,11 @@ async def test_thread_control_hook_end(mocker):
         current_step=root_hash,
         message_id="",
         guild_id="",
-        discord_bot=AsyncMock(),
+        discord_bot=MockBot(),
         cache=cache,
     )
     await thread.send(AsyncMock(message_id="", id="1"))
-    assert json.loads(await cache.get("1")) is not None
+    assert (await cached_values(cache)) is not None
 
     hash_ = thread.step.get_next_step("send").hash_
     t2 = await MockThread(
@@ -540,11 +554,11 @@ async def test_thread_control_hook_end(mocker):
         current_step=hash_,
         message_id="",
         guild_id="",
-        discord_bot=AsyncMock(),
+        discord_bot=MockBot(),
         cache=cache,
     )
     await t2.send(AsyncMock(message_id="", id="1"))
-    assert await cache.get("1") is None
+    assert await cache.get(build_thread_key("1")) is None
 
 
 @pytest.mark.asyncio
@@ -597,7 +611,7 @@ async def test_thread_override_step_and_step(mocker):
         current_step=root_hash,
         message_id="",
         guild_id="",
-        discord_bot=AsyncMock(),
+        discord_bot=MockBot(),
         cache=cache,
     )
     await thread.send(AsyncMock(message_id="", id="1"))
@@ -608,7 +622,7 @@ async def test_thread_override_step_and_step(mocker):
         current_step=hash_,
         message_id="",
         guild_id="",
-        discord_bot=AsyncMock(),
+        discord_bot=MockBot(),
         cache=cache,
     )
     await t2.send(AsyncMock(message_id="", id="1"))
@@ -663,7 +677,7 @@ async def test_thread_trigger(mocker):
         current_step=root_hash,
         message_id="",
         guild_id="",
-        discord_bot=AsyncMock(),
+        discord_bot=MockBot(),
         cache=cache,
     )
     await thread.send(AsyncMock(message_id="", id="1"))
@@ -674,8 +688,309 @@ async def test_thread_trigger(mocker):
         current_step=hash_,
         message_id="",
         guild_id="",
-        discord_bot=AsyncMock(),
+        discord_bot=MockBot(),
         cache=cache,
     )
     await t2.send(AsyncMock(message_id="", id="1"))
     assert third_step is True
+
+
+@pytest.mark.asyncio
+async def test_thread_handle_interaction():
+    """
+    Picking a prompt component moves on like a reaction with its emoji
+    """
+    chosen = []
+
+    class ChoiceLogic(BaseStep):
+        name = "choice"
+        emoji = True
+
+        async def send(self, message, user_id):
+            return message, None
+
+        async def handle_emoji(self, raw_reaction):
+            chosen.append((raw_reaction.emoji.name, raw_reaction.message_id))
+            return "next", False
+
+    class NextLogic(BaseStep):
+        name = "next"
+
+        async def send(self, message, user_id):
+            return MagicMock(id=3), None
+
+    class MockThread(BaseThread):
+        name = "thread"
+
+        async def get_steps(self):
+            return (
+                Step(current=ChoiceLogic())
+                .add_next_step(NextLogic())
+                .add_next_step(MockLogic())
+                .build()
+            )
+
+    cache = MockCache()
+    thread = await MockThread(
+        user_id="1",
+        current_step=get_root_hash(),
+        message_id=2,
+        guild_id="",
+        discord_bot=MockBot(),
+        cache=cache,
+    )
+    interaction = MagicMock(channel_id=5)
+    interaction.message.id = 2
+    interaction.channel = AsyncMock()
+    await thread.handle_interaction(interaction, "\U0001F44D")
+
+    assert chosen == [("\U0001F44D", 2)]
+    values = await cached_values(cache)
+    assert values["step"] == thread.step.get_next_step("mock_logic").hash_
+    assert values["message_id"] == 3
+
+
+@pytest.mark.asyncio
+async def test_thread_write_behind_queues_save(mocker):
+    """
+    In write behind mode the previous step is saved by a job
+    """
+    saved = []
+
+    class SaveLogic(BaseStep):
+        name = "save"
+
+        async def send(self, message, user_id):
+            return MagicMock(id=2), {"field": "twitter"}
+
+        async def save(self, message, guild_id, user_id):
+            saved.append(message.content)
+
+    class NextLogic(BaseStep):
+        name = "next"
+
+        async def send(self, message, user_id):
+            return MagicMock(id=3), None
+
+    class MockThread(BaseThread):
+        name = "thread"
+
+        async def get_steps(self):
+            return (
+                Step(current=SaveLogic())
+                .add_next_step(NextLogic())
+                .add_next_step(MockLogic())
+                .build()
+            )
+
+    mocker.patch("bot.common.threads.thread_builder.WRITE_BEHIND", True)
+    enqueue = mocker.patch(
+        "bot.common.threads.thread_builder.queue.enqueue", new=AsyncMock()
+    )
+    cache = MockCache()
+    thread = await MockThread(
+        user_id="1",
+        current_step=get_root_hash(),
+        message_id="",
+        guild_id="2",
+        discord_bot=MockBot(),
+        cache=cache,
+    )
+    await thread.send(MagicMock())
+    thread = await MockThread(
+        user_id="1",
+        current_step=thread.step.get_next_step("next").hash_,
+        message_id=2,
+        guild_id="2",
+        discord_bot=MockBot(),
+        cache=cache,
+    )
+    await thread.send(MagicMock(id=4, content="@kevin", author=MagicMock(id=1)))
+
+    assert saved == []
+    name, key = enqueue.await_args.args
+    kwargs = enqueue.await_args.kwargs
+    assert (name, key) == ("save_step", "1")
+    assert kwargs["values"]["step"] == get_root_hash()
+    assert kwargs["values"]["thread"] == "thread"
+    assert kwargs["values"]["metadata"] == {"field": "twitter"}
+    assert kwargs["message"]["content"] == "@kevin"
+    assert kwargs["message"]["author"] == {"id": 1}
+
+
+# Test thread state #
+
+
+KEY = build_thread_key("1")
+
+
+async def cached_values(cache, user_id="1"):
+    return (await ThreadState(cache, user_id).load()).values
+
+
+@pytest.mark.asyncio
+async def test_thread_state_loads_once():
+    """
+    Steps read the state from memory after it has been loaded
+    """
+    cache = MockCache()
+    await cache.compare_and_set(
+        KEY, build_cache_value("thread", get_root_hash(), "", metadata={"a": 1})
+    )
+    cache.get_hash = AsyncMock(wraps=cache.get_hash)
+
+    state = await ThreadState(cache, "1").load()
+    await state.load()
+    assert state.metadata == {"a": 1}
+    assert cache.get_hash.await_count == 1
+
+
+@pytest.mark.asyncio
+async def test_thread_state_flush_writes_once():
+    """
+    Only write to the cache when the state was changed
+    """
+    cache = MockCache()
+    state = await ThreadState(cache, "1").load()
+    assert await state.flush() is True
+    assert cache.versions == {}
+
+    state.set("thread", get_root_hash(), "")
+    state.set_metadata({"a": 1})
+    await state.flush()
+    assert cache.versions == {KEY: 1}
+    assert (await cached_values(cache)).get("metadata") == {"a": 1}
+
+
+@pytest.mark.asyncio
+async def test_thread_state_flush_retries_on_version_bump():
+    """
+    Retry the write if the version changed but the step did not
+    """
+    cache = MockCache()
+    root_hash = get_root_hash()
+    await cache.compare_and_set(KEY, build_cache_value("thread", root_hash, ""))
+    state = await ThreadState(cache, "1").load()
+    # Another writer touches the state without moving the conversation
+    await cache.compare_and_set(
+        KEY, build_cache_value("thread", root_hash, "", metadata={"a": 1})
+    )
+
+    state.set("thread", "next", "")
+    assert await state.flush() is True
+    assert (await cached_values(cache)).get("step") == "next"
+    assert state.version == 3
+
+
+@pytest.mark.asyncio
+async def test_thread_state_flush_drops_stale_update():
+    """
+    Do not overwrite the state if another writer moved the conversation
+    """
+    cache = MockCache()
+    await cache.compare_and_set(KEY, build_cache_value("thread", get_root_hash(), ""))
+    state = await ThreadState(cache, "1").load()
+    await cache.compare_and_set(KEY, build_cache_value("thread", "other", ""))
+
+    state.set("thread", "next", "")
+    assert await state.flush() is False
+    assert (await cached_values(cache)).get("step") == "other"
+
+
+@pytest.mark.asyncio
+async def test_thread_state_expiry():
+    """
+    The state expires per thread type and is refreshed on activity
+    """
+    cache = MockCache()
+    state = await ThreadState(cache, "1").load()
+    state.set("points", get_root_hash(), "")
+    await state.flush()
+    assert cache.ttls[KEY] == get_thread_ttl("points")
+
+    cache.ttls[KEY] = 10
+    state = await ThreadState(cache, "1").load()
+    await state.flush()
+    assert cache.ttls[KEY] == get_thread_ttl("points")
+    assert get_thread_ttl("unknown") == get_thread_ttl("default")
+
+
+@pytest.mark.asyncio
+async def test_hash_state_store_writes_changed_fields():
+    """
+    Only the fields that changed are written to the hash
+    """
+    cache = MockCache()
+    state = ThreadState.new(cache, "1", HashStateStore(cache))
+    state.set("thread", get_root_hash(), 1, metadata={"a": 1, "b": 2})
+    await state.flush()
+    assert set(cache.internal[KEY]) == {
+        "thread",
+        "step",
+        "guild_id",
+        "message_id",
+        "metadata.a",
+        "metadata.b",
+    }
+
+    cache.compare_and_set_hash = AsyncMock(wraps=cache.compare_and_set_hash)
+    state = await ThreadState(cache, "1", HashStateStore(cache)).load()
+    state.set_metadata({"a": 1, "c": 3})
+    await state.flush()
+    args = cache.compare_and_set_hash.await_args
+    assert args.args[1:] == ({"metadata.c": "3"}, ["metadata.b"])
+    assert (await cached_values(cache))["metadata"] == {"a": 1, "c": 3}
+
+
+@pytest.mark.asyncio
+async def test_hash_state_store_reads_string_state():
+    """
+    States stored as a single value are read and converted to a hash
+    """
+    cache = MockCache()
+    state = ThreadState.new(cache, "1", StringStateStore(cache))
+    state.set("thread", get_root_hash(), 1, metadata={"a": 1})
+    await state.flush()
+    assert not isinstance(cache.internal[KEY], dict)
+
+    state = await ThreadState(cache, "1", HashStateStore(cache)).load()
+    assert state.metadata == {"a": 1}
+    state.set_metadata({"a": 2})
+    await state.flush()
+    assert cache.internal[KEY]["metadata.a"] == "2"
+    assert (await cached_values(cache)) == {
+        "thread": "thread",
+        "step": get_root_hash(),
+        "guild_id": 1,
+        "message_id": "",
+        "metadata": {"a": 2},
+    }
+
+
+# Test thread registry #
+def test_thread_registry_imports_every_thread():
+    for key in ThreadKeys:
+        cls = get_thread_class(key.value)
+        assert issubclass(cls, BaseThread)
+        assert cls.name == key.value
+
+
+def test_thread_registry_unknown_thread():
+    with pytest.raises(Exception):
+        get_thread_class("unknown")
+
+
+@pytest.mark.asyncio
+async def test_get_thread_builds_registered_thread(mocker):
+    mocker.patch.dict(THREADS, {"multi": MultiThread})
+    cache = MockCache()
+    step = hashlib.sha256(f"{get_root_hash()}{MockLogic.name}".encode()).hexdigest()
+    thread = await get_thread(
+        1,
+        {"thread": "multi", "step": step, "message_id": "2", "guild_id": 3},
+        state=ThreadState.new(cache, 1),
+    )
+    assert isinstance(thread, MultiThread)
+    assert thread.step.hash_ == step
+    assert thread.cache is cache
+    assert (thread.message_id, thread.guild_id) == ("2", 3)
@@ -0,0 +1,13 @@
+from bot.config import LazyClient
+from unittest.mock import MagicMock
+
+
+def test_lazy_client_builds_on_first_use():
+    build = MagicMock()
+    client = LazyClient(build)
+    build.assert_not_called()
+
+    client.get("key")
+    client.set("key", "value")
+    build.assert_called_once_with()
+    build.return_value.get.assert_called_once_with("key")
@@ -1,17 +1,70 @@
 from bot.common.cache import Cache
+from unittest.mock import AsyncMock, MagicMock
+
+
+def MockBot():
+    """A discord bot whose gateway cache is empty"""
+    bot = AsyncMock()
+    bot.get_user = MagicMock(return_value=None)
+    bot.get_channel = MagicMock(return_value=None)
+    bot.get_guild = MagicMock(return_value=None)
+    bot.cached_messages = []
+    return bot
 
 
 # Add in memory implementation
 class MockCache(Cache):
     def __init__(self):
         self.internal = {}
+        self.versions = {}
+        self.ttls = {}
 
     async def get(self, key):
         return self.internal.get(key)
 
-    async def set(self, key, value):
+    async def set(self, key, value, ex=None):
         self.internal[key] = value
+        self.ttls[key] = ex
 
     async def delete(self, key):
         if self.internal.get(key):
             del self.internal[key]
+        self.versions[key] = self.versions.get(key, 0) + 1
+
+    async def expire(self, key, seconds):
+        self.ttls[key] = seconds
+
+    async def get_versioned(self, key):
+        return self.internal.get(key), self.versions.get(key, 0)
+
+    async def compare_and_set(self, key, value, version=None, ex=None):
+        current = self.versions.get(key, 0)
+        if version is not None and version != current:
+            return None
+        self.internal[key] = value
+        self.versions[key] = current + 1
+        self.ttls[key] = ex
+        return self.versions[key]
+
+    async def get_hash(self, key):
+        value = self.internal.get(key)
+        if isinstance(value, dict):
+            value = dict(value)
+        return value, self.versions.get(key, 0)
+
+    async def compare_and_set_hash(
+        self, key, fields, removed=(), version=None, ex=None, replace=False
+    ):
+        current = self.versions.get(key, 0)
+        if version is not None and version != current:
+            return None
+        value = self.internal.get(key)
+        if replace or not isinstance(value, dict):
+            value = {}
+        value.update(fields)
+        for field in removed:
+            value.pop(field, None)
+        self.internal[key] = value
+        self.versions[key] = current + 1
+        self.ttls[key] = ex
+        return self.versions[key]